@@ -0,0 +1,826 @@
+"""
+Assigns aircraft and pilots to flights. Run with:
+    python assignment.py [--db table.db] [--departure-after 2024-01-01] [--departure-before 2024-02-01]
+                         [--reassign] [--pilots-per-flight 1] [--no-local-search] [--dry-run]
+By default only flights without a valid aircraft or short of pilots are given them; with --reassign every selected
+flight is assigned from scratch. An aircraft or pilot can't fly two flights at once and must depart from where its
+previous flight landed, and as few of them as possible are used
+"""
+import argparse
+import heapq
+import itertools
+import json
+import sqlite3
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from typing import Callable, Iterable, Optional
+
+import util
+from database import db_flight_query
+from database import db_initialisation
+
+# Event kinds in the order events at the same time are handled. Landing exactly as the next flight departs is
+# allowed, so resources become available before anything departs
+_AVAILABLE = 0
+_LEAVE = 1
+_ASSIGN = 2
+
+# Resources with time for a detour looked at for one that can fly straight back from its destination
+_DETOUR_LOOKAHEAD = 8
+
+# Passes over the resources swapping flights to get them back for flights they keep. Swaps made for one resource
+# can open up swaps for others, but rarely after a couple of passes
+_REPAIR_PASSES = 3
+
+# Available since before any flight, for resources that have never flown
+_ALWAYS = -(2 ** 63)
+
+# (flight ID, source, destination, departure, arrival, has a valid aircraft, number of valid pilots) of the
+# flights selected by a query
+_TARGETS_SQL = """
+SELECT t.id, t.source_id, t.destination_id, t.departure_time, t.arrival_time,
+    t.aircraft_id IN (SELECT id FROM aircraft),
+    (SELECT COUNT() FROM pilot_flights JOIN pilots ON pilots.id = pilot_flights.pilot_id
+        WHERE pilot_flights.flight_id = t.id)
+FROM ({}) AS t
+"""
+
+
+class ResourceType(Enum):
+    AIRCRAFT = 1
+    PILOT = 2
+
+    def get_name(self) -> str:
+        if self == ResourceType.AIRCRAFT:
+            return "Aircraft"
+        elif self == ResourceType.PILOT:
+            return "Pilot"
+
+    def get_plural(self) -> str:
+        if self == ResourceType.AIRCRAFT:
+            return "aircraft"
+        elif self == ResourceType.PILOT:
+            return "pilots"
+
+    def get_table(self) -> str:
+        if self == ResourceType.AIRCRAFT:
+            return "aircraft"
+        elif self == ResourceType.PILOT:
+            return "pilots"
+
+    def get_schedule_sql(self) -> str:
+        """
+        Returns a query selecting (resource ID, flight ID, source, destination, departure, arrival) of the flights
+        of every existing resource departing between two times ordered by departure
+        """
+        if self == ResourceType.AIRCRAFT:
+            return ("SELECT aircraft.id, flights.id, flights.source_id, flights.destination_id, "
+                    "flights.departure_time, flights.arrival_time "
+                    "FROM flights JOIN aircraft ON aircraft.id = flights.aircraft_id "
+                    "WHERE flights.departure_time BETWEEN ? AND ? ORDER BY flights.departure_time")
+        elif self == ResourceType.PILOT:
+            return ("SELECT pilot_flights.pilot_id, flights.id, flights.source_id, flights.destination_id, "
+                    "flights.departure_time, flights.arrival_time "
+                    "FROM flights JOIN pilot_flights ON pilot_flights.flight_id = flights.id "
+                    "JOIN pilots ON pilots.id = pilot_flights.pilot_id "
+                    "WHERE flights.departure_time BETWEEN ? AND ? ORDER BY flights.departure_time")
+
+    def get_neighbour_sql(self, before: bool) -> str:
+        """
+        Returns a query selecting (resource ID, flight ID, source, destination, departure, arrival) of the last
+        flight of every resource departing before a time (or the first departing after it)
+        """
+        comparison, order = ("<", "DESC") if before else (">", "ASC")
+        if self == ResourceType.AIRCRAFT:
+            nearest = (f"SELECT id FROM flights WHERE aircraft_id = aircraft.id AND departure_time {comparison} ? "
+                       f"ORDER BY departure_time {order} LIMIT 1")
+        else:  # self == ResourceType.PILOT
+            nearest = (f"SELECT flights.id FROM pilot_flights JOIN flights ON flights.id = pilot_flights.flight_id "
+                       f"WHERE pilot_flights.pilot_id = pilots.id AND flights.departure_time {comparison} ? "
+                       f"ORDER BY flights.departure_time {order} LIMIT 1")
+        table = self.get_table()
+        return (f"SELECT {table}.id, f.id, f.source_id, f.destination_id, f.departure_time, f.arrival_time "
+                f"FROM {table} JOIN flights AS f ON f.id = ({nearest})")
+
+
+@dataclass(frozen=True)
+class Leg:
+    """Class representing a flight as the solver sees it (times are database times)"""
+    flight_id: int
+    source_id: int
+    destination_id: int
+    departure: int
+    arrival: int
+
+
+def _follows(previous: Optional[Leg], leg: Optional[Leg]) -> bool:
+    """Returns True if something that flew previous (None if nothing) can fly leg (None if nothing) next"""
+    return previous is None or leg is None or (
+        previous.arrival <= leg.departure and previous.destination_id == leg.source_id
+        and previous.flight_id != leg.flight_id
+    )
+
+
+@dataclass
+class _Resource:
+    resource_id: int
+    # Last flight before and first flight after the solved window
+    before: Optional[Leg] = None
+    after: Optional[Leg] = None
+    # Every flight in the window ordered by departure (once solved) and the IDs of the ones it already had
+    timeline: list[Leg] = field(default_factory=list)
+    kept: set[int] = field(default_factory=set)
+    # Flights in the window it had that are being reassigned
+    replaced: list[Leg] = field(default_factory=list)
+    # Changed whenever the resource moves so that its stale entries in the pools can be spotted
+    token: int = 0
+    # Whether it already couldn't fly all its flights before solving (which is left to the integrity check)
+    broken: bool = False
+    # Whether it was put back to the flights it had and isn't given any others
+    fixed: bool = False
+
+    def is_used(self) -> bool:
+        return len(self.timeline) > 0
+
+    def neighbours(self, departure: int) -> tuple[int, Optional[Leg], Optional[Leg]]:
+        """Returns (timeline position, flight before, flight after) of a flight departing at a time"""
+        position = bisect_right(self.timeline, departure, key=lambda leg: leg.departure)
+        previous = self.timeline[position - 1] if position > 0 else self.before
+        following = self.timeline[position] if position < len(self.timeline) else self.after
+        return position, previous, following
+
+    def can_be_emptied(self) -> bool:
+        """Returns True if the resource could give away all its flights and still make its next flight"""
+        return len(self.kept) == 0 and _follows(self.before, self.after)
+
+
+@dataclass
+class AssignmentResult:
+    """Class representing the assignments found for one type of resource"""
+    resource_type: ResourceType
+    # (flight ID, resource ID) of every new assignment, and of the resources a reassigned flight given new ones keeps
+    assignments: list[tuple[int, int]] = field(default_factory=list)
+    # Flights that couldn't be given all the resources they need (they are given none, and keep any they had if
+    # reassigning)
+    unassigned: list[int] = field(default_factory=list)
+    # Resources that could fly all their flights before but now can't get to one they keep in time
+    stranded: list[int] = field(default_factory=list)
+    # Resources flying in the solved window after the greedy pass and after local search
+    used_greedy: int = 0
+    used: int = 0
+
+    def to_string(self) -> str:
+        """Converts the result to a user-readable summary"""
+        name = self.resource_type.get_plural()
+        s = f"{len(self.assignments)} {self.resource_type.get_name().lower()} assignment(s) using {self.used} {name}"
+        if self.used != self.used_greedy:
+            s += f" ({self.used_greedy - self.used} freed by local search)"
+        if len(self.unassigned) > 0:
+            s += f", {len(self.unassigned)} flight(s) couldn't be assigned"
+        if len(self.stranded) > 0:
+            s += f", {len(self.stranded)} {name} can't reach their next flight"
+        return s
+
+
+class _Pools:
+    """
+    Resources waiting at each location (None for resources that have never flown and can start anywhere). Free
+    resources are kept in stacks so the most recently landed is reused first. Resources that must be somewhere by a
+    time (for a flight they keep) are kept in heaps, latest deadline first, both by where they must be (to find ones
+    a flight takes straight there) and altogether (to find ones with time for a detour)
+    """
+    def __init__(self, legs: list[Leg]):
+        self.free: dict[tuple[Optional[int], bool], list[tuple[int, _Resource]]] = {}
+        # Keyed by (location, deadline location, used) and by (location, used, deadline away from the location)
+        self.bounded_to: dict[tuple[Optional[int], int, bool], list[tuple[int, int, int, _Resource, Leg]]] = {}
+        self.bounded: dict[tuple[Optional[int], bool, bool], list[tuple[int, int, int, _Resource, Leg]]] = {}
+        self.sequence = itertools.count()
+        # (departures, earliest arrival of the flights departing from each on) of the flights between two locations
+        self.routes: dict[tuple[int, int], tuple[list[int], list[int]]] = {}
+        for leg in sorted(legs, key=lambda leg: leg.departure):
+            departures, arrivals = self.routes.setdefault((leg.source_id, leg.destination_id), ([], []))
+            departures.append(leg.departure)
+            arrivals.append(leg.arrival)
+        for _, arrivals in self.routes.values():
+            for i in range(len(arrivals) - 2, -1, -1):
+                arrivals[i] = min(arrivals[i], arrivals[i + 1])
+
+    def add(self, resource: _Resource, location: Optional[int], deadline: Optional[Leg]):
+        resource.token += 1
+        used = resource.is_used()
+        if deadline is None:
+            self.free.setdefault((location, used), []).append((resource.token, resource))
+            return
+        entry = (-deadline.departure, next(self.sequence), resource.token, resource, deadline)
+        heapq.heappush(self.bounded_to.setdefault((location, deadline.source_id, used), []), entry)
+        heapq.heappush(self.bounded.setdefault((location, used, deadline.source_id != location), []), entry)
+
+    def _returns(self, leg: Leg, deadline: Leg) -> bool:
+        """Returns True if a flight lands in time to fly on (or one of the flights solved) to a deadline"""
+        if leg.destination_id == deadline.source_id:
+            return True
+        departures, arrivals = self.routes.get((leg.destination_id, deadline.source_id), ((), ()))
+        i = bisect_left(departures, leg.arrival)
+        return i < len(departures) and arrivals[i] <= deadline.departure
+
+    @staticmethod
+    def _pop(pool: list, is_heap: bool, leg: Leg) -> Optional[tuple]:
+        """Removes and returns the next entry of a pool able to fly a leg, dropping stale entries"""
+        while len(pool) > 0:
+            if is_heap:
+                if pool[0][2] == pool[0][3].token and -pool[0][0] < leg.arrival:
+                    return None  # Nothing left in the heap lands in time
+                entry = heapq.heappop(pool)
+                if entry[2] == entry[3].token:
+                    return entry
+            else:
+                entry = pool.pop()
+                if entry[0] == entry[1].token:
+                    return entry
+        return None
+
+    def take(self, leg: Leg, count: int) -> list[tuple[_Resource, Optional[Leg]]]:
+        """
+        Removes and returns count (resource, deadline) that can fly a leg, or returns nothing if there aren't
+        enough. Resources already flying are preferred, then resources at the leg's source, and among those ones
+        it takes where they must be, then free ones and then ones with time for a detour. Detours are given to
+        resources that can fly straight back in time if possible
+        """
+        taken = []
+        chosen = set()
+        popped = []  # (pool, entry, is a heap) to put back if the flight can't be given enough resources
+        spare = []  # Entries looked at but not taken, put back either way
+        for location in (leg.source_id, None):
+            for used in (True, False):
+                for pools, key, detour in [(self.bounded_to, (location, leg.destination_id, used), False),
+                                           (self.bounded, (location, used, True), True),
+                                           (self.free, (location, used), False),
+                                           (self.bounded, (location, used, False), True)]:
+                    pool = pools.get(key, [])
+                    is_heap = pools is not self.free
+                    entries = []
+                    while len(taken) + len(entries) < count + (_DETOUR_LOOKAHEAD if detour else 0):
+                        entry = self._pop(pool, is_heap, leg)
+                        if entry is None:
+                            break
+                        if entry[-2 if is_heap else 1].resource_id in chosen:
+                            popped.append((pool, entry, is_heap))
+                        else:
+                            entries.append(entry)
+                    if detour:
+                        entries.sort(key=lambda e: not self._returns(leg, e[4]))
+                    for entry in entries:
+                        resource, deadline = (entry[3], entry[4]) if is_heap else (entry[1], None)
+                        if len(taken) < count:
+                            chosen.add(resource.resource_id)
+                            taken.append((resource, deadline))
+                            popped.append((pool, entry, is_heap))
+                        else:
+                            spare.append((pool, entry, is_heap))
+
+        put_back = spare + (popped if len(taken) < count else [])
+        for pool, entry, is_heap in reversed(put_back):
+            if is_heap:
+                heapq.heappush(pool, entry)
+            else:
+                pool.append(entry)
+        if len(taken) < count:
+            # Resources only move once the whole flight can be given them
+            return []
+
+        for resource, _ in taken:
+            resource.token += 1
+        return taken
+
+
+def _load(conn: sqlite3.Connection, resource_type: ResourceType, targets: list[Leg],
+          replaced: set[int]) -> dict[int, _Resource]:
+    """
+    Returns every resource with its flights around the targets' departures. Its flights in the replaced set are
+    left out as they are being reassigned
+    """
+    start = min(leg.departure for leg in targets)
+    end = max(leg.departure for leg in targets)
+    resources = {row[0]: _Resource(row[0]) for row in conn.execute(f"SELECT id FROM {resource_type.get_table()}")}
+    for before, time in [(True, start), (False, end)]:
+        for resource_id, *leg in conn.execute(resource_type.get_neighbour_sql(before), (time,)):
+            if before:
+                resources[resource_id].before = Leg(*leg)
+            else:
+                resources[resource_id].after = Leg(*leg)
+
+    schedules: dict[int, list[Leg]] = {}
+    for resource_id, *leg in conn.execute(resource_type.get_schedule_sql(), (start, end)):
+        schedules.setdefault(resource_id, []).append(Leg(*leg))
+        resource = resources[resource_id]
+        if leg[0] in replaced:
+            resource.replaced.append(Leg(*leg))
+        else:
+            resource.timeline.append(Leg(*leg))
+            resource.kept.add(leg[0])
+    for resource in resources.values():
+        legs = schedules.get(resource.resource_id, [])
+        resource.broken = _break_in(resource.before, legs, resource.after) is not None
+    return resources
+
+
+def _assign_greedily(resources: dict[int, _Resource], targets: list[tuple[Leg, int]]) -> list[int]:
+    """
+    Gives flights (with the number of resources each needs) resources in departure order, sweeping through time
+    with every resource waiting in a pool from when it lands, and returns the flights that couldn't be given
+    them. Taking resources already flying first means new ones are only brought in when nothing else can fly
+    """
+    sequence = itertools.count()
+    events = []  # (time, kind, sequence, subject, location or count, deadline)
+    for resource in resources.values():
+        if resource.fixed:
+            continue
+        if resource.before is None:
+            events.append((_ALWAYS, _AVAILABLE, next(sequence), resource, None,
+                           resource.timeline[0] if resource.is_used() else resource.after))
+        else:
+            events.append((resource.before.arrival, _AVAILABLE, next(sequence), resource,
+                           resource.before.destination_id,
+                           resource.timeline[0] if resource.is_used() else resource.after))
+        # Flights it already can't fly one after another leave it on the ground only once all of them have landed
+        landed = None
+        for i, leg in enumerate(resource.timeline):
+            following = resource.timeline[i + 1] if i + 1 < len(resource.timeline) else resource.after
+            events.append((leg.departure, _LEAVE, next(sequence), resource, None, None))
+            if landed is None or leg.arrival >= landed.arrival:
+                landed = leg
+            if following is None or landed.arrival <= following.departure:
+                events.append((landed.arrival, _AVAILABLE, next(sequence), resource, landed.destination_id,
+                               following))
+    for leg, count in targets:
+        events.append((leg.departure, _ASSIGN, next(sequence), leg, count, None))
+    heapq.heapify(events)
+
+    pools = _Pools([leg for leg, _ in targets])
+    unassigned = []
+    while len(events) > 0:
+        _, kind, _, subject, value, deadline = heapq.heappop(events)
+        if kind == _AVAILABLE:
+            pools.add(subject, value, deadline)
+        elif kind == _LEAVE:
+            subject.token += 1
+        else:
+            taken = pools.take(subject, value)
+            if len(taken) == 0:
+                unassigned.append(subject.flight_id)
+            for resource, deadline in taken:
+                resource.timeline.append(subject)
+                heapq.heappush(events, (subject.arrival, _AVAILABLE, next(sequence), resource,
+                                        subject.destination_id, deadline))
+
+    for resource in resources.values():
+        resource.timeline.sort(key=lambda leg: leg.departure)
+    return unassigned
+
+
+def _index_arrivals(resources: dict[int, _Resource]) -> tuple[dict[int, set[int]], set[int]]:
+    """
+    Returns the IDs of the resources landing at each location at some point and of the resources that can start
+    anywhere. Callers add to the sets as flights move, so they may hold resources no longer landing there
+    """
+    arriving: dict[int, set[int]] = {}
+    anywhere = set()
+    for resource in resources.values():
+        if resource.before is None:
+            anywhere.add(resource.resource_id)
+        else:
+            arriving.setdefault(resource.before.destination_id, set()).add(resource.resource_id)
+        for leg in resource.timeline:
+            arriving.setdefault(leg.destination_id, set()).add(resource.resource_id)
+    return arriving, anywhere
+
+
+def _break_in(before: Optional[Leg], legs: list[Leg], after: Optional[Leg]) -> Optional[int]:
+    """
+    Returns the position of the first of a resource's flights it can't fly after the one before it (the number of
+    flights if it's the flight after them), or None if it can fly all of them
+    """
+    previous = before
+    for i, leg in enumerate(legs):
+        if not _follows(previous, leg):
+            return i
+        previous = leg
+    return None if _follows(previous, after) else len(legs)
+
+
+def _first_break(resource: _Resource) -> Optional[int]:
+    """Returns the timeline position of the first flight the resource can't fly (see _break_in)"""
+    return _break_in(resource.before, resource.timeline, resource.after)
+
+
+def _next_kept(resource: _Resource, position: int) -> int:
+    """Returns the position of the first flight the resource keeps from a position on (or the timeline's length)"""
+    while position < len(resource.timeline) and resource.timeline[position].flight_id not in resource.kept:
+        position += 1
+    return position
+
+
+def _swap_tails(resources: dict[int, _Resource], arriving: dict[int, set[int]], anywhere: set[int],
+                resource: _Resource, position: int) -> bool:
+    """
+    Tries to make a resource able to fly the kept flight at a timeline position (or the flight after the window) by
+    swapping the flights it was given before it for those another resource on the ground at the same place and
+    time was given before its next kept flight, and returns True if it did. The other resource must still make its
+    next kept flight, and the latest place to swap is tried first
+    """
+    start = position
+    while start > 0 and resource.timeline[start - 1].flight_id not in resource.kept:
+        start -= 1
+    need = resource.timeline[position] if position < len(resource.timeline) else resource.after
+
+    for p in range(position, start - 1, -1):
+        previous = resource.timeline[p - 1] if p > 0 else resource.before
+        if previous is None:
+            continue
+        location = previous.destination_id
+        # The other resource's flights from p on must depart after this resource lands, and it must land before
+        # this resource's flights from p on depart
+        until = resource.timeline[p].departure if p < position else need.departure
+        for other_id in itertools.chain(arriving.get(location, ()), anywhere):
+            other = resources[other_id]
+            if other is resource or other.broken:
+                continue
+            after_until = bisect_right(other.timeline, until, key=lambda leg: leg.departure)
+            for q in (after_until, after_until - 1):
+                if q < 0:
+                    continue
+                other_previous = other.timeline[q - 1] if q > 0 else other.before
+                if other_previous is not None and (other_previous.destination_id != location
+                                                   or other_previous.arrival > until):
+                    continue
+                end = _next_kept(other, q)
+                if end == q and p == position:
+                    continue
+                if end > q and (other.timeline[q].source_id != location
+                                or other.timeline[q].departure < previous.arrival):
+                    continue
+                other_need = other.timeline[end] if end < len(other.timeline) else other.after
+                last = other.timeline[end - 1] if end > q else previous
+                other_last = resource.timeline[position - 1] if position > p else other_previous
+                other_broken = not _follows(other.timeline[end - 1] if end > q else other_previous, other_need)
+                # A resource that already can't make its next kept flight can be left out of position, but not
+                # still in the air when it departs
+                other_fits = _follows(other_last, other_need) or (other_broken and (
+                    other_last is None or other_need is None or other_last.arrival <= other_need.departure))
+                if _follows(last, need) and other_fits:
+                    tail = resource.timeline[p:position]
+                    resource.timeline[p:position] = other.timeline[q:end]
+                    other.timeline[q:end] = tail
+                    for leg in resource.timeline[p:p + end - q]:
+                        arriving.setdefault(leg.destination_id, set()).add(resource.resource_id)
+                    for leg in tail:
+                        arriving.setdefault(leg.destination_id, set()).add(other.resource_id)
+                    return True
+    return False
+
+
+def _repair(resources: dict[int, _Resource]):
+    """
+    Detours taken in the greedy pass can leave resources unable to get back for flights they keep. Each such
+    resource swaps flights with others until it can fly all its kept flights or no swap helps. Resources that still
+    can't are reported rather than left without the flights, which would only leave the flights unassigned
+    """
+    arriving, anywhere = _index_arrivals(resources)
+    for _ in range(_REPAIR_PASSES):
+        changed = False
+        for resource in resources.values():
+            position = None if resource.broken else _first_break(resource)
+            while position is not None and _swap_tails(resources, arriving, anywhere, resource, position):
+                position = _first_break(resource)
+                changed = True
+        if not changed:
+            break
+
+
+def _improve(resources: dict[int, _Resource]):
+    """
+    Local search trying to free resources the greedy pass brought in, fewest flights first, by moving runs of their
+    flights into gaps in other resources' timelines that start and end in the right places. The longest run that
+    fits is moved each time, and a resource's flights are only moved if all of them fit somewhere
+    """
+    arriving, anywhere = _index_arrivals(resources)
+    candidates = sorted((r for r in resources.values() if r.is_used() and r.can_be_emptied()),
+                        key=lambda r: len(r.timeline))
+    for resource in candidates:
+        legs = resource.timeline
+        moves = []  # (receiving resource, position, number of flights)
+        i = 0
+        while i < len(legs):
+            start = legs[i]
+            best = None  # (last flight moved, receiving resource, position)
+            for receiver_id in itertools.chain(arriving.get(start.source_id, ()), anywhere):
+                receiver = resources[receiver_id]
+                if receiver is resource or not receiver.is_used() or receiver.fixed:
+                    continue
+                position, previous, following = receiver.neighbours(start.departure)
+                if not _follows(previous, start):
+                    continue
+                for j in range(i, len(legs)):
+                    if following is not None and legs[j].arrival > following.departure:
+                        break
+                    if _follows(legs[j], following) and (best is None or j > best[0]):
+                        best = (j, receiver, position)
+                if best is not None and best[0] == len(legs) - 1:
+                    break
+
+            if best is None:
+                break
+            last, receiver, position = best
+            receiver.timeline[position:position] = legs[i:last + 1]
+            moves.append((receiver, position, last + 1 - i))
+            for leg in legs[i:last + 1]:
+                arriving.setdefault(leg.destination_id, set()).add(receiver.resource_id)
+            i = last + 1
+
+        if i == len(legs):
+            resource.timeline = []
+        else:
+            for receiver, position, count in reversed(moves):
+                del receiver.timeline[position:position + count]
+
+
+def _trim(resource: _Resource, displace: Callable[[Leg], None]):
+    """
+    Takes away the flights a resource was given that it can no longer fly after the flight before it or before the
+    kept flight (or the flight after the window) following them
+    """
+    timeline: list[Leg] = []
+    for leg in itertools.chain(resource.timeline, [None]):
+        if leg is None or leg.flight_id in resource.kept:
+            following = resource.after if leg is None else leg
+            while (len(timeline) > 0 and timeline[-1].flight_id not in resource.kept
+                   and not _follows(timeline[-1], following)):
+                displace(timeline.pop())
+            if leg is not None:
+                timeline.append(leg)
+        elif _follows(timeline[-1] if len(timeline) > 0 else resource.before, leg):
+            timeline.append(leg)
+        else:
+            displace(leg)
+    resource.timeline = timeline
+
+
+def _restore(resources: dict[int, _Resource], flight_ids: set[int], displace: Callable[[Leg], None]):
+    """
+    Gives flights that couldn't be reassigned back to the resources they had as kept flights, taking away the flights
+    those resources were given that are in the air at the same time or that they can no longer fly around them
+    """
+    for resource in resources.values():
+        restored = sorted((leg for leg in resource.replaced if leg.flight_id in flight_ids),
+                          key=lambda leg: leg.departure)
+        if len(restored) == 0:
+            continue
+        resource.replaced = [leg for leg in resource.replaced if leg.flight_id not in flight_ids]
+
+        # Times the flights given back are in the air, merged so that only the last one starting before a flight
+        # lands can overlap it. A resource that already can't fly its flights in order may overlap anywhere
+        busy: list[list[int]] = []
+        for leg in restored:
+            if len(busy) > 0 and leg.departure < busy[-1][1]:
+                busy[-1][1] = max(busy[-1][1], leg.arrival)
+            else:
+                busy.append([leg.departure, leg.arrival])
+        starts = [start for start, _ in busy]
+        timeline = []
+        for leg in resource.timeline:
+            i = bisect_left(starts, leg.arrival) - 1
+            if leg.flight_id not in resource.kept and i >= 0 and busy[i][1] > leg.departure:
+                displace(leg)
+            else:
+                timeline.append(leg)
+
+        for leg in restored:
+            resource.kept.add(leg.flight_id)
+            timeline.insert(bisect_right(timeline, leg.departure, key=lambda other: other.departure), leg)
+        resource.timeline = timeline
+        _trim(resource, displace)
+
+
+def _withdraw(resources: dict[int, _Resource], flight_ids: set[int], displace: Callable[[Leg], None]):
+    """
+    Takes flights away from every resource given them, along with the flights those resources can then no longer
+    fly
+    """
+    for resource in resources.values():
+        if any(leg.flight_id in flight_ids and leg.flight_id not in resource.kept for leg in resource.timeline):
+            resource.timeline = [leg for leg in resource.timeline
+                                 if leg.flight_id not in flight_ids or leg.flight_id in resource.kept]
+            _trim(resource, displace)
+
+
+def _revert(resources: dict[int, _Resource], resource: _Resource, displaced: dict[int, tuple[Leg, int]],
+            displace: Callable[[Leg], None]):
+    """
+    Puts a resource back to the flights it had, taking them from whatever was given them in its place (or from the
+    displaced flights waiting to be placed again), and stops it being given any others. The flights it was given
+    instead and the flights the others can then no longer fly are taken away
+    """
+    originals = {leg.flight_id: leg for leg in resource.replaced}
+    kept = []
+    for leg in resource.timeline:
+        if leg.flight_id in resource.kept or leg.flight_id in originals:
+            kept.append(leg)
+        else:
+            displace(leg)
+    given = {leg.flight_id for leg in kept}
+    for flight_id in originals.keys() - given:
+        kept.append(originals[flight_id])
+        if flight_id in displaced:
+            leg, count = displaced.pop(flight_id)
+            if count > 1:
+                displaced[flight_id] = (leg, count - 1)
+            continue
+        # Otherwise one of the resources given the flight gives it up, which is all of them for aircraft
+        for other in resources.values():
+            if other is not resource and flight_id not in other.kept and any(
+                    leg.flight_id == flight_id for leg in other.timeline):
+                other.timeline = [leg for leg in other.timeline if leg.flight_id != flight_id]
+                _trim(other, displace)
+                break
+
+    resource.kept.update(originals)
+    resource.replaced = []
+    resource.timeline = sorted(kept, key=lambda leg: leg.departure)
+    resource.fixed = True
+
+
+def assign(conn: sqlite3.Connection, resource_type: ResourceType, targets: list[tuple[Leg, int]],
+           reassign: bool = False, local_search: bool = True) -> AssignmentResult:
+    """
+    Finds resources of a type for flights (with the number of resources each needs), keeping every other
+    assignment. If reassigning, the flights' current resources of the type are ignored, except for flights that
+    can't be given new ones, which keep them
+    """
+    result = AssignmentResult(resource_type)
+    targets = [(leg, count) for leg, count in targets if count > 0]
+    # Flights landing before they depart can't be flown
+    result.unassigned = [leg.flight_id for leg, _ in targets if leg.arrival < leg.departure]
+    targets = [(leg, count) for leg, count in targets if leg.arrival >= leg.departure]
+    if len(targets) == 0:
+        return result
+
+    replaced = {leg.flight_id for leg, _ in targets} if reassign else set()
+    resources = _load(conn, resource_type, [leg for leg, _ in targets], replaced)
+    unassigned = _assign_greedily(resources, targets)
+    _repair(resources)
+
+    # Flights that can't be reassigned keep their current resources, which were treated as free. They are given
+    # back, and only the flights pushed out by them are placed again. Flights that lose some of their resources and
+    # can't get them back lose the rest too, which can push out more flights and leave more to give back
+    displaced: dict[int, tuple[Leg, int]] = {}
+
+    def displace(leg: Leg):
+        displaced[leg.flight_id] = (leg, displaced.get(leg.flight_id, (leg, 0))[1] + 1)
+
+    _restore(resources, set(unassigned) & replaced, displace)
+    while True:
+        while len(displaced) > 0:
+            failed = set(_assign_greedily(resources, list(displaced.values())))
+            displaced.clear()
+            unassigned += failed
+            _withdraw(resources, failed, displace)
+            _restore(resources, failed & replaced, displace)
+        # A consistent schedule must stay consistent, so resources left unable to reach a flight they keep are put
+        # back to the flights they had, and only the flights that pushes out are placed again. Resources put back
+        # aren't given anything else, so this ends once none are left stranded
+        stranded = [r for r in resources.values() if not r.broken and not r.fixed and _first_break(r) is not None]
+        if len(stranded) == 0:
+            break
+        for resource in stranded:
+            _revert(resources, resource, displaced, displace)
+
+    result.used_greedy = sum(1 for r in resources.values() if r.is_used())
+    if local_search:
+        _improve(resources)
+    result.unassigned += unassigned
+    result.used = sum(1 for r in resources.values() if r.is_used())
+
+    # Reassigned flights given new resources have all of theirs written, including any put back to the ones they had
+    changed = {leg.flight_id for r in resources.values() for leg in r.timeline if leg.flight_id not in r.kept}
+    for resource in resources.values():
+        result.assignments += [(leg.flight_id, resource.resource_id) for leg in resource.timeline
+                               if leg.flight_id not in resource.kept
+                               or (leg.flight_id in changed and leg.flight_id in replaced)]
+        if not resource.broken and _first_break(resource) is not None:
+            result.stranded.append(resource.resource_id)
+    result.assignments.sort()
+    return result
+
+
+def solve(conn: sqlite3.Connection, query: db_flight_query.FlightQuery, reassign: bool = False,
+          pilots_per_flight: int = 1, local_search: bool = True) -> list[AssignmentResult]:
+    """
+    Finds aircraft and pilots for the flights matching a query. Only flights without a valid aircraft or with fewer
+    than pilots_per_flight valid pilots are given more unless reassigning, in which case every flight is
+    assigned from scratch
+    """
+    sql, arguments = query.sql(conn)
+    flights = conn.execute(_TARGETS_SQL.format(sql), arguments).fetchall()
+    results = []
+    for resource_type in ResourceType:
+        needed = 1 if resource_type == ResourceType.AIRCRAFT else pilots_per_flight
+        targets = []
+        for flight_id, source_id, destination_id, departure, arrival, has_aircraft, pilots in flights:
+            have = 0 if reassign else (has_aircraft if resource_type == ResourceType.AIRCRAFT else pilots)
+            if have < needed:
+                targets.append((Leg(flight_id, source_id, destination_id, departure, arrival), needed - have))
+        results.append(assign(conn, resource_type, targets, reassign, local_search))
+    return results
+
+
+def apply_assignments(conn: sqlite3.Connection, results: Iterable[AssignmentResult], reassign: bool = False):
+    """
+    Writes assignments to the database in a single savepoint (left for the caller to commit). If reassigning,
+    flights given new pilots lose their old ones. Results leaving any resource unable to reach its next flight are
+    refused, as writing them would break a schedule that could be flown
+    """
+    results = list(results)
+    for result in results:
+        if len(result.stranded) > 0:
+            raise ValueError(f"{len(result.stranded)} {result.resource_type.get_plural()} would be left unable to "
+                             f"reach their next flight")
+    conn.execute("SAVEPOINT assignment")
+    try:
+        for result in results:
+            if result.resource_type == ResourceType.AIRCRAFT:
+                conn.executemany("UPDATE flights SET aircraft_id = ? WHERE id = ?",
+                                 [(aircraft_id, flight_id) for flight_id, aircraft_id in result.assignments])
+            else:
+                if reassign:
+                    conn.execute("DELETE FROM pilot_flights WHERE flight_id IN (SELECT value FROM json_each(?))",
+                                 (json.dumps(sorted({flight_id for flight_id, _ in result.assignments})),))
+                conn.executemany("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)",
+                                 [(pilot_id, flight_id) for flight_id, pilot_id in result.assignments])
+    except BaseException:
+        conn.execute("ROLLBACK TO assignment")
+        conn.execute("RELEASE assignment")
+        raise
+    conn.execute("RELEASE assignment")
+
+
+def assignment_options(conn: sqlite3.Connection, query: db_flight_query.FlightQuery):
+    """Assigns aircraft and pilots to the flights matching a query after asking the user how"""
+    c = util.choices("Select flights to assign:", [
+        "Flights Missing an Aircraft or Pilots",
+        "All Flights (Replacing Current Assignments)",
+        "Cancel"
+    ])
+    if c == 3:
+        return
+    reassign = c == 2
+
+    print("Enter the number of pilots each flight needs")
+    pilots_per_flight = util.choose_number_from_range(1, 10)
+    local_search = util.choices("Try to use fewer aircraft and pilots? (Slower)", ["Yes", "No"]) == 1
+
+    started = datetime.now()
+    results = solve(conn, query, reassign, pilots_per_flight, local_search)
+    print(f"Solved in {(datetime.now() - started).total_seconds():.2f}s")
+    for result in results:
+        print(f"\t{result.resource_type.get_name()}: {result.to_string()}")
+    print()
+
+    if all(len(result.assignments) == 0 for result in results):
+        print("Nothing to assign")
+        print()
+        return
+    if any(len(result.stranded) > 0 for result in results):
+        print("These assignments can't be applied as they would leave aircraft or pilots out of position")
+        print()
+        return
+    if util.choices("Apply these assignments?", ["Yes", "No"]) == 1:
+        apply_assignments(conn, results, reassign)
+        util.ask_commit(conn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Assign aircraft and pilots to flights")
+    parser.add_argument("--db", default="table.db", help="database to update")
+    parser.add_argument("--departure-after", type=datetime.fromisoformat, help="only flights departing after this")
+    parser.add_argument("--departure-before", type=datetime.fromisoformat, help="only flights departing before this")
+    parser.add_argument("--reassign", action="store_true", help="replace the current assignments of every flight")
+    parser.add_argument("--pilots-per-flight", type=int, default=1, help="number of pilots each flight needs")
+    parser.add_argument("--no-local-search", action="store_true", help="skip the pass freeing aircraft and pilots")
+    parser.add_argument("--dry-run", action="store_true", help="report the assignments without saving them")
+    args = parser.parse_args()
+
+    conn = db_initialisation.initialise_db(args.db)
+    try:
+        started = datetime.now()
+        results = solve(conn, db_flight_query.FlightQuery(args.departure_after, args.departure_before),
+                        args.reassign, args.pilots_per_flight, not args.no_local_search)
+        for result in results:
+            print(f"{result.resource_type.get_name()}: {result.to_string()}")
+        if not args.dry_run:
+            apply_assignments(conn, results, args.reassign)
+            conn.commit()
+        print(f"Done in {(datetime.now() - started).total_seconds():.2f}s")
+    finally:
+        conn.close()
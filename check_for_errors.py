@@ -1,88 +1,285 @@
 import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
 
+import conflicts
+import tables
+import util
+from database import db_initialisation
+from database import db_names
 
-def check_for_errors(conn: sqlite3.Connection):
-    # Arrival time before departure
-    rows = conn.execute("SELECT * FROM flights WHERE departure_time > arrival_time").fetchall()
-    if len(rows) > 0:
-        print("The following flight IDs have their arrival time set before their departure time:")
-        for row in rows:
-            print("\t" + str(row[0]))
-    else:
-        print("All arrival times occur after departure times")
-
-    # Flights with invalid aircraft
-    rows = conn.execute("SELECT flights.id FROM flights LEFT JOIN aircraft ON flights.aircraft_id = aircraft.id WHERE aircraft.id IS NULL").fetchall()
-    if len(rows) > 0:
-        print("The following flight IDs have invalid aircraft IDs:")
-        for row in rows:
-            print("\t" + str(row[0]))
-    else:
-        print("All flights have valid aircraft IDs")
-
-    # Flights with invalid locations
-    rows = conn.execute("SELECT flights.id FROM flights LEFT JOIN destinations ON flights.source_id = destinations.id WHERE destinations.id IS NULL").fetchall()
-    if len(rows) > 0:
-        print("The following flight IDs have invalid departure location IDs:")
-        for row in rows:
-            print("\t" + str(row[0]))
-    else:
-        print("All flights have valid departure location IDs")
-
-    # Contd.
-    rows = conn.execute("SELECT flights.id FROM flights LEFT JOIN destinations ON flights.destination_id = destinations.id WHERE destinations.id IS NULL").fetchall()
-    if len(rows) > 0:
-        print("The following flight IDs have invalid destination IDs:")
-        for row in rows:
-            print("\t" + str(row[0]))
-    else:
-        print("All flights have valid destination IDs")
+# Conflicts of each type printed by check_for_errors
+CONFLICT_PRINT_LIMIT = 50
 
-    rows = conn.execute("SELECT flights.id FROM flights LEFT JOIN pilot_flights ON flights.id = pilot_flights.flight_id WHERE pilot_id IS NULL").fetchall()
-    if len(rows) > 0:
-        print("The following flight IDs have no pilots:")
-        for row in rows:
-            print("\t" + str(row[0]))
-    else:
-        print("All flights have at least one pilot")
-
-    # Pilot-Flights table row with invalid pilot / flight
-    rows = conn.execute("SELECT pilot_flights.pilot_id, pilot_flights.flight_id FROM pilot_flights LEFT JOIN flights ON pilot_flights.flight_id = flights.id WHERE flights.id IS NULL").fetchall()
-    if len(rows) > 0:
-        print("The following pilot IDs have been assigned to invalid flight IDs:")
-        for row in rows:
-            print("\t" + str(row[0]) + " (Invalid flight: " + str(row[1]) + ")")
-    else:
-        print("All pilots have been assigned to flights with valid IDs")
-
-    # Contd.
-    rows = conn.execute("SELECT pilot_flights.flight_id, pilot_flights.pilot_id FROM pilot_flights LEFT JOIN pilots ON pilot_flights.pilot_id = pilots.id WHERE pilots.id IS NULL").fetchall()
-    if len(rows) > 0:
-        print("The following flight IDs have been assigned invalid pilot IDs:")
-        for row in rows:
-            print("\t" + str(row[0]) + " (Invalid pilot: " + str(row[1]) + ")")
-    else:
-        print("All flights have been assigned pilots with valid IDs")
-
-    # Destinations with invalid lat/long
-    rows = conn.execute("SELECT id, name from destinations where latitude > 90 OR latitude < -90").fetchall()
-    if len(rows) > 0:
-        print("The following destinations IDs have an invalid latitude:")
-        for row in rows:
-            print("\t" + str(row[0]) + " (" + row[1] + ")")
-    else:
-        print("All destinations have valid latitudes")
-
-    # Contd.
-    rows = conn.execute("SELECT id, name from destinations where longitude > 180 OR longitude < -180").fetchall()
-    if len(rows) > 0:
-        print("The following destinations IDs have an invalid longitude:")
-        for row in rows:
-            print("\t" + str(row[0]) + " (" + row[1] + ")")
+
+class CheckScope(Enum):
+    FLIGHTS = 1
+    PILOT_FLIGHTS = 2
+    DESTINATIONS = 3
+
+
+class Violation(Enum):
+    ARRIVAL_BEFORE_DEPARTURE = 1
+    INVALID_AIRCRAFT = 2
+    INVALID_SOURCE = 3
+    INVALID_DESTINATION = 4
+    NO_PILOTS = 5
+    INVALID_FLIGHT_ASSIGNMENT = 6
+    INVALID_PILOT_ASSIGNMENT = 7
+    INVALID_LATITUDE = 8
+    INVALID_LONGITUDE = 9
+
+
+# Queries returning (row ID, detail) for every row with a violation along with the rows they check.
+# Flight checks return flight IDs, pilot-flight checks return (flight ID, pilot ID) and destination checks
+# return destination IDs
+_CHECKS = {
+    Violation.ARRIVAL_BEFORE_DEPARTURE: (
+        CheckScope.FLIGHTS,
+        "SELECT flights.id, NULL FROM flights WHERE flights.departure_time > flights.arrival_time"
+    ),
+    Violation.INVALID_AIRCRAFT: (
+        CheckScope.FLIGHTS,
+        "SELECT flights.id, flights.aircraft_id FROM flights "
+        "WHERE NOT EXISTS (SELECT 1 FROM aircraft WHERE aircraft.id = flights.aircraft_id)"
+    ),
+    Violation.INVALID_SOURCE: (
+        CheckScope.FLIGHTS,
+        "SELECT flights.id, flights.source_id FROM flights "
+        "WHERE NOT EXISTS (SELECT 1 FROM destinations WHERE destinations.id = flights.source_id)"
+    ),
+    Violation.INVALID_DESTINATION: (
+        CheckScope.FLIGHTS,
+        "SELECT flights.id, flights.destination_id FROM flights "
+        "WHERE NOT EXISTS (SELECT 1 FROM destinations WHERE destinations.id = flights.destination_id)"
+    ),
+    Violation.NO_PILOTS: (
+        CheckScope.FLIGHTS,
+        "SELECT flights.id, NULL FROM flights "
+        "WHERE NOT EXISTS (SELECT 1 FROM pilot_flights WHERE pilot_flights.flight_id = flights.id)"
+    ),
+    Violation.INVALID_FLIGHT_ASSIGNMENT: (
+        CheckScope.PILOT_FLIGHTS,
+        "SELECT pilot_flights.flight_id, pilot_flights.pilot_id FROM pilot_flights "
+        "WHERE NOT EXISTS (SELECT 1 FROM flights WHERE flights.id = pilot_flights.flight_id)"
+    ),
+    Violation.INVALID_PILOT_ASSIGNMENT: (
+        CheckScope.PILOT_FLIGHTS,
+        "SELECT pilot_flights.flight_id, pilot_flights.pilot_id FROM pilot_flights "
+        "WHERE NOT EXISTS (SELECT 1 FROM pilots WHERE pilots.id = pilot_flights.pilot_id)"
+    ),
+    Violation.INVALID_LATITUDE: (
+        CheckScope.DESTINATIONS,
+        "SELECT destinations.id, NULL FROM destinations "
+        "WHERE (destinations.latitude > 90 OR destinations.latitude < -90)"
+    ),
+    Violation.INVALID_LONGITUDE: (
+        CheckScope.DESTINATIONS,
+        "SELECT destinations.id, NULL FROM destinations "
+        "WHERE (destinations.longitude > 180 OR destinations.longitude < -180)"
+    ),
+}
+
+_DIRTY = "SELECT row_id FROM integrity_dirty WHERE table_name = '{}'"
+
+# Flights affected by a change to themselves, their pilots or anything they reference
+_DIRTY_FLIGHTS = (
+    f"{_DIRTY.format('flights')} "
+    f"UNION SELECT id FROM flights WHERE aircraft_id IN ({_DIRTY.format('aircraft')}) "
+    f"UNION SELECT id FROM flights WHERE source_id IN ({_DIRTY.format('destinations')}) "
+    f"UNION SELECT id FROM flights WHERE destination_id IN ({_DIRTY.format('destinations')})"
+)
+
+# (condition restricting a check to changed rows, condition selecting the stored violations it replaces)
+_SCOPE_CONDITIONS = {
+    CheckScope.FLIGHTS: (
+        f"flights.id IN ({_DIRTY_FLIGHTS})",
+        f"row_id IN ({_DIRTY_FLIGHTS})"
+    ),
+    CheckScope.PILOT_FLIGHTS: (
+        f"(pilot_flights.flight_id IN ({_DIRTY.format('flights')}) "
+        f"OR pilot_flights.pilot_id IN ({_DIRTY.format('pilots')}))",
+        f"(row_id IN ({_DIRTY.format('flights')}) OR detail IN ({_DIRTY.format('pilots')}))"
+    ),
+    CheckScope.DESTINATIONS: (
+        f"destinations.id IN ({_DIRTY.format('destinations')})",
+        f"row_id IN ({_DIRTY.format('destinations')})"
+    ),
+}
+
+# (message if there are violations, message if there are none)
+_MESSAGES = {
+    Violation.ARRIVAL_BEFORE_DEPARTURE: (
+        "The following flight IDs have their arrival time set before their departure time:",
+        "All arrival times occur after departure times"
+    ),
+    Violation.INVALID_AIRCRAFT: (
+        "The following flight IDs have invalid aircraft IDs:", "All flights have valid aircraft IDs"
+    ),
+    Violation.INVALID_SOURCE: (
+        "The following flight IDs have invalid departure location IDs:",
+        "All flights have valid departure location IDs"
+    ),
+    Violation.INVALID_DESTINATION: (
+        "The following flight IDs have invalid destination IDs:", "All flights have valid destination IDs"
+    ),
+    Violation.NO_PILOTS: ("The following flight IDs have no pilots:", "All flights have at least one pilot"),
+    Violation.INVALID_FLIGHT_ASSIGNMENT: (
+        "The following pilot IDs have been assigned to invalid flight IDs:",
+        "All pilots have been assigned to flights with valid IDs"
+    ),
+    Violation.INVALID_PILOT_ASSIGNMENT: (
+        "The following flight IDs have been assigned invalid pilot IDs:",
+        "All flights have been assigned pilots with valid IDs"
+    ),
+    Violation.INVALID_LATITUDE: (
+        "The following destinations IDs have an invalid latitude:", "All destinations have valid latitudes"
+    ),
+    Violation.INVALID_LONGITUDE: (
+        "The following destinations IDs have an invalid longitude:", "All destinations have valid longitude"
+    ),
+}
+
+
+@dataclass
+class IntegrityReport:
+    """Class representing the result of an integrity check"""
+    full: bool
+    checked_at: datetime
+    # Violation type -> (row ID, detail) of every row with that violation
+    violations: dict[Violation, list[tuple[int, int]]] = field(default_factory=dict)
+
+    def is_ok(self) -> bool:
+        return all(len(v) == 0 for v in self.violations.values())
+
+
+def check_integrity(conn: sqlite3.Connection, full: bool = False, save: bool = False) -> IntegrityReport:
+    """
+    Re-validates every row changed since the last saved check (or every row if full is set or no full check has
+    been saved yet) and returns all outstanding violations. Nothing is written unless save is set, in which case
+    the violations found and the rows checked are saved in a transaction of their own so the next check can start
+    from them. Saving can't be done while the connection has changes waiting to be committed
+    """
+    if save and conn.in_transaction:
+        raise ValueError("Integrity checks can't be saved while there are uncommitted changes")
+
+    now = datetime.now()
+    if not save:
+        return _find_violations(conn, full, now)
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        report = _save_violations(conn, full, now)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return report
+
+
+def _is_first_check(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM integrity_state").fetchone() is None
+
+
+def _find_violations(conn: sqlite3.Connection, full: bool, now: datetime) -> IntegrityReport:
+    """Checks the rows without writing anything, combining the saved violations of unchanged rows with new ones"""
+    full = full or _is_first_check(conn)
+    report = IntegrityReport(full, now, {v: [] for v in Violation})
+    for violation, (scope, sql) in _CHECKS.items():
+        if not full:
+            check_condition, stored_condition = _SCOPE_CONDITIONS[scope]
+            sql = (f"SELECT row_id, detail FROM integrity_violations WHERE violation = ? AND NOT ({stored_condition}) "
+                   f"UNION ALL {sql} AND {check_condition}")
+        rows = conn.execute(f"SELECT * FROM ({sql}) ORDER BY 1, 2", () if full else (violation.name,))
+        report.violations[violation] = [(row_id, detail) for row_id, detail in rows]
+    return report
+
+
+def _save_violations(conn: sqlite3.Connection, full: bool, now: datetime) -> IntegrityReport:
+    """Checks the rows, replacing the saved violations of the rows checked and marking them as checked"""
+    full = full or _is_first_check(conn)
+    for violation, (scope, sql) in _CHECKS.items():
+        if full:
+            conn.execute("DELETE FROM integrity_violations WHERE violation = ?", (violation.name,))
+            conn.execute(f"INSERT INTO integrity_violations (violation, row_id, detail) SELECT ?, * FROM ({sql})",
+                         (violation.name,))
+        else:
+            check_condition, stored_condition = _SCOPE_CONDITIONS[scope]
+            conn.execute(f"DELETE FROM integrity_violations WHERE violation = ? AND {stored_condition}",
+                         (violation.name,))
+            conn.execute(
+                f"INSERT INTO integrity_violations (violation, row_id, detail) "
+                f"SELECT ?, * FROM ({sql} AND {check_condition})",
+                (violation.name,)
+            )
+
+    conn.execute("DELETE FROM integrity_dirty")
+    if full:
+        conn.execute("INSERT OR REPLACE INTO integrity_state (id, last_check, last_full_check) VALUES (1, ?, ?)",
+                     (util.dt_to_db(now), util.dt_to_db(now)))
     else:
-        print("All destinations have valid longitude")
+        conn.execute("UPDATE integrity_state SET last_check = ? WHERE id = 1", (util.dt_to_db(now),))
+
+    report = IntegrityReport(full, now, {v: [] for v in Violation})
+    rows = conn.execute("SELECT violation, row_id, detail FROM integrity_violations ORDER BY row_id, detail")
+    for violation, row_id, detail in rows:
+        report.violations[Violation[violation]].append((row_id, detail))
+    return report
+
+
+def print_report(conn: sqlite3.Connection, report: IntegrityReport):
+    """Prints the violations in an integrity report"""
+    destination_names = db_names.get_names(conn, "destinations", {
+        row_id for v in (Violation.INVALID_LATITUDE, Violation.INVALID_LONGITUDE)
+        for row_id, _ in report.violations.get(v, [])
+    })
+
+    for violation in Violation:
+        rows = report.violations.get(violation, [])
+        found, ok = _MESSAGES[violation]
+        if len(rows) == 0:
+            print(ok)
+            continue
+
+        print(found)
+        # Full checks of large databases can find more violations than fit on screen, so they are paged
+        if violation == Violation.INVALID_FLIGHT_ASSIGNMENT:
+            table = ([str(detail), f"(Invalid flight: {row_id})"] for row_id, detail in rows)
+        elif violation == Violation.INVALID_PILOT_ASSIGNMENT:
+            table = ([str(row_id), f"(Invalid pilot: {detail})"] for row_id, detail in rows)
+        elif violation in (Violation.INVALID_LATITUDE, Violation.INVALID_LONGITUDE):
+            table = ([str(row_id), f"({destination_names[row_id] or ''})"] for row_id, _ in rows)
+        else:
+            table = ([str(row_id)] for row_id, _ in rows)
+        tables.stream_table(table, indent="\t")
+
+
+def check_for_errors(conn: sqlite3.Connection):
+    """
+    Checks the database for errors and prints them
+    """
+    c = util.choices("Select check:", ["Check rows changed since last check", "Check all rows"])
+    # Checks are saved in a transaction of their own, which can't be started while the session has unsaved changes
+    # (or at all in a read-only session)
+    read_only = db_initialisation.is_read_only(conn)
+    save = not read_only and not conn.in_transaction
+    # Read before saving the check forgets which rows changed
+    changed = conflicts.changed_resources(conn)
+    report = check_integrity(conn, c == 2, save)
+
+    print_report(conn, report)
+    print()
 
+    # Double-bookings are found with a sweep over the flights of every aircraft and pilot, or only of those with
+    # changed flights when only changed rows were checked
+    swept = None if report.full else changed
+    conflicts.print_conflicts(conflicts.find_conflicts(conn, resources=swept), CONFLICT_PRINT_LIMIT, swept)
     print()
 
-    print("Checks complete")
+    print("Checks complete" + ("" if report.full else " (changed rows only)"))
+    if read_only:
+        print("The check wasn't saved as this is a read-only session")
+    elif not save:
+        print("The check wasn't saved as there are unsaved changes, so the next one will check these rows again")
     print()
@@ -0,0 +1,161 @@
+import heapq
+import json
+import sqlite3
+from dataclasses import dataclass
+from enum import Enum
+from typing import Iterable, Iterator, Optional
+
+import tables
+import util
+
+
+class ConflictType(Enum):
+    AIRCRAFT = 1
+    PILOT = 2
+
+    def get_name(self) -> str:
+        if self == ConflictType.AIRCRAFT:
+            return "Aircraft"
+        elif self == ConflictType.PILOT:
+            return "Pilot"
+
+    def get_plural(self) -> str:
+        if self == ConflictType.AIRCRAFT:
+            return "aircraft"
+        elif self == ConflictType.PILOT:
+            return "pilots"
+
+
+# (query returning (resource ID, departure time, arrival time, flight ID), resource ID column, ordering by resource
+# then departure time)
+_SCHEDULES = {
+    ConflictType.AIRCRAFT: (
+        "SELECT aircraft_id, departure_time, arrival_time, id FROM flights",
+        "aircraft_id",
+        "ORDER BY aircraft_id, departure_time"
+    ),
+    ConflictType.PILOT: (
+        "SELECT pilot_flights.pilot_id, flights.departure_time, flights.arrival_time, flights.id "
+        "FROM pilot_flights JOIN flights ON flights.id = pilot_flights.flight_id",
+        "pilot_flights.pilot_id",
+        "ORDER BY pilot_flights.pilot_id, flights.departure_time"
+    ),
+}
+
+_DIRTY = "SELECT row_id FROM integrity_dirty WHERE table_name = '{}'"
+
+# Resources whose flights have changed since the last saved integrity check (or that changed themselves)
+_CHANGED_RESOURCES_SQL = {
+    ConflictType.AIRCRAFT: (
+        f"SELECT aircraft_id FROM flights WHERE id IN ({_DIRTY.format('flights')}) "
+        f"UNION {_DIRTY.format('aircraft')}"
+    ),
+    ConflictType.PILOT: (
+        f"SELECT pilot_id FROM pilot_flights WHERE flight_id IN ({_DIRTY.format('flights')}) "
+        f"UNION {_DIRTY.format('pilots')}"
+    ),
+}
+
+
+@dataclass
+class Conflict:
+    """Class representing two flights that use the same aircraft or pilot at the same time"""
+    conflict_type: ConflictType
+    resource_id: int
+    # The flight departing first and the one overlapping it
+    first_flight: int
+    second_flight: int
+    # Database times of the start and end of the overlap
+    overlap_start: int
+    overlap_end: int
+
+
+def sweep(schedule: Iterable[tuple[int, int, int, int]]) -> Iterator[tuple[int, int, int, int, int]]:
+    """
+    Yields (resource ID, first flight, second flight, overlap start, overlap end) for every pair of overlapping
+    flights given (resource ID, departure, arrival, flight ID) rows ordered by resource and departure. Flights in
+    the air are kept in a heap ordered by arrival so each row costs O(log n) plus the conflicts it reports
+    """
+    resource = None
+    in_air: list[tuple[int, int]] = []  # (arrival, flight ID)
+    for resource_id, departure, arrival, flight_id in schedule:
+        if resource_id != resource:
+            resource = resource_id
+            in_air.clear()
+
+        # Flights that are never in the air can't overlap anything (ones landing before they depart are reported by
+        # the integrity check instead)
+        if arrival <= departure:
+            continue
+
+        # Landing exactly as the next flight departs isn't a conflict
+        while len(in_air) > 0 and in_air[0][0] <= departure:
+            heapq.heappop(in_air)
+
+        for other_arrival, other_id in in_air:
+            yield resource_id, other_id, flight_id, departure, min(arrival, other_arrival)
+
+        heapq.heappush(in_air, (arrival, flight_id))
+
+
+def changed_resources(conn: sqlite3.Connection) -> dict[ConflictType, set[int]]:
+    """Returns the aircraft and pilots with flights changed since the last saved integrity check"""
+    return {t: {row[0] for row in conn.execute(sql)} for t, sql in _CHANGED_RESOURCES_SQL.items()}
+
+
+def find_conflicts(conn: sqlite3.Connection, conflict_types: Iterable[ConflictType] = tuple(ConflictType),
+                   resources: Optional[dict[ConflictType, Iterable[int]]] = None) -> Iterator[Conflict]:
+    """
+    Yields every pair of flights sharing an aircraft or pilot while both are in the air. If resources are given,
+    only the flights of those aircraft and pilots are swept
+    """
+    for conflict_type in conflict_types:
+        sql, resource_column, order = _SCHEDULES[conflict_type]
+        arguments = ()
+        if resources is not None:
+            # Passed as JSON rather than loaded into a temporary table, which would open a transaction
+            sql += f" WHERE {resource_column} IN (SELECT value FROM json_each(?))"
+            arguments = (json.dumps(sorted(resources.get(conflict_type, ()))),)
+        cursor = conn.execute(f"{sql} {order}", arguments)
+        try:
+            for resource_id, first, second, start, end in sweep(cursor):
+                yield Conflict(conflict_type, resource_id, first, second, start, end)
+        finally:
+            cursor.close()
+
+
+def print_conflicts(conflicts: Iterable[Conflict], limit: Optional[int] = None,
+                    resources: Optional[dict[ConflictType, Iterable[int]]] = None) -> dict[ConflictType, int]:
+    """
+    Prints conflicts (up to limit of each type) and returns the number of conflicts of each type. resources are the
+    changed aircraft and pilots the conflicts were found among, as passed to find_conflicts, or None if every one
+    was swept
+    """
+    counts = {t: 0 for t in ConflictType}
+    writer = None
+    for conflict in conflicts:
+        if counts[conflict.conflict_type] == 0:
+            # Conflicts arrive one type at a time, so each type gets its own table
+            if writer is not None:
+                writer.close()
+            print(f"The following {conflict.conflict_type.get_plural()} are double-booked:")
+            writer = tables.TableWriter(indent="\t", paged=True)
+        counts[conflict.conflict_type] += 1
+        if limit is None or counts[conflict.conflict_type] <= limit:
+            writer.write_rows([[
+                f"{conflict.conflict_type.get_name()} {conflict.resource_id}:",
+                f"flights {conflict.first_flight} and {conflict.second_flight}",
+                f"overlap from {util.dt_format(util.db_to_dt(conflict.overlap_start))}",
+                f"to {util.dt_format(util.db_to_dt(conflict.overlap_end))}"
+            ]])
+    if writer is not None:
+        writer.close()
+
+    for conflict_type, count in counts.items():
+        if count == 0 and resources is None:
+            print(f"No {conflict_type.get_plural()} are double-booked")
+        elif count == 0:
+            print(f"No double-bookings among changed {conflict_type.get_plural()}")
+        elif limit is not None and count > limit:
+            print(f"\t... and {count - limit} more {conflict_type.get_name().lower()} conflict(s)")
+    return counts
@@ -1 +1,29 @@
 LIMIT_PER_PAGE = 10
+# Maximum number of entity names kept by database.db_names
+NAME_CACHE_SIZE = 4096
+# Closest matches shown when a search has no exact matches
+SEARCH_FUZZY_LIMIT = 20
+# Prepared statements kept per connection (and flight search shapes kept compiled)
+STATEMENT_CACHE_SIZE = 256
+# ID selections larger than this are loaded into a temporary table instead of being passed to each query
+SELECTION_TABLE_THRESHOLD = 100
+# Flight IDs listed when confirming the deletion of a pilot, aircraft or destination
+CASCADE_SAMPLE_SIZE = 20
+# Rows a streamed table buffers before writing (the first block sets its column widths)
+TABLE_BLOCK_ROWS = 200
+# Longest cell written by a streamed table before it is truncated
+TABLE_MAX_CELL_WIDTH = 40
+# Rows shown at a time when a streamed table is paged
+TABLE_PAGE_ROWS = 40
+# Most flights searched for in a connecting itinerary
+ITINERARY_MAX_LEGS = 4
+# Shortest time allowed to change flights at a destination unless it has its own
+ITINERARY_MIN_CONNECTION_MINUTES = 45
+# Slow statements kept by a statement profile (older ones are dropped)
+SLOW_QUERY_LOG_SIZE = 100
+# Statements listed when showing a statement profile
+PROFILE_STATEMENT_LIMIT = 30
+# Longest statement text shown when showing a statement profile
+PROFILE_SQL_WIDTH = 100
+# Length of the longest bar in a statement duration histogram
+PROFILE_HISTOGRAM_WIDTH = 40
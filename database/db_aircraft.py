@@ -1,31 +1,34 @@
 import sqlite3
 from typing import Optional
 
-import consts
 import util
+from database import db_names
+from database import db_search
+from pagination import KeysetPager
 
 
 def get_aircraft_from_id(conn: sqlite3.Connection, aircraft_id: int) -> str:
     """Returns the aircraft's name given its ID"""
-    return conn.execute("SELECT name FROM aircraft WHERE id=?", (aircraft_id,)).fetchone()[0]
+    name = db_names.get_name(conn, "aircraft", aircraft_id)
+    if name is None: return "[INVALID AIRCRAFT]"
+    return name
 
 
 def get_aircraft_selection(conn: sqlite3.Connection, base_selection: set[int]) -> set[int]:
     """Allows the user to select multiple aircraft"""
-    page = 0
+    pager = KeysetPager(("id",))
+    search_text = None
     if type(base_selection) != set:
         selection = set(base_selection)
     else:
         selection = base_selection.copy()
 
     while True:
-        rows = conn.execute(
-            f"SELECT id, name FROM aircraft LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
+        search = db_search.search_condition(conn, "aircraft", search_text)
+        rows = pager.fetch(conn, "aircraft", "id, name", search.conditions, search.arguments)
 
-        has_next = len(rows) > consts.LIMIT_PER_PAGE
-        rows = rows[:consts.LIMIT_PER_PAGE]
-
-        print(f"Page: {page + 1}")
+        db_search.print_search_status(search_text, search)
+        print(f"Page: {pager.to_string()}")
         table = [["ID", "Name", "Selected"]]
         for row in rows:
             table.append(
@@ -36,24 +39,23 @@ def get_aircraft_selection(conn: sqlite3.Connection, base_selection: set[int]) -
                 ]
             )
 
-        if len(rows) == 0:
+        if len(rows) == 0 and search_text is None:
             print("No aircraft - add more from main menu")
             print()
             return set()
         util.print_table(table)
+        if len(rows) == 0:
+            print("[NO MATCHES]")
         print()
 
-        page_text = ["No Previous Page", "No Next Page"]
-        if page > 0:
-            page_text[0] = f"Previous Page ({page})"
-        if has_next:
-            page_text[1] = f"Next Page ({page + 2})"
-        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select/Deselect ID", "Deselect All", "Done"])
+        page_text = pager.page_text()
+        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select/Deselect ID", "Deselect All",
+                                               f"Search - {search_text or 'None'}", "Done"], conn)
 
         if c == 1:
-            if page > 0: page -= 1
+            pager.previous_page()
         elif c == 2:
-            if has_next: page += 1
+            pager.next_page()
         elif c == 3:
             print("Enter ID:")
             _id = util.choose_number()
@@ -71,21 +73,23 @@ def get_aircraft_selection(conn: sqlite3.Connection, base_selection: set[int]) -
         elif c == 4:
             selection = set()
         elif c == 5:
+            search_text = db_search.ask_search_text()
+            pager.reset()
+        elif c == 6:
             return selection
 
 
 def get_aircraft(conn: sqlite3.Connection) -> Optional[int]:
     """Allows the user to select an aircraft"""
-    page = 0
+    pager = KeysetPager(("id",))
+    search_text = None
 
     while True:
-        rows = conn.execute(
-            f"SELECT id, name FROM aircraft LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
-
-        has_next = len(rows) > consts.LIMIT_PER_PAGE
-        rows = rows[:consts.LIMIT_PER_PAGE]
+        search = db_search.search_condition(conn, "aircraft", search_text)
+        rows = pager.fetch(conn, "aircraft", "id, name", search.conditions, search.arguments)
 
-        print(f"Page: {page + 1}")
+        db_search.print_search_status(search_text, search)
+        print(f"Page: {pager.to_string()}")
         table = [["ID", "Name"]]
         for row in rows:
             table.append(
@@ -95,24 +99,23 @@ def get_aircraft(conn: sqlite3.Connection) -> Optional[int]:
                 ]
             )
 
-        if len(rows) == 0:
+        if len(rows) == 0 and search_text is None:
             print("No aircraft - add more from main menu")
             print()
             return
         util.print_table(table)
+        if len(rows) == 0:
+            print("[NO MATCHES]")
         print()
 
-        page_text = ["No Previous Page", "No Next Page"]
-        if page > 0:
-            page_text[0] = f"Previous Page ({page})"
-        if has_next:
-            page_text[1] = f"Next Page ({page + 2})"
-        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select ID"])
+        page_text = pager.page_text()
+        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select ID",
+                                               f"Search - {search_text or 'None'}"], conn)
 
         if c == 1:
-            if page > 0: page -= 1
+            pager.previous_page()
         elif c == 2:
-            if has_next: page += 1
+            pager.next_page()
         elif c == 3:
             print("Enter ID:")
             _id = util.choose_number()
@@ -120,4 +123,7 @@ def get_aircraft(conn: sqlite3.Connection) -> Optional[int]:
                 return _id
             print("Invalid ID")
             print()
+        elif c == 4:
+            search_text = db_search.ask_search_text()
+            pager.reset()
 
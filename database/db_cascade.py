@@ -0,0 +1,55 @@
+import sqlite3
+from dataclasses import dataclass, field
+
+import consts
+
+# Condition selecting the flights that can't exist without a row of each entity table, and the number of times
+# the row's ID is passed to it. A flight is only deleted along with a pilot if it has no other pilot
+_DEPENDENT_FLIGHTS = {
+    "pilots": (
+        "id IN (SELECT assigned.flight_id FROM pilot_flights AS assigned WHERE assigned.pilot_id = ? "
+        "AND NOT EXISTS (SELECT 1 FROM pilot_flights AS other "
+        "WHERE other.flight_id = assigned.flight_id AND other.pilot_id != assigned.pilot_id))",
+        1
+    ),
+    "aircraft": ("aircraft_id = ?", 1),
+    "destinations": ("source_id = ? OR destination_id = ?", 2),
+}
+
+
+@dataclass
+class CascadeImpact:
+    """Class representing the flights that would be deleted along with a pilot, aircraft or destination"""
+    flight_count: int = 0
+    # Lowest IDs of the flights that would be deleted (up to consts.CASCADE_SAMPLE_SIZE)
+    sample: list[int] = field(default_factory=list)
+
+    def to_string(self) -> str:
+        """Converts the sample of flight IDs to a user-readable string"""
+        more = self.flight_count - len(self.sample)
+        return ", ".join(str(i) for i in self.sample) + (f" and {more} more" if more > 0 else "")
+
+
+def preview_delete(conn: sqlite3.Connection, table: str, row_id: int) -> CascadeImpact:
+    """Returns the flights that deleting a row of an entity table would also delete, using a single query"""
+    condition, repeat = _DEPENDENT_FLIGHTS[table]
+    # The window count is taken over every dependent flight before the sample is limited
+    rows = conn.execute(
+        f"SELECT id, COUNT() OVER () FROM flights WHERE {condition} ORDER BY id LIMIT {consts.CASCADE_SAMPLE_SIZE}",
+        (row_id,) * repeat
+    ).fetchall()
+    if len(rows) == 0:
+        return CascadeImpact()
+    return CascadeImpact(rows[0][1], [row[0] for row in rows])
+
+
+def delete_with_cascade(conn: sqlite3.Connection, table: str, row_id: int) -> int:
+    """
+    Deletes a row of an entity table along with every flight that depends on it and returns the number of
+    flights deleted. The flights go in one statement before the row so that pilots' orphaned flights can
+    still be found
+    """
+    condition, repeat = _DEPENDENT_FLIGHTS[table]
+    deleted_flights = conn.execute(f"DELETE FROM flights WHERE {condition}", (row_id,) * repeat).rowcount
+    conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+    return deleted_flights
@@ -2,12 +2,16 @@ import sqlite3
 from typing import Optional
 
 import util
-import consts
+from database import db_names
+from database import db_search
+from pagination import KeysetPager
 
 
 def get_destinations_from_id(conn: sqlite3.Connection, destination_id: int) -> str:
     """Returns a destination's name given its ID"""
-    return conn.execute("SELECT name FROM destinations WHERE id=?", (destination_id,)).fetchone()[0]
+    name = db_names.get_name(conn, "destinations", destination_id)
+    if name is None: return "[INVALID DESTINATION]"
+    return name
 
 
 def get_destination_code_from_id(conn: sqlite3.Connection, destination_id: int) -> str:
@@ -17,20 +21,19 @@ def get_destination_code_from_id(conn: sqlite3.Connection, destination_id: int)
 
 def get_destination_selection(conn: sqlite3.Connection, base_selection: set[int]) -> set[int]:
     """Allows the user to select multiple destinations"""
-    page = 0
+    pager = KeysetPager(("id",))
+    search_text = None
     if type(base_selection) != set:
         selection = set(base_selection)
     else:
         selection = base_selection.copy()
 
     while True:
-        rows = conn.execute(
-            f"SELECT id, code, name FROM destinations LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
+        search = db_search.search_condition(conn, "destinations", search_text)
+        rows = pager.fetch(conn, "destinations", "id, code, name", search.conditions, search.arguments)
 
-        has_next = len(rows) > consts.LIMIT_PER_PAGE
-        rows = rows[:consts.LIMIT_PER_PAGE]
-
-        print(f"Page: {page + 1}")
+        db_search.print_search_status(search_text, search)
+        print(f"Page: {pager.to_string()}")
         table = [["ID", "Code", "Name", "Selected"]]
         for row in rows:
             table.append(
@@ -42,25 +45,24 @@ def get_destination_selection(conn: sqlite3.Connection, base_selection: set[int]
                 ]
             )
 
-        if len(rows) == 0:
+        if len(rows) == 0 and search_text is None:
             print("No destinations - add more from main menu")
             print()
             return set()
 
         util.print_table(table)
+        if len(rows) == 0:
+            print("[NO MATCHES]")
         print()
 
-        page_text = ["No Previous Page", "No Next Page"]
-        if page > 0:
-            page_text[0] = f"Previous Page ({page})"
-        if has_next:
-            page_text[1] = f"Next Page ({page + 2})"
-        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select/Deselect ID", "Deselect All", "Done"])
+        page_text = pager.page_text()
+        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select/Deselect ID", "Deselect All",
+                                               f"Search - {search_text or 'None'}", "Done"], conn)
 
         if c == 1:
-            if page > 0: page -= 1
+            pager.previous_page()
         elif c == 2:
-            if has_next: page += 1
+            pager.next_page()
         elif c == 3:
             print("Enter ID:")
             _id = util.choose_number()
@@ -78,20 +80,23 @@ def get_destination_selection(conn: sqlite3.Connection, base_selection: set[int]
         elif c == 4:
             selection = set()
         elif c == 5:
+            search_text = db_search.ask_search_text()
+            pager.reset()
+        elif c == 6:
             return selection
 
 
 def get_destination(conn: sqlite3.Connection) -> Optional[int]:
     """Allows the user to select a destinations"""
-    page = 0
+    pager = KeysetPager(("id",))
+    search_text = None
 
     while True:
-        rows = conn.execute(f"SELECT id, code, name FROM destinations LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
-
-        has_next = len(rows) > consts.LIMIT_PER_PAGE
-        rows = rows[:consts.LIMIT_PER_PAGE]
+        search = db_search.search_condition(conn, "destinations", search_text)
+        rows = pager.fetch(conn, "destinations", "id, code, name", search.conditions, search.arguments)
 
-        print(f"Page: {page + 1}")
+        db_search.print_search_status(search_text, search)
+        print(f"Page: {pager.to_string()}")
         table = [["ID", "Code", "Name"]]
         for row in rows:
             table.append(
@@ -102,24 +107,23 @@ def get_destination(conn: sqlite3.Connection) -> Optional[int]:
                 ]
             )
 
-        if len(rows) == 0:
+        if len(rows) == 0 and search_text is None:
             print("No destinations - add more from main menu")
             print()
             return
         util.print_table(table)
+        if len(rows) == 0:
+            print("[NO MATCHES]")
         print()
 
-        page_text = ["No Previous Page", "No Next Page"]
-        if page > 0:
-            page_text[0] = f"Previous Page ({page})"
-        if has_next:
-            page_text[1] = f"Next Page ({page + 2})"
-        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select ID"])
+        page_text = pager.page_text()
+        c = util.choices("Select an option: ", [page_text[0], page_text[1], "Select ID",
+                                               f"Search - {search_text or 'None'}"], conn)
 
         if c == 1:
-            if page > 0: page -= 1
+            pager.previous_page()
         elif c == 2:
-            if has_next: page += 1
+            pager.next_page()
         elif c == 3:
             print("Enter ID:")
             _id = util.choose_number()
@@ -127,3 +131,6 @@ def get_destination(conn: sqlite3.Connection) -> Optional[int]:
                 return _id
             print("Invalid ID")
             print()
+        elif c == 4:
+            search_text = db_search.ask_search_text()
+            pager.reset()
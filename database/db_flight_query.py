@@ -0,0 +1,171 @@
+import functools
+import json
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterator, Optional
+
+import consts
+import util
+from database import db_flight_records
+from database import db_selections
+from database import db_spatial
+from pagination import KeysetPager
+
+# Rows fetched from the cursor at a time when streaming records
+STREAM_BATCH_SIZE = 1000
+
+# Condition on flights applied by each FlightQuery predicate. ID sets are passed as a single JSON array so the
+# statement doesn't change with the number of IDs selected
+PREDICATES = {
+    "departure_after": "departure_time > ?",
+    "departure_before": "departure_time < ?",
+    "arrival_after": "arrival_time > ?",
+    "arrival_before": "arrival_time < ?",
+    "sources": "source_id IN (SELECT value FROM json_each(?))",
+    "destinations": "destination_id IN (SELECT value FROM json_each(?))",
+    "aircraft": "aircraft_id IN (SELECT value FROM json_each(?))",
+    "pilots": "id IN (SELECT flight_id FROM pilot_flights WHERE pilot_id IN (SELECT value FROM json_each(?)))",
+    # Selections larger than consts.SELECTION_TABLE_THRESHOLD are loaded into temporary tables instead
+    "sources_table": f"source_id IN (SELECT id FROM {db_selections.table_name('sources')})",
+    "destinations_table": f"destination_id IN (SELECT id FROM {db_selections.table_name('destinations')})",
+    "aircraft_table": f"aircraft_id IN (SELECT id FROM {db_selections.table_name('aircraft')})",
+    # Large pilot selections match a large share of flights, so walking flights in order and checking each
+    # one's pilots finds a page far sooner than collecting every flight of every selected pilot
+    "pilots_table": (
+        f"EXISTS (SELECT 1 FROM pilot_flights JOIN {db_selections.table_name('pilots')} AS selected "
+        f"ON selected.id = pilot_flights.pilot_id WHERE pilot_flights.flight_id = flights.id)"
+    ),
+}
+
+# Column restricted by each area predicate. The condition depends on how many bounding boxes the area needs,
+# so these appear in a shape as (predicate, box count)
+AREA_COLUMNS = {
+    "source_area": "source_id",
+    "destination_area": "destination_id",
+}
+
+
+@functools.lru_cache(maxsize=consts.STATEMENT_CACHE_SIZE)
+def compile_conditions(shape: tuple) -> tuple[str, ...]:
+    """Returns the SQL conditions of a query shape (the predicates a FlightQuery applies, in order)"""
+    conditions = []
+    for predicate in shape:
+        if type(predicate) == tuple:
+            name, box_count = predicate
+            conditions.append(f"{AREA_COLUMNS[name]} IN ({db_spatial.within_sql(box_count)})")
+        else:
+            conditions.append(PREDICATES[predicate])
+    return tuple(conditions)
+
+
+@dataclass
+class FlightQuery:
+    """
+    Class representing criteria selecting flights. Time bounds are exclusive and left as None when unbounded,
+    and an empty ID set matches every ID
+    """
+    departure_after: Optional[datetime] = None
+    departure_before: Optional[datetime] = None
+    arrival_after: Optional[datetime] = None
+    arrival_before: Optional[datetime] = None
+    sources: set[int] = field(default_factory=set)
+    destinations: set[int] = field(default_factory=set)
+    pilots: set[int] = field(default_factory=set)
+    aircraft: set[int] = field(default_factory=set)
+    ascending: bool = True
+    # Sources/destinations must also lie inside these circles
+    source_area: Optional[db_spatial.Circle] = None
+    destination_area: Optional[db_spatial.Circle] = None
+
+    def predicates(self, conn: Optional[sqlite3.Connection] = None) -> list[tuple]:
+        """
+        Returns (shape entry, arguments) of every predicate the criteria apply in canonical order. If a connection
+        is given, large ID selections are loaded into temporary tables on it rather than passed as arguments
+        """
+        predicates = []
+        for name, bound in [
+            ("departure_after", self.departure_after), ("departure_before", self.departure_before),
+            ("arrival_after", self.arrival_after), ("arrival_before", self.arrival_before),
+        ]:
+            if bound is not None:
+                predicates.append((name, [util.dt_to_db(bound)]))
+
+        for name, ids in [("sources", self.sources), ("destinations", self.destinations),
+                          ("aircraft", self.aircraft), ("pilots", self.pilots)]:
+            if conn is not None and len(ids) > consts.SELECTION_TABLE_THRESHOLD:
+                db_selections.load_selection(conn, name, ids)
+                predicates.append((f"{name}_table", []))
+            elif len(ids) > 0:
+                predicates.append((name, [json.dumps(sorted(ids))]))
+
+        # Destinations inside the circle are found with the R*Tree and the flights from the source/destination index
+        for name, area in [("source_area", self.source_area), ("destination_area", self.destination_area)]:
+            if area is not None:
+                predicates.append(((name, len(area.bounding_boxes())), area.sql()[1]))
+
+        return predicates
+
+    def shape(self, conn: Optional[sqlite3.Connection] = None) -> tuple:
+        """Returns the predicates applied, which determine the SQL (but not the arguments) of the query"""
+        return tuple(entry for entry, _ in self.predicates(conn))
+
+    def conditions(self, conn: Optional[sqlite3.Connection] = None) -> tuple[list[str], list]:
+        """Returns (SQL conditions on flights, arguments) matching the criteria"""
+        predicates = self.predicates(conn)
+        conditions = compile_conditions(tuple(entry for entry, _ in predicates))
+        return list(conditions), [argument for _, arguments in predicates for argument in arguments]
+
+    def order(self) -> str:
+        """Returns the ORDER BY clause of the hydrated records"""
+        direction = "ASC" if self.ascending else "DESC"
+        return f"page.departure_time {direction}, page.id {direction}"
+
+    def sql(self, conn: Optional[sqlite3.Connection] = None) -> tuple[str, list]:
+        """Returns (query selecting FLIGHT_COLUMNS of every matching flight, arguments)"""
+        conditions, arguments = self.conditions(conn)
+        where = "" if len(conditions) == 0 else " WHERE " + " AND ".join(conditions)
+        return f"SELECT {db_flight_records.FLIGHT_COLUMNS} FROM flights{where}", arguments
+
+
+def iter_flight_batches(conn: sqlite3.Connection, query: FlightQuery,
+                        batch_size: int = STREAM_BATCH_SIZE) -> Iterator[list[db_flight_records.FlightRecord]]:
+    """
+    Lazily yields the records of every flight matching the query ordered by departure time in batches of up to
+    batch_size. Rows are streamed from the cursor so memory use doesn't depend on the number of matches
+    """
+    sql, arguments = query.sql(conn)
+    cursor = conn.execute(db_flight_records.HYDRATE_SQL.format(sql, query.order()), arguments)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                return
+            yield [db_flight_records.row_to_flight_record(row) for row in rows]
+    finally:
+        cursor.close()
+
+
+def iter_flights(conn: sqlite3.Connection, query: FlightQuery,
+                 batch_size: int = STREAM_BATCH_SIZE) -> Iterator[db_flight_records.FlightRecord]:
+    """Lazily yields a record for every flight matching the query ordered by departure time"""
+    for batch in iter_flight_batches(conn, query, batch_size):
+        yield from batch
+
+
+def count_flights(conn: sqlite3.Connection, query: FlightQuery) -> int:
+    """Returns the number of flights matching the query"""
+    sql, arguments = query.sql(conn)
+    return conn.execute(f"SELECT COUNT() FROM ({sql})", arguments).fetchone()[0]
+
+
+def page_flights(conn: sqlite3.Connection, query: FlightQuery,
+                 pager: KeysetPager) -> list[db_flight_records.FlightRecord]:
+    """Returns the records on the pager's current page of flights matching the query"""
+    conditions, arguments = query.conditions(conn)
+    pager.ascending = query.ascending
+    return pager.fetch(
+        conn, "flights", db_flight_records.FLIGHT_COLUMNS, conditions, arguments,
+        key_of=lambda r: (round(r.departure_time.timestamp() * 1000), r.id),
+        load=lambda sql, args: db_flight_records.get_flight_records(conn, sql, args, query.order())
+    )
@@ -0,0 +1,78 @@
+import json
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Iterable
+
+import util
+
+
+@dataclass
+class FlightRecord:
+    """Class representing a flight with the names of everything it references"""
+    id: int
+    departure_time: datetime
+    arrival_time: datetime
+    source_id: int
+    source_name: Optional[str]
+    destination_id: int
+    destination_name: Optional[str]
+    aircraft_id: int
+    aircraft_name: Optional[str]
+    pilots: list[tuple[int, Optional[str]]] = field(default_factory=list)
+
+
+# Columns the inner query passed to get_flight_records must select from flights (in this order)
+FLIGHT_COLUMNS = "id, departure_time, arrival_time, source_id, destination_id, aircraft_id"
+
+# Joins names onto a page of flights. Pilots are aggregated into a JSON array per flight so that the whole
+# page (including every pilot) is loaded by one statement
+HYDRATE_SQL = """
+SELECT page.id, page.departure_time, page.arrival_time,
+       page.source_id, sources.name,
+       page.destination_id, destinations.name,
+       page.aircraft_id, aircraft.name,
+       (
+           SELECT json_group_array(json_array(pilot_flights.pilot_id, pilots.name || ' ' || pilots.surname))
+           FROM pilot_flights LEFT JOIN pilots ON pilots.id = pilot_flights.pilot_id
+           WHERE pilot_flights.flight_id = page.id
+       )
+FROM ({}) AS page
+LEFT JOIN destinations AS sources ON sources.id = page.source_id
+LEFT JOIN destinations ON destinations.id = page.destination_id
+LEFT JOIN aircraft ON aircraft.id = page.aircraft_id
+ORDER BY {}
+"""
+
+
+def row_to_flight_record(row) -> FlightRecord:
+    """Converts a row returned by the hydration query into a FlightRecord"""
+    pilots = sorted((p[0], p[1]) for p in json.loads(row[9])) if row[9] is not None else []
+    return FlightRecord(
+        row[0], util.db_to_dt(row[1]), util.db_to_dt(row[2]),
+        row[3], row[4], row[5], row[6], row[7], row[8],
+        pilots
+    )
+
+
+def get_flight_records(conn: sqlite3.Connection, flights_sql: str, arguments: Iterable,
+                       order: str = "page.departure_time ASC, page.id ASC") -> list[FlightRecord]:
+    """
+    Returns the flights selected by flights_sql (a query selecting FLIGHT_COLUMNS from flights) along with the
+    names of their source, destination, aircraft and pilots using a single query
+    """
+    rows = conn.execute(HYDRATE_SQL.format(flights_sql, order), list(arguments)).fetchall()
+    return [row_to_flight_record(row) for row in rows]
+
+
+def get_flight_records_from_ids(conn: sqlite3.Connection, flight_ids: Iterable[int]) -> list[FlightRecord]:
+    """Returns the flight records for a batch of flight IDs ordered by departure time"""
+    flight_ids = list(flight_ids)
+    if len(flight_ids) == 0:
+        return []
+
+    return get_flight_records(
+        conn,
+        f"SELECT {FLIGHT_COLUMNS} FROM flights WHERE id IN (SELECT value FROM json_each(?))",
+        [json.dumps(flight_ids)]
+    )
@@ -33,6 +33,51 @@ class FlightData:
         return None
 
 
+def save_flight(conn: sqlite3.Connection, flight_id: Optional[int], data: FlightData,
+                current_pilots: Optional[set[int]] = None) -> int:
+    """
+    Writes checked flight data, creating a new flight if flight_id is None, and returns the flight's ID.
+    current_pilots are the pilots the flight had when it was loaded
+    """
+    if flight_id is None:  # New flight
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id)  VALUES (?, ?, ?, ?, ?)",
+            (
+                data.source_id, data.destination_id,
+                util.dt_to_db(data.departure_time), util.dt_to_db(data.arrival_time),
+                data.aircraft_id
+            )
+        )
+        flight_id = cursor.lastrowid
+    else:  # Update existing flight
+        conn.execute(
+            "UPDATE flights SET (source_id, destination_id, departure_time, arrival_time, aircraft_id) = (?, ?, ?, ?, ?) WHERE id = ?",
+            (
+                data.source_id, data.destination_id,
+                util.dt_to_db(data.departure_time), util.dt_to_db(data.arrival_time),
+                data.aircraft_id,
+                flight_id
+            )
+        )
+
+    all_pilots: set[int] = data.pilots.selection.copy()
+    removed_pilots: set[int] = set()
+    if current_pilots is not None:
+        for p in current_pilots:
+            try:
+                all_pilots.remove(p)
+            except KeyError:
+                removed_pilots.add(p)
+
+    for p in all_pilots:  # Add new pilots
+        conn.execute("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)", (p, flight_id))
+    for p in removed_pilots:  # Remove removed pilots
+        conn.execute("DELETE FROM pilot_flights WHERE pilot_id = ? AND flight_id = ?", (p, flight_id))
+
+    return flight_id
+
+
 def modify_flight(conn: sqlite3.Connection, flight_id=None):
     """
     Modifies a flight with the given id. If none is passed in, a new flight is created.
@@ -89,42 +134,7 @@ def modify_flight(conn: sqlite3.Connection, flight_id=None):
                 print()
                 continue
 
-            if flight_id is None:  # New flight
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id)  VALUES (?, ?, ?, ?, ?)",
-                    (
-                        data.source_id, data.destination_id,
-                        util.dt_to_db(data.departure_time), util.dt_to_db(data.arrival_time),
-                        data.aircraft_id
-                    )
-                )
-                flight_id = cursor.lastrowid
-            else:  # Update existing flight
-                conn.execute(
-                    "UPDATE flights SET (source_id, destination_id, departure_time, arrival_time, aircraft_id) = (?, ?, ?, ?, ?) WHERE id = ?",
-                    (
-                        data.source_id, data.destination_id,
-                        util.dt_to_db(data.departure_time), util.dt_to_db(data.arrival_time),
-                        data.aircraft_id,
-                        flight_id
-                    )
-                )
-
-            all_pilots: set[int] = data.pilots.selection.copy()
-            removed_pilots: set[int] = set()
-            if current_pilots is not None:
-                for p in current_pilots:
-                    try:
-                        all_pilots.remove(p)
-                    except KeyError:
-                        removed_pilots.add(p)
-
-            for p in all_pilots:  # Add new pilots
-                conn.execute("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)", (p, flight_id))
-            for p in removed_pilots:  # Remove removed pilots
-                conn.execute("DELETE FROM pilot_flights WHERE pilot_id = ? AND flight_id = ?", (p, flight_id))
-
+            save_flight(conn, flight_id, data, current_pilots)
             util.ask_commit(conn)
             return
         elif choice == 9:  # Quit without saving
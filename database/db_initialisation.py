@@ -1,10 +1,168 @@
 import sqlite3
+import urllib.parse
+import weakref
 
+import consts
+from database import db_profiling
+from database import db_search
+from database import db_spatial
+from database import db_traffic
 
-def initialise_db() -> sqlite3.Connection:
-    """Initialises the database creating the database, tables and setting flags"""
-    conn = sqlite3.connect("table.db")
+# Secondary indexes managed by initialise_db (name: table and columns). Any other index
+# using the idx_ prefix, or one whose definition has changed, is assumed to be stale and is dropped
+INDEXES = {
+    # Covers the flight list query (id is included so pages can be ordered by (departure_time, id))
+    "idx_flights_departure_time": "flights (departure_time, id, arrival_time, source_id, destination_id, aircraft_id)",
+    "idx_flights_arrival_time": "flights (arrival_time)",
+    # Source/destination/aircraft filters and ON DELETE CASCADE lookups
+    "idx_flights_source_id": "flights (source_id, departure_time)",
+    "idx_flights_destination_id": "flights (destination_id, departure_time)",
+    # Includes arrival_time so the double-booking sweep reads flights per aircraft from the index alone
+    "idx_flights_aircraft_id": "flights (aircraft_id, departure_time, arrival_time)",
+    # The primary key only covers lookups by pilot_id
+    "idx_pilot_flights_flight_id": "pilot_flights (flight_id, pilot_id)",
+    "idx_destinations_code": "destinations (code)",
+}
+
+
+def create_indexes(conn: sqlite3.Connection):
+    """Creates all managed indexes and drops stale ones"""
+    existing = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'"
+    ).fetchall()
+    for name, sql in existing:
+        if name not in INDEXES or sql != f"CREATE INDEX {name} ON {INDEXES[name]}":
+            conn.execute(f"DROP INDEX {name}")
+
+    for name, definition in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+# Rows whose changes make integrity_dirty record another row for the integrity checker to re-validate.
+# (table, event, [(dirty table, changed row ID expression)])
+_DIRTY_TRIGGERS = [
+    ("flights", "INSERT", [("flights", "NEW.id")]),
+    ("flights", "UPDATE", [("flights", "NEW.id"), ("flights", "OLD.id")]),
+    ("flights", "DELETE", [("flights", "OLD.id")]),
+    ("pilot_flights", "INSERT", [("flights", "NEW.flight_id"), ("pilots", "NEW.pilot_id")]),
+    ("pilot_flights", "UPDATE", [("flights", "NEW.flight_id"), ("pilots", "NEW.pilot_id"),
+                                 ("flights", "OLD.flight_id"), ("pilots", "OLD.pilot_id")]),
+    ("pilot_flights", "DELETE", [("flights", "OLD.flight_id"), ("pilots", "OLD.pilot_id")]),
+    ("pilots", "INSERT", [("pilots", "NEW.id")]),
+    ("pilots", "DELETE", [("pilots", "OLD.id")]),
+    ("aircraft", "INSERT", [("aircraft", "NEW.id")]),
+    ("aircraft", "DELETE", [("aircraft", "OLD.id")]),
+    ("destinations", "INSERT", [("destinations", "NEW.id")]),
+    ("destinations", "UPDATE", [("destinations", "NEW.id"), ("destinations", "OLD.id")]),
+    ("destinations", "DELETE", [("destinations", "OLD.id")]),
+]
+
+
+def create_integrity_tracking(conn: sqlite3.Connection):
+    """Creates the tables and triggers the incremental integrity checker uses to track changed rows"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS integrity_dirty (
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        PRIMARY KEY (table_name, row_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS integrity_violations (
+        violation TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        detail INTEGER
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS integrity_violations_row_id ON integrity_violations (row_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS integrity_violations_detail ON integrity_violations (detail)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS integrity_state (
+        id INTEGER NOT NULL PRIMARY KEY CHECK (id = 1),
+        last_check DATETIME NOT NULL,
+        last_full_check DATETIME NOT NULL
+    )
+    """)
+
+    _create_dirty_triggers(conn, _DIRTY_TRIGGERS)
+
+
+def _create_dirty_triggers(conn: sqlite3.Connection, triggers: list[tuple[str, str, list[tuple[str, str]]]]):
+    for table, event, dirty in triggers:
+        inserts = "\n".join([
+            f"INSERT OR IGNORE INTO integrity_dirty (table_name, row_id) VALUES ('{t}', {e});" for t, e in dirty
+        ])
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS integrity_{table}_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            {inserts}
+        END
+        """)
+
+
+# Updates to pilots and aircraft, which can change the IDs their flights refer to
+_ENTITY_UPDATE_TRIGGERS = [
+    ("pilots", "UPDATE", [("pilots", "NEW.id"), ("pilots", "OLD.id")]),
+    ("aircraft", "UPDATE", [("aircraft", "NEW.id"), ("aircraft", "OLD.id")]),
+]
+
+
+def track_entity_updates(conn: sqlite3.Connection):
+    """Creates the triggers recording pilots and aircraft changed by updates for the integrity checker"""
+    _create_dirty_triggers(conn, _ENTITY_UPDATE_TRIGGERS)
+
+
+# Connection tuning PRAGMAs applied by initialise_db (profile name: PRAGMA values)
+PROFILES = {
+    "default": {"synchronous": "NORMAL", "cache_size": "-16384", "mmap_size": "0", "temp_store": "DEFAULT"},
+    # Larger caches and memory mapped reads for big databases, at the risk of losing the last commits on power loss
+    "fast": {"synchronous": "OFF", "cache_size": "-262144", "mmap_size": str(1 << 30), "temp_store": "MEMORY"},
+    "safe": {"synchronous": "FULL", "cache_size": "-2000", "mmap_size": "0", "temp_store": "DEFAULT"},
+}
+
+
+def apply_profile(conn: sqlite3.Connection, profile: str):
+    """Applies a tuning profile's PRAGMAs to a connection"""
+    for pragma, value in PROFILES[profile].items():
+        conn.execute(f"PRAGMA {pragma}={value}")
+
+
+# Connections opened by open_read_only. PRAGMA query_only can't mark them as it would also stop them writing the
+# temporary tables searches use
+_read_only: weakref.WeakSet[sqlite3.Connection] = weakref.WeakSet()
+
+
+def open_read_only(path: str = "table.db", profile: str = "default") -> sqlite3.Connection:
+    """
+    Opens an existing database for reading. Read-only connections run in autocommit mode so they never hold a
+    snapshot open and always see the latest commit from the editing session
+    """
+    conn = sqlite3.connect(f"file:{urllib.parse.quote(path)}?mode=ro", uri=True, isolation_level=None,
+                           cached_statements=consts.STATEMENT_CACHE_SIZE, factory=db_profiling.ProfiledConnection)
+    _read_only.add(conn)
+    apply_profile(conn, profile)
+    db_spatial.register_functions(conn)
+    return conn
+
+
+def is_read_only(conn: sqlite3.Connection) -> bool:
+    """Returns whether a connection was opened with open_read_only"""
+    return conn in _read_only
+
+
+def connect(path: str = "table.db", profile: str = "default") -> sqlite3.Connection:
+    """Opens another connection to a database that has already been initialised"""
+    # Flight searches compile to one statement per shape, so a larger cache keeps them all prepared
+    conn = sqlite3.connect(path, cached_statements=consts.STATEMENT_CACHE_SIZE,
+                           factory=db_profiling.ProfiledConnection)
     conn.execute("PRAGMA foreign_keys=ON")
+    apply_profile(conn, profile)
+    db_spatial.register_functions(conn)
+    return conn
+
+
+def create_tables(conn: sqlite3.Connection):
+    """Creates the entity, flight and pilot assignment tables"""
     conn.execute("""
     CREATE TABLE IF NOT EXISTS aircraft (
         id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
@@ -51,8 +209,60 @@ def initialise_db() -> sqlite3.Connection:
     )
     """)
 
-    # conn.execute("INSERT INTO aircraft (id, name) VALUES (?, ?)", (0, "Undefined"))
-    # conn.execute("INSERT INTO destinations (id, name) VALUES (?, ?)", (0, "Undefined"))
 
-    conn.commit()
-    return conn
\ No newline at end of file
+# Schema migrations in the order they are applied, as (description, function). A database's PRAGMA user_version is
+# the number of migrations it has had. Migrations are never edited once released - later changes, including
+# recreating the managed indexes after INDEXES changes, go in a new migration. The first migrations only create what
+# is missing, so databases created before the schema was versioned (at version 0) are brought up to date by them
+MIGRATIONS = [
+    ("Create tables", create_tables),
+    ("Create indexes", create_indexes),
+    ("Track changed rows for the integrity checker", create_integrity_tracking),
+    ("Create name search indexes", db_search.create_search_indexes),
+    ("Create destination spatial index", db_spatial.create_spatial_index),
+    ("Create traffic summaries", db_traffic.create_traffic_summaries),
+    ("Track updated pilots and aircraft for the integrity checker", track_entity_updates),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Applies the migrations a database hasn't had, each in its own transaction along with the version it reaches,
+    and returns the number applied. Raises RuntimeError if the database is from a newer version of the app
+    """
+    version = get_schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return 0
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"database schema version {version} is newer than the latest known ({SCHEMA_VERSION})")
+
+    applied = 0
+    for number, (_, migration) in enumerate(MIGRATIONS[version:], version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another session may have migrated the database since its version was read
+            if get_schema_version(conn) >= number:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied += 1
+    return applied
+
+
+def initialise_db(path: str = "table.db", profile: str = "default") -> sqlite3.Connection:
+    """Opens a database, creating it or bringing its schema up to date if needed"""
+    conn = connect(path, profile)
+    # Lets read-only sessions run alongside an editing session that holds a long write transaction
+    conn.execute("PRAGMA journal_mode=WAL")
+    migrate(conn)
+    return conn
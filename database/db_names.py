@@ -0,0 +1,55 @@
+import json
+import sqlite3
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import consts
+import util
+
+# Expression returning the display name of a row for each entity table
+NAME_EXPRESSIONS = {
+    "aircraft": "name",
+    "destinations": "name",
+    "pilots": "name || ' ' || surname",
+}
+
+
+# (table, ID) -> name (or None if no row has that ID) cached for each connection. Least recently used entries are
+# evicted first
+_caches: util.ConnectionCache[OrderedDict[tuple[str, int], Optional[str]]] = util.ConnectionCache()
+
+
+def get_names(conn: sqlite3.Connection, table: str, ids: Iterable[int]) -> dict[int, Optional[str]]:
+    """Returns the names of the given IDs of an entity table (None for missing IDs) using at most one query"""
+    cache = _caches.get(conn, OrderedDict)
+
+    names = {}
+    missing = []
+    for _id in ids:
+        if (table, _id) in cache:
+            cache.move_to_end((table, _id))
+            names[_id] = cache[(table, _id)]
+        elif _id not in names:
+            names[_id] = None
+            missing.append(_id)
+
+    if len(missing) > 0:
+        rows = conn.execute(
+            f"SELECT {table}.id, {NAME_EXPRESSIONS[table]} FROM json_each(?) AS ids "
+            f"JOIN {table} ON {table}.id = ids.value",
+            (json.dumps(missing),)
+        )
+        for _id, name in rows:
+            names[_id] = name
+
+        for _id in missing:
+            cache[(table, _id)] = names[_id]
+        while len(cache) > consts.NAME_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    return names
+
+
+def get_name(conn: sqlite3.Connection, table: str, _id: int) -> Optional[str]:
+    """Returns the name of an ID in an entity table or None if it doesn't exist"""
+    return get_names(conn, table, (_id,))[_id]
@@ -1,32 +1,33 @@
 import sqlite3
 
-import consts
 import util
+from database import db_names
+from database import db_search
+from pagination import KeysetPager
 
 
 def get_pilot_from_id(conn: sqlite3.Connection, pilot_id: int) -> str:
     """Returns a pilots name given their ID"""
-    row = conn.execute("SELECT name, surname FROM pilots WHERE id=?", (pilot_id,)).fetchone()
-    if row is None: return "[NO PILOT]"
-    return row[0] + " " + row[1]
+    name = db_names.get_name(conn, "pilots", pilot_id)
+    if name is None: return "[NO PILOT]"
+    return name
 
 
 def get_pilot_selection(conn: sqlite3.Connection, base_selection: set[int]) -> set[int]:
     """Allows the user to select multiple pilots"""
-    page = 0
+    pager = KeysetPager(("id",))
+    search_text = None
     if type(base_selection) != set:
         selection = set(base_selection)
     else:
         selection = base_selection.copy()
 
     while True:
-        rows = conn.execute(
-            f"SELECT id, name, surname FROM pilots LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
+        search = db_search.search_condition(conn, "pilots", search_text)
+        rows = pager.fetch(conn, "pilots", "id, name, surname", search.conditions, search.arguments)
 
-        has_next = len(rows) > consts.LIMIT_PER_PAGE
-        rows = rows[:consts.LIMIT_PER_PAGE]
-
-        print(f"Page: {page + 1}")
+        db_search.print_search_status(search_text, search)
+        print(f"Page: {pager.to_string()}")
         table = [["ID", "Name", "Surname", "Selected"]]
         for row in rows:
             table.append(
@@ -38,26 +39,25 @@ def get_pilot_selection(conn: sqlite3.Connection, base_selection: set[int]) -> s
                 ]
             )
 
-        if len(rows) == 0:
+        if len(rows) == 0 and search_text is None:
             print("No destinations - add more from main menu")
             print()
             return set()
 
         util.print_table(table)
+        if len(rows) == 0:
+            print("[NO MATCHES]")
         print()
 
-        page_text = ["No Previous Page", "No Next Page"]
-        if page > 0:
-            page_text[0] = f"Previous Page ({page})"
-        if has_next:
-            page_text[1] = f"Next Page ({page + 2})"
+        page_text = pager.page_text()
         c = util.choices("Select an option: ",
-                         [page_text[0], page_text[1], "Select/Deselect ID", "Deselect All", "Done"])
+                         [page_text[0], page_text[1], "Select/Deselect ID", "Deselect All",
+                          f"Search - {search_text or 'None'}", "Done"], conn)
 
         if c == 1:
-            if page > 0: page -= 1
+            pager.previous_page()
         elif c == 2:
-            if has_next: page += 1
+            pager.next_page()
         elif c == 3:
             print("Enter ID:")
             _id = util.choose_number()
@@ -75,6 +75,9 @@ def get_pilot_selection(conn: sqlite3.Connection, base_selection: set[int]) -> s
         elif c == 4:
             selection = set()
         elif c == 5:
+            search_text = db_search.ask_search_text()
+            pager.reset()
+        elif c == 6:
             return selection
 
 
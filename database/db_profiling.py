@@ -0,0 +1,427 @@
+import contextlib
+import json
+import re
+import sqlite3
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from time import perf_counter
+from typing import Iterator, Optional, TextIO
+
+import consts
+import tables
+import util
+
+# Statement durations are counted in buckets doubling in width: bucket 0 is under 1µs and bucket i is from
+# 2^(i - 1)µs up to 2^iµs, with the last bucket taking everything longer
+HISTOGRAM_BUCKETS = 24
+
+# Label of statements run outside any menu action
+NO_ACTION = "(none)"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+# Text shown in menus after the option's name, such as the current value or a page number
+_OPTION_DETAIL = re.compile(r" (?:- |\().*$")
+
+
+@lru_cache(maxsize=1024)
+def normalise(sql: str) -> str:
+    """
+    Returns a statement with its literals replaced by ? and its whitespace collapsed, so statements differing only in
+    the values written into them are counted together
+    """
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _IN_LIST.sub("IN (?, ...)", sql)
+    return " ".join(sql.split())
+
+
+def _bucket(seconds: float) -> int:
+    return min(int(seconds * 1_000_000).bit_length(), HISTOGRAM_BUCKETS - 1)
+
+
+def bucket_label(bucket: int) -> str:
+    """Returns the range of durations counted in a histogram bucket"""
+    def duration(us: int) -> str:
+        if us >= 1_000_000:
+            return f"{us / 1_000_000:g}s"
+        if us >= 1000:
+            return f"{us / 1000:g}ms"
+        return f"{us}µs"
+
+    if bucket == 0:
+        return f"< {duration(1)}"
+    if bucket == HISTOGRAM_BUCKETS - 1:
+        return f">= {duration(1 << (bucket - 1))}"
+    return f"{duration(1 << (bucket - 1))} - {duration(1 << bucket)}"
+
+
+@dataclass
+class StatementStats:
+    """Class representing the executions of one normalised statement during one action"""
+    calls: int = 0
+    seconds: float = 0.0
+    longest: float = 0.0
+    rows: int = 0
+
+
+@dataclass
+class SlowQuery:
+    """Class representing an execution of a statement that took longer than the slow query threshold"""
+    at: datetime
+    action: str
+    sql: str
+    seconds: float
+    rows: int
+
+
+@dataclass
+class Profile:
+    """
+    Class collecting the statements run on a connection. A statement's duration covers executing it and fetching
+    its rows, and it is recorded once all its rows have been fetched or its cursor is closed or dropped
+    """
+    # Statements taking at least this long are logged (None to log none)
+    slow_ms: Optional[float] = None
+    # Slow statements are also written here as they happen
+    slow_log: Optional[TextIO] = None
+    started: datetime = field(default_factory=datetime.now)
+    # (action, normalised statement): executions
+    statements: dict[tuple[str, str], StatementStats] = field(default_factory=dict)
+    # Action: number of statements in each duration bucket
+    histograms: dict[str, list[int]] = field(default_factory=dict)
+    slow: deque[SlowQuery] = field(default_factory=lambda: deque(maxlen=consts.SLOW_QUERY_LOG_SIZE))
+
+    def record(self, action: str, sql: str, seconds: float, rows: int):
+        """Adds an execution of a statement"""
+        normalised = normalise(sql)
+        stats = self.statements.get((action, normalised))
+        if stats is None:
+            stats = self.statements[(action, normalised)] = StatementStats()
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.longest = max(stats.longest, seconds)
+        stats.rows += rows
+
+        histogram = self.histograms.get(action)
+        if histogram is None:
+            histogram = self.histograms[action] = [0] * HISTOGRAM_BUCKETS
+        histogram[_bucket(seconds)] += 1
+
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            slow = SlowQuery(datetime.now(), action, normalised, seconds, rows)
+            self.slow.append(slow)
+            if self.slow_log is not None:
+                self.slow_log.write(f"{slow.at.isoformat(timespec='milliseconds')}\t{seconds * 1000:.3f}ms\t"
+                                    f"{rows} row(s)\t{action}\t{normalised}\n")
+                self.slow_log.flush()
+
+    def to_json(self) -> dict:
+        """Converts the profile to a JSON-serialisable dict"""
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            "slow_ms": self.slow_ms,
+            "statements": [
+                {"action": action, "sql": sql, "calls": stats.calls, "seconds": stats.seconds,
+                 "longest_seconds": stats.longest, "rows": stats.rows}
+                for (action, sql), stats in sorted(self.statements.items(), key=lambda item: -item[1].seconds)
+            ],
+            "histograms": {
+                action: {bucket_label(i): count for i, count in enumerate(histogram) if count > 0}
+                for action, histogram in self.histograms.items()
+            },
+            "slow_queries": [
+                {"at": slow.at.isoformat(timespec="milliseconds"), "action": slow.action, "sql": slow.sql,
+                 "seconds": slow.seconds, "rows": slow.rows}
+                for slow in self.slow
+            ],
+        }
+
+
+class _Execution:
+    """A statement being run on a cursor, whose time and rows add up until it is recorded"""
+    __slots__ = ("profile", "action", "sql", "seconds", "rows")
+
+    def __init__(self, profile: Profile, action: str, sql: str):
+        self.profile = profile
+        self.action = action
+        self.sql = sql
+        self.seconds = 0.0
+        self.rows = 0
+
+    def record(self):
+        self.profile.record(self.action, self.sql, self.seconds, self.rows)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor timing its statements and counting their rows while its connection is profiling"""
+    _execution: Optional[_Execution] = None
+
+    def _finish(self):
+        execution = self._execution
+        if execution is not None:
+            self._execution = None
+            execution.record()
+
+    def _run(self, method, sql: str, parameters):
+        self._finish()
+        if not self.connection.profiling:
+            return method(sql, parameters)
+
+        execution = _Execution(self.connection.profile, self.connection.get_action(), sql)
+        started = perf_counter()
+        try:
+            method(sql, parameters)
+        except BaseException:
+            execution.seconds += perf_counter() - started
+            execution.record()
+            raise
+        execution.seconds += perf_counter() - started
+        if self.description is None:
+            execution.record()  # Nothing to fetch
+        else:
+            self._execution = execution
+        return self
+
+    def execute(self, sql: str, parameters=(), /):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql: str, parameters, /):
+        return self._run(super().executemany, sql, parameters)
+
+    def __next__(self):
+        execution = self._execution
+        if execution is None:
+            return super().__next__()
+        started = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            execution.seconds += perf_counter() - started
+            self._finish()
+            raise
+        execution.seconds += perf_counter() - started
+        execution.rows += 1
+        return row
+
+    def fetchone(self):
+        execution = self._execution
+        if execution is None:
+            return super().fetchone()
+        started = perf_counter()
+        row = super().fetchone()
+        execution.seconds += perf_counter() - started
+        if row is None:
+            self._finish()
+        else:
+            execution.rows += 1
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        size = self.arraysize if size is None else size
+        execution = self._execution
+        if execution is None:
+            return super().fetchmany(size)
+        started = perf_counter()
+        rows = super().fetchmany(size)
+        execution.seconds += perf_counter() - started
+        execution.rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        execution = self._execution
+        if execution is None:
+            return super().fetchall()
+        started = perf_counter()
+        rows = super().fetchall()
+        execution.seconds += perf_counter() - started
+        execution.rows += len(rows)
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Cursors are often dropped after reading the one row they need
+        self._finish()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """
+    Connection that records its statements in a profile while profiling. Otherwise statements go straight to
+    sqlite3 with only a method call added
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiling = False
+        # The profile being recorded, or the last one recorded once profiling stops
+        self.profile: Optional[Profile] = None
+        # Menu actions being run, outermost first
+        self.actions: list[str] = []
+
+    def get_action(self) -> str:
+        return " > ".join(self.actions) if len(self.actions) > 0 else NO_ACTION
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters=(), /):
+        if not self.profiling:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, parameters, /):
+        if not self.profiling:
+            return super().executemany(sql, parameters)
+        return self.cursor().executemany(sql, parameters)
+
+
+@contextlib.contextmanager
+def action(conn: sqlite3.Connection, option: str) -> Iterator[None]:
+    """
+    Attributes the statements run inside the block to a menu option. The text options show after their name
+    (such as " - All" or " (3)") is left out so every use of an option is counted together
+    """
+    actions = getattr(conn, "actions", None)
+    if actions is None:
+        yield
+        return
+    actions.append(_OPTION_DETAIL.sub("", option))
+    try:
+        yield
+    finally:
+        actions.pop()
+
+
+def start_profiling(conn: ProfiledConnection, slow_ms: Optional[float] = None,
+                    slow_log: Optional[TextIO] = None) -> Profile:
+    """Starts recording a connection's statements in a new profile and returns it"""
+    conn.profile = Profile(slow_ms, slow_log)
+    conn.profiling = True
+    return conn.profile
+
+
+def stop_profiling(conn: ProfiledConnection) -> Optional[Profile]:
+    """Stops recording a connection's statements and returns the profile they were recorded in"""
+    conn.profiling = False
+    return conn.profile
+
+
+def export_profile(profile: Profile, path: str):
+    """Writes a profile to a JSON file"""
+    with open(path, "w") as file:
+        json.dump(profile.to_json(), file, indent=2)
+
+
+def print_profile(profile: Profile, limit: int = consts.PROFILE_STATEMENT_LIMIT):
+    """Prints the statements taking the most time, each action's statement durations and the slow statements"""
+    calls = sum(stats.calls for stats in profile.statements.values())
+    seconds = sum(stats.seconds for stats in profile.statements.values())
+    print(f"Profiling since {util.dt_format(profile.started)}: {calls} statement(s) taking {seconds * 1000:.1f}ms")
+    if calls == 0:
+        print()
+        return
+
+    print(f"Statements taking the most time:")
+    writer = tables.TableWriter(["Action", "Calls", "Total (ms)", "Mean (ms)", "Longest (ms)", "Rows", "Statement"],
+                                indent="\t", paged=True, max_cell_width=consts.PROFILE_SQL_WIDTH)
+    ranked = sorted(profile.statements.items(), key=lambda item: -item[1].seconds)
+    writer.write_rows([
+        [action, str(stats.calls), f"{stats.seconds * 1000:.2f}", f"{stats.seconds * 1000 / stats.calls:.3f}",
+         f"{stats.longest * 1000:.3f}", str(stats.rows), sql]
+        for (action, sql), stats in ranked[:limit]
+    ])
+    writer.close()
+    if len(ranked) > limit:
+        print(f"\t... and {len(ranked) - limit} more statement(s)")
+    print()
+
+    print("Statement durations by action:")
+    for action_name, histogram in sorted(profile.histograms.items()):
+        print(f"\t{action_name} ({sum(histogram)} statement(s))")
+        largest = max(histogram)
+        tables.print_table([
+            [bucket_label(i), str(count), "#" * max(1, count * consts.PROFILE_HISTOGRAM_WIDTH // largest)]
+            for i, count in enumerate(histogram) if count > 0
+        ], indent="\t\t")
+    print()
+
+    if profile.slow_ms is not None:
+        print(f"Statements taking {profile.slow_ms:g}ms or more ({len(profile.slow)} most recent kept):")
+        if len(profile.slow) == 0:
+            print("\t[NONE]")
+            print()
+            return
+        writer = tables.TableWriter(["Time", "Action", "Duration (ms)", "Rows", "Statement"], indent="\t",
+                                    paged=True, max_cell_width=consts.PROFILE_SQL_WIDTH)
+        writer.write_rows([
+            [slow.at.strftime("%H:%M:%S"), slow.action, f"{slow.seconds * 1000:.3f}", str(slow.rows), slow.sql]
+            for slow in profile.slow
+        ])
+        writer.close()
+        print()
+
+
+def profiling_options(conn: sqlite3.Connection):
+    """Allows the user to switch statement profiling on and off and look at what it has recorded"""
+    if not isinstance(conn, ProfiledConnection):
+        print("This connection can't be profiled")
+        print()
+        return
+
+    while True:
+        profile = conn.profile
+        slow = "Off" if profile is None or profile.slow_ms is None else f"{profile.slow_ms:g}ms"
+        c = util.choices(f"Profiling is {'on' if conn.profiling else 'off'}:", [
+            "Stop Profiling" if conn.profiling else "Start Profiling",
+            f"Set Slow Statement Threshold - {slow}",
+            "Show Profile",
+            "Export Profile",
+            "Clear Profile",
+            "Return"
+        ])
+
+        if c == 1:
+            if conn.profiling:
+                stop_profiling(conn)
+            elif profile is None:
+                start_profiling(conn)
+            else:
+                # Keeps the threshold and log of the last profile
+                start_profiling(conn, profile.slow_ms, profile.slow_log)
+        elif c == 6:
+            return
+        elif profile is None:
+            print("Nothing has been profiled yet")
+            print()
+        elif c == 2:
+            print("Enter the threshold in milliseconds (0 to log nothing)")
+            threshold = util.choose_float_range(0.0, 3_600_000.0)
+            profile.slow_ms = None if threshold == 0 else threshold
+        elif c == 3:
+            print_profile(profile)
+        elif c == 4:
+            print("Enter file name:")
+            path = input("> ")
+            print()
+            if not path.endswith(".json"):
+                path += ".json"
+            try:
+                export_profile(profile, path)
+            except OSError as e:
+                print(f"Export failed: {e}")
+                print()
+                continue
+            print(f"Exported the profile to {path}")
+            print()
+        elif c == 5:
+            profiling = conn.profiling
+            start_profiling(conn, profile.slow_ms, profile.slow_log)
+            conn.profiling = profiling
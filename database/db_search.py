@@ -0,0 +1,169 @@
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional
+
+import consts
+import util
+
+# Columns of each entity table covered by its full-text index ({table}_search)
+SEARCH_COLUMNS = {
+    "aircraft": ("name",),
+    "destinations": ("code", "name"),
+    "pilots": ("name", "surname"),
+}
+
+# The trigram tokenizer can only find words of at least this many characters
+MIN_TERM_LENGTH = 3
+
+
+def create_search_indexes(conn: sqlite3.Connection):
+    """
+    Creates an FTS5 trigram index over the names of each entity table and the triggers keeping it in sync.
+    Indexes created for an existing database are filled from its current rows
+    """
+    for table, columns in SEARCH_COLUMNS.items():
+        index = f"{table}_search"
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (index,)).fetchone() is not None
+
+        # External content - the index stores only trigrams and reads the names back from the table itself
+        conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            {', '.join(columns)}, content='{table}', content_rowid='id', tokenize='trigram'
+        )
+        """)
+
+        insert = (f"INSERT INTO {index} (rowid, {', '.join(columns)}) "
+                  f"VALUES (NEW.id, {', '.join(f'NEW.{c}' for c in columns)});")
+        delete = (f"INSERT INTO {index} ({index}, rowid, {', '.join(columns)}) "
+                  f"VALUES ('delete', OLD.id, {', '.join(f'OLD.{c}' for c in columns)});")
+        for event, statements in [("INSERT", insert), ("DELETE", delete),
+                                  (f"UPDATE OF id, {', '.join(columns)}", delete + "\n" + insert)]:
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS search_{table}_{event.split()[0].lower()} AFTER {event} ON {table}
+            BEGIN
+                {statements}
+            END
+            """)
+
+        if not exists:
+            conn.execute(f"INSERT INTO {index} ({index}) VALUES ('rebuild')")
+
+
+def _phrase(term: str) -> str:
+    """Quotes a term so FTS5 matches it as a substring"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like(term: str) -> str:
+    """Returns a LIKE pattern matching a term anywhere"""
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+@dataclass
+class SearchCondition:
+    """Class representing the conditions selecting the rows of an entity table that match search text"""
+    conditions: list[str] = field(default_factory=list)
+    arguments: list = field(default_factory=list)
+    # True if nothing contained the text and the closest matches were selected instead
+    fuzzy: bool = False
+
+
+def search_condition(conn: sqlite3.Connection, table: str, text: Optional[str]) -> SearchCondition:
+    """
+    Returns the conditions selecting rows where every word of the text appears in one of the searched columns.
+    If there are no such rows the rows sharing the most trigrams with the text are selected instead so a
+    misspelt name still finds something
+    """
+    if text is None:
+        return SearchCondition()
+
+    index = f"{table}_search"
+    terms = text.split()
+    long_terms = [t for t in terms if len(t) >= MIN_TERM_LENGTH]
+
+    result = SearchCondition()
+    if len(long_terms) > 0:
+        match = " ".join(_phrase(t) for t in long_terms)
+        if conn.execute(f"SELECT 1 FROM {index} WHERE {index} MATCH ? LIMIT 1", (match,)).fetchone() is None:
+            trigrams = dict.fromkeys(t[i:i + 3] for t in long_terms for i in range(len(t) - 2))
+            result.conditions.append(
+                f"id IN (SELECT rowid FROM {index} WHERE {index} MATCH ? ORDER BY rank LIMIT ?)"
+            )
+            result.arguments += [" OR ".join(_phrase(t) for t in trigrams), consts.SEARCH_FUZZY_LIMIT]
+            result.fuzzy = True
+            return result
+
+        result.conditions.append(f"id IN (SELECT rowid FROM {index} WHERE {index} MATCH ?)")
+        result.arguments.append(match)
+
+    # Words too short to have a trigram are checked against the table directly
+    for term in terms:
+        if len(term) < MIN_TERM_LENGTH:
+            result.conditions.append(
+                "(" + " OR ".join(f"{c} LIKE ? ESCAPE '\\'" for c in SEARCH_COLUMNS[table]) + ")"
+            )
+            result.arguments += [_like(term)] * len(SEARCH_COLUMNS[table])
+
+    return result
+
+
+def ask_search_text() -> Optional[str]:
+    """Asks the user for search text, returning None to clear the search"""
+    print("Enter search text (leave blank for none):")
+    text = input("> ").strip()
+    print()
+    return None if text == "" else text
+
+
+def print_search_status(text: Optional[str], condition: SearchCondition):
+    """Prints the search applied to a picker (if any)"""
+    if text is None:
+        return
+    if condition.fuzzy:
+        print(f"Nothing contains \"{text}\" - showing the closest matches")
+    else:
+        print(f"Showing matches for \"{text}\"")
+
+
+# (heading, columns displayed, column headings) of each entity table in the main menu search
+_SEARCH_RESULTS = {
+    "destinations": ("Destinations", "id, code, name", ["ID", "Code", "Name"]),
+    "aircraft": ("Aircraft", "id, name", ["ID", "Name"]),
+    "pilots": ("Pilots", "id, name, surname", ["ID", "Name", "Surname"]),
+}
+
+
+def search_everything(conn: sqlite3.Connection):
+    """
+    Allows the user to search the names of every pilot, aircraft and destination (and destination codes)
+    """
+    text = ask_search_text()
+    if text is None:
+        return
+
+    results = []
+    for table, (heading, columns, column_headings) in _SEARCH_RESULTS.items():
+        condition = search_condition(conn, table, text)
+        # Rows matching the text exactly (such as a destination code) are listed first
+        rows = conn.execute(
+            f"SELECT {columns} FROM {table} WHERE {' AND '.join(condition.conditions)} "
+            f"ORDER BY {SEARCH_COLUMNS[table][0]} = ? COLLATE NOCASE DESC, id LIMIT {consts.LIMIT_PER_PAGE + 1}",
+            condition.arguments + [text]
+        ).fetchall()
+        if len(rows) > 0:
+            results.append((heading, column_headings, condition.fuzzy, rows))
+
+    # The closest matches are only worth showing when nothing contains the text
+    if any(not fuzzy for _, _, fuzzy, _ in results):
+        results = [result for result in results if not result[2]]
+
+    for heading, column_headings, fuzzy, rows in results:
+        print(f"{heading}{' (closest matches)' if fuzzy else ''}:")
+        util.print_table([column_headings] + [[str(v) for v in row] for row in rows[:consts.LIMIT_PER_PAGE]])
+        if len(rows) > consts.LIMIT_PER_PAGE:
+            print(f"[SHOWING THE FIRST {consts.LIMIT_PER_PAGE} MATCHES]")
+        print()
+
+    if len(results) == 0:
+        print(f"Nothing matches \"{text}\"")
+        print()
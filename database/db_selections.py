@@ -0,0 +1,53 @@
+import itertools
+import json
+import sqlite3
+from typing import Iterable
+
+import util
+
+# Generation written to a selection table by the most recent load
+_generations = itertools.count(1)
+# Selection name -> (generation, IDs) of the last load into each selection table of each connection
+_loaded: util.ConnectionCache[dict[str, tuple[int, frozenset[int]]]] = util.ConnectionCache()
+
+
+def table_name(name: str) -> str:
+    """Returns the temporary table a selection is loaded into"""
+    return f"temp.selected_{name}"
+
+
+def _is_current(conn: sqlite3.Connection, name: str, generation: int) -> bool:
+    """
+    Returns True if a selection table still holds the rows of a load. A rolled back transaction leaves different
+    rows, which is spotted from the generation row
+    """
+    try:
+        row = conn.execute(f"SELECT MIN(id) FROM {table_name(name)}").fetchone()
+    except sqlite3.OperationalError:  # No such table
+        return False
+    return row[0] == -generation
+
+
+def load_selection(conn: sqlite3.Connection, name: str, ids: Iterable[int]) -> str:
+    """
+    Loads IDs into an indexed temporary table on the connection and returns its name. The table is only
+    rewritten when the IDs differ from the last load or the database has changed, so paging through a search
+    reuses it
+    """
+    ids = frozenset(ids)
+    loaded = _loaded.get(conn, dict)
+    if name in loaded and loaded[name][1] == ids and _is_current(conn, name, loaded[name][0]):
+        return table_name(name)
+
+    # The table is created from the IDs rather than inserted into, as INSERT and DELETE would open a transaction on
+    # the connection (and count as changes to it) while CREATE TABLE ... AS doesn't. IDs are never negative, so the
+    # generation is kept as a row that can't match anything
+    generation = next(_generations)
+    conn.execute(f"DROP TABLE IF EXISTS {table_name(name)}")
+    conn.execute(
+        f"CREATE TEMP TABLE selected_{name} AS SELECT value AS id FROM json_each(?)",
+        (json.dumps([-generation] + sorted(ids)),)
+    )
+    conn.execute(f"CREATE UNIQUE INDEX temp.selected_{name}_id ON selected_{name} (id)")
+    loaded[name] = (generation, ids)
+    return table_name(name)
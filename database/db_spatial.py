@@ -0,0 +1,209 @@
+import json
+import math
+import sqlite3
+from dataclasses import dataclass
+from typing import Optional
+
+import util
+from database import db_destinations
+
+# Mean radius of the Earth
+EARTH_RADIUS_KM = 6371.0088
+# Any two points are closer than this
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+# Radius the nearest destination search starts from (doubled until enough destinations are found)
+NEAREST_START_RADIUS_KM = 250.0
+
+
+def haversine_km(lat1: Optional[float], lon1: Optional[float],
+                 lat2: Optional[float], lon2: Optional[float]) -> Optional[float]:
+    """Returns the great-circle distance in km between two points given in degrees (None if any is NULL)"""
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def register_functions(conn: sqlite3.Connection):
+    """Registers haversine_km(lat1, lon1, lat2, lon2) on a connection"""
+    conn.create_function("haversine_km", 4, haversine_km, deterministic=True)
+
+
+def create_spatial_index(conn: sqlite3.Connection):
+    """
+    Creates an R*Tree over destination coordinates and the triggers keeping it in sync. An index created for an
+    existing database is filled from its current rows
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'destinations_rtree'").fetchone() is not None
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS destinations_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+    )
+
+    insert = ("INSERT INTO destinations_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+              "VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);")
+    delete = "DELETE FROM destinations_rtree WHERE id = OLD.id;"
+    for event, statements in [("INSERT", insert), ("DELETE", delete),
+                              ("UPDATE OF id, latitude, longitude", delete + "\n" + insert)]:
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS spatial_destinations_{event.split()[0].lower()} AFTER {event} ON destinations
+        BEGIN
+            {statements}
+        END
+        """)
+
+    if not exists:
+        conn.execute(
+            "INSERT INTO destinations_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+            "SELECT id, latitude, latitude, longitude, longitude FROM destinations"
+        )
+
+
+@dataclass
+class Circle:
+    """Class representing every point within radius_km of a centre given in degrees"""
+    latitude: float
+    longitude: float
+    radius_km: float
+
+    @staticmethod
+    def from_string(value: str) -> "Circle":
+        """Parses "latitude,longitude,radius_km", raising ValueError if it isn't valid"""
+        parts = value.split(",")
+        if len(parts) != 3:
+            raise ValueError("must be latitude,longitude,radius_km")
+        latitude, longitude, radius_km = map(float, parts)
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180 or radius_km < 0:
+            raise ValueError("latitude/longitude/radius out of range")
+        return Circle(latitude, longitude, radius_km)
+
+    def bounding_boxes(self) -> list[tuple[float, float, float, float]]:
+        """
+        Returns (min latitude, max latitude, min longitude, max longitude) boxes that together contain the circle.
+        A circle crossing the antimeridian is split into a box on each side
+        """
+        if self.radius_km >= MAX_DISTANCE_KM:
+            return [(-90.0, 90.0, -180.0, 180.0)]
+
+        angle = self.radius_km / EARTH_RADIUS_KM
+        min_lat = self.latitude - math.degrees(angle)
+        max_lat = self.latitude + math.degrees(angle)
+        # Circles reaching a pole contain every longitude
+        if min_lat <= -90.0 or max_lat >= 90.0:
+            return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+        # Widest point of the circle, which is north or south of the centre's latitude
+        delta_lon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(self.latitude)))))
+        min_lon = self.longitude - delta_lon
+        max_lon = self.longitude + delta_lon
+        if min_lon < -180.0:
+            return [(min_lat, max_lat, -180.0, max_lon), (min_lat, max_lat, min_lon + 360.0, 180.0)]
+        if max_lon > 180.0:
+            return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360.0)]
+        return [(min_lat, max_lat, min_lon, max_lon)]
+
+    def candidates_sql(self) -> tuple[str, list]:
+        """Returns (query selecting the IDs in the R*Tree inside the circle's bounding boxes, arguments)"""
+        boxes = self.bounding_boxes()
+        return candidates_sql(len(boxes)), [bound for box in boxes for bound in box]
+
+    def sql(self) -> tuple[str, list]:
+        """
+        Returns (query selecting the IDs of destinations inside the circle, arguments). Candidates are found with
+        the R*Tree and only those have their exact distance calculated
+        """
+        boxes = self.bounding_boxes()
+        return (
+            within_sql(len(boxes)),
+            [bound for box in boxes for bound in box] + [self.latitude, self.longitude, self.radius_km]
+        )
+
+    def to_string(self) -> str:
+        """Converts the circle to a user-readable string"""
+        return f"Within {self.radius_km:g} km of ({self.latitude:g}, {self.longitude:g})"
+
+
+def candidates_sql(box_count: int) -> str:
+    """Returns the query selecting the IDs in the R*Tree inside box_count bounding boxes"""
+    return " UNION ALL ".join(
+        "SELECT id FROM destinations_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?"
+        for _ in range(box_count)
+    )
+
+
+def within_sql(box_count: int) -> str:
+    """Returns the query Circle.sql gives for a circle covered by box_count bounding boxes"""
+    return (f"SELECT id FROM destinations WHERE id IN ({candidates_sql(box_count)}) "
+            f"AND haversine_km(latitude, longitude, ?, ?) <= ?")
+
+
+def destinations_within(conn: sqlite3.Connection, circle: Circle) -> list[tuple[int, float]]:
+    """Returns (ID, distance in km) of every destination inside a circle, nearest first"""
+    candidates, arguments = circle.candidates_sql()
+    return conn.execute(
+        f"SELECT id, haversine_km(latitude, longitude, ?, ?) AS distance FROM destinations "
+        f"WHERE id IN ({candidates}) AND distance <= ? ORDER BY distance, id",
+        [circle.latitude, circle.longitude] + arguments + [circle.radius_km]
+    ).fetchall()
+
+
+def nearest_destinations(conn: sqlite3.Connection, latitude: float, longitude: float, k: int,
+                         exclude: Optional[int] = None) -> list[tuple[int, float]]:
+    """
+    Returns (ID, distance in km) of the k destinations nearest a point, nearest first, optionally leaving out
+    one destination (such as the one the point was taken from). The search radius is doubled until it holds
+    at least k destinations, which are then guaranteed to be the nearest
+    """
+    radius = NEAREST_START_RADIUS_KM
+    while True:
+        found = [(i, d) for i, d in destinations_within(conn, Circle(latitude, longitude, radius)) if i != exclude]
+        if len(found) >= k or radius >= MAX_DISTANCE_KM:
+            return found[:k]
+        radius *= 2
+
+
+def get_coordinates(conn: sqlite3.Connection, destination_id: int) -> Optional[tuple[float, float]]:
+    """Returns the (latitude, longitude) of a destination or None if it doesn't exist"""
+    row = conn.execute("SELECT latitude, longitude FROM destinations WHERE id = ?", (destination_id,)).fetchone()
+    return None if row is None else (row[0], row[1])
+
+
+def nearby_options(conn: sqlite3.Connection):
+    """
+    Allows the user to find the destinations near a destination or a point
+    """
+    c = util.choices("Search around:", ["A Destination", "Coordinates"])
+    exclude = None
+    if c == 1:
+        exclude = db_destinations.get_destination(conn)
+        if exclude is None:
+            return
+        latitude, longitude = get_coordinates(conn, exclude)
+    else:
+        print("Enter latitude")
+        latitude = util.choose_float_range(-90.0, 90.0)
+        print("Enter longitude")
+        longitude = util.choose_float_range(-180.0, 180.0)
+
+    c = util.choices("Find:", ["Destinations Within a Distance", "Nearest Destinations"])
+    if c == 1:
+        print("Enter distance (km)")
+        radius = util.choose_float_range(0.0, MAX_DISTANCE_KM)
+        found = [(i, d) for i, d in destinations_within(conn, Circle(latitude, longitude, radius)) if i != exclude]
+    else:
+        print("Enter number of destinations")
+        found = nearest_destinations(conn, latitude, longitude, util.choose_number_from_range(1, 1000), exclude)
+
+    rows = {r[0]: r for r in conn.execute(
+        "SELECT destinations.id, code, name FROM json_each(?) AS ids JOIN destinations ON destinations.id = ids.value",
+        (json.dumps([i for i, _ in found]),)
+    )}
+    table = [["ID", "Code", "Name", "Distance (km)"]]
+    for _id, distance in found:
+        table.append([str(_id), rows[_id][1], rows[_id][2], f"{distance:.1f}"])
+
+    util.print_table(table)
+    if len(found) == 0:
+        print("[NO DESTINATIONS FOUND]")
+    print()
@@ -0,0 +1,289 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Optional
+
+import util
+
+# Length of a summary bucket in database time (ms). Buckets are UTC days numbered from the epoch
+DAY_MS = 86_400_000
+_DAY_SQL = f"departure_time / {DAY_MS}"
+
+
+class Dimension(Enum):
+    SOURCES = 1
+    DESTINATIONS = 2
+    AIRCRAFT = 3
+    PILOTS = 4
+
+    def get_name(self) -> str:
+        if self == Dimension.SOURCES:
+            return "Source"
+        elif self == Dimension.DESTINATIONS:
+            return "Destination"
+        elif self == Dimension.AIRCRAFT:
+            return "Aircraft"
+        elif self == Dimension.PILOTS:
+            return "Pilot"
+
+    def get_table(self) -> str:
+        """Returns the summary table counting flights per day of each entity"""
+        if self == Dimension.SOURCES:
+            return "traffic_sources"
+        elif self == Dimension.DESTINATIONS:
+            return "traffic_destinations"
+        elif self == Dimension.AIRCRAFT:
+            return "traffic_aircraft"
+        elif self == Dimension.PILOTS:
+            return "traffic_pilots"
+
+    def get_totals_table(self) -> str:
+        """Returns the summary table counting every flight of each entity"""
+        return self.get_table() + "_totals"
+
+    def get_entity_table(self) -> str:
+        if self == Dimension.SOURCES or self == Dimension.DESTINATIONS:
+            return "destinations"
+        elif self == Dimension.AIRCRAFT:
+            return "aircraft"
+        elif self == Dimension.PILOTS:
+            return "pilots"
+
+    def get_flights_sql(self) -> str:
+        """Returns a query selecting (entity ID, departure time) for every flight of every entity"""
+        if self == Dimension.SOURCES:
+            return "SELECT source_id AS entity_id, departure_time FROM flights"
+        elif self == Dimension.DESTINATIONS:
+            return "SELECT destination_id AS entity_id, departure_time FROM flights"
+        elif self == Dimension.AIRCRAFT:
+            return "SELECT aircraft_id AS entity_id, departure_time FROM flights"
+        elif self == Dimension.PILOTS:
+            return ("SELECT pilot_flights.pilot_id AS entity_id, flights.departure_time FROM flights "
+                    "JOIN pilot_flights ON pilot_flights.flight_id = flights.id")
+
+
+# Flight column counted by each summary kept by the flights triggers (pilots are kept by the pilot_flights triggers)
+_FLIGHT_COLUMNS = {
+    Dimension.SOURCES: "source_id",
+    Dimension.DESTINATIONS: "destination_id",
+    Dimension.AIRCRAFT: "aircraft_id",
+}
+
+
+def _add(dimension: Dimension, entity_id: str, day: str) -> str:
+    """Returns statements counting a flight of an entity departing on a day"""
+    return (f"INSERT INTO {dimension.get_table()} (entity_id, day, flights) VALUES ({entity_id}, {day}, 1) "
+            f"ON CONFLICT DO UPDATE SET flights = flights + 1;\n"
+            f"INSERT INTO {dimension.get_totals_table()} (entity_id, flights) VALUES ({entity_id}, 1) "
+            f"ON CONFLICT DO UPDATE SET flights = flights + 1;")
+
+
+def _remove(dimension: Dimension, entity_id: str, day: str) -> str:
+    """Returns statements uncounting a flight of an entity departing on a day (nothing if the day is NULL)"""
+    # Emptied buckets are dropped so the summaries only grow with the days that have traffic
+    table, totals = dimension.get_table(), dimension.get_totals_table()
+    return (f"UPDATE {table} SET flights = flights - 1 WHERE entity_id = {entity_id} AND day = {day};\n"
+            f"DELETE FROM {table} WHERE entity_id = {entity_id} AND day = {day} AND flights <= 0;\n"
+            f"UPDATE {totals} SET flights = flights - 1 WHERE entity_id = {entity_id} AND {day} IS NOT NULL;\n"
+            f"DELETE FROM {totals} WHERE entity_id = {entity_id} AND flights <= 0;")
+
+
+def _pilot_statements(sign: str, flight: str) -> str:
+    """Returns statements adding (+) or removing (-) a flight from the summaries of every pilot assigned to it"""
+    table, totals = Dimension.PILOTS.get_table(), Dimension.PILOTS.get_totals_table()
+    day = f"{flight}.departure_time / {DAY_MS}"
+    pilots = f"(SELECT pilot_id FROM pilot_flights WHERE flight_id = {flight}.id)"
+    if sign == "+":
+        return (f"INSERT INTO {table} (entity_id, day, flights) "
+                f"SELECT pilot_id, {day}, 1 FROM pilot_flights WHERE flight_id = {flight}.id "
+                f"ON CONFLICT DO UPDATE SET flights = flights + 1;\n"
+                f"INSERT INTO {totals} (entity_id, flights) "
+                f"SELECT pilot_id, 1 FROM pilot_flights WHERE flight_id = {flight}.id "
+                f"ON CONFLICT DO UPDATE SET flights = flights + 1;")
+    return (f"UPDATE {table} SET flights = flights - 1 WHERE day = {day} AND entity_id IN {pilots};\n"
+            f"DELETE FROM {table} WHERE day = {day} AND flights <= 0 AND entity_id IN {pilots};\n"
+            f"UPDATE {totals} SET flights = flights - 1 WHERE entity_id IN {pilots};\n"
+            f"DELETE FROM {totals} WHERE flights <= 0 AND entity_id IN {pilots};")
+
+
+def _assignment_statements(sign: str, assignment: str) -> str:
+    """Returns statements adding (+) or removing (-) a pilot_flights row from the pilot summaries"""
+    # NULL if the flight doesn't exist, so assignments to missing flights count nowhere
+    day = f"(SELECT {_DAY_SQL} FROM flights WHERE id = {assignment}.flight_id)"
+    if sign == "+":
+        return (f"INSERT INTO {Dimension.PILOTS.get_table()} (entity_id, day, flights) "
+                f"SELECT {assignment}.pilot_id, {_DAY_SQL}, 1 FROM flights WHERE id = {assignment}.flight_id "
+                f"ON CONFLICT DO UPDATE SET flights = flights + 1;\n"
+                f"INSERT INTO {Dimension.PILOTS.get_totals_table()} (entity_id, flights) "
+                f"SELECT {assignment}.pilot_id, 1 WHERE {day} IS NOT NULL "
+                f"ON CONFLICT DO UPDATE SET flights = flights + 1;")
+    return _remove(Dimension.PILOTS, f"{assignment}.pilot_id", day)
+
+
+def _triggers() -> dict[str, str]:
+    """Returns (trigger name: definition) of every trigger keeping the summaries up to date"""
+    def flight_statements(sign: str, flight: str) -> str:
+        day = f"{flight}.departure_time / {DAY_MS}"
+        make = _add if sign == "+" else _remove
+        return "\n".join(make(d, f"{flight}.{column}", day) for d, column in _FLIGHT_COLUMNS.items())
+
+    moved = " OR ".join(
+        [f"OLD.{column} IS NOT NEW.{column}" for column in _FLIGHT_COLUMNS.values()] +
+        [f"OLD.{_DAY_SQL} IS NOT NEW.{_DAY_SQL}"]
+    )
+    return {
+        "traffic_flights_insert": f"AFTER INSERT ON flights BEGIN\n{flight_statements('+', 'NEW')}\nEND",
+        # Runs before the flight goes so its pilots are still assigned (ON DELETE CASCADE removes them after, when
+        # the assignment triggers can no longer find the flight)
+        "traffic_flights_delete": (
+            f"BEFORE DELETE ON flights BEGIN\n{flight_statements('-', 'OLD')}\n{_pilot_statements('-', 'OLD')}\nEND"
+        ),
+        "traffic_flights_update": (
+            f"AFTER UPDATE OF source_id, destination_id, aircraft_id, departure_time ON flights WHEN {moved} BEGIN\n"
+            f"{flight_statements('-', 'OLD')}\n{flight_statements('+', 'NEW')}\n"
+            f"{_pilot_statements('-', 'OLD')}\n{_pilot_statements('+', 'NEW')}\nEND"
+        ),
+        "traffic_pilot_flights_insert": f"AFTER INSERT ON pilot_flights BEGIN\n{_assignment_statements('+', 'NEW')}\nEND",
+        "traffic_pilot_flights_delete": f"AFTER DELETE ON pilot_flights BEGIN\n{_assignment_statements('-', 'OLD')}\nEND",
+        "traffic_pilot_flights_update": (
+            f"AFTER UPDATE ON pilot_flights BEGIN\n{_assignment_statements('-', 'OLD')}\n"
+            f"{_assignment_statements('+', 'NEW')}\nEND"
+        ),
+    }
+
+
+def create_traffic_summaries(conn: sqlite3.Connection):
+    """
+    Creates the tables counting flights per day of every source, destination, aircraft and pilot, and the
+    triggers keeping them up to date. Summaries created for an existing database are filled from its flights
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'traffic_pilots'").fetchone() is not None
+    for dimension in Dimension:
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {dimension.get_table()} (
+            entity_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            flights INTEGER NOT NULL,
+            PRIMARY KEY (entity_id, day)
+        ) WITHOUT ROWID
+        """)
+        # Covers windows over every entity (the primary key covers one entity's series)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {dimension.get_table()}_day "
+                     f"ON {dimension.get_table()} (day, entity_id, flights)")
+        # All-time counts, so the busiest entities overall don't need every day of every entity summed
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {dimension.get_totals_table()} (
+            entity_id INTEGER NOT NULL PRIMARY KEY,
+            flights INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """)
+
+    for name, definition in _triggers().items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {definition}")
+
+    if not exists:
+        rebuild_traffic_summaries(conn)
+
+
+def rebuild_traffic_summaries(conn: sqlite3.Connection):
+    """Recomputes every summary from the flights"""
+    for dimension in Dimension:
+        conn.execute(f"DELETE FROM {dimension.get_table()}")
+        conn.execute(
+            f"INSERT INTO {dimension.get_table()} (entity_id, day, flights) "
+            f"SELECT entity_id, {_DAY_SQL} AS day, COUNT() FROM ({dimension.get_flights_sql()}) "
+            f"GROUP BY entity_id, day"
+        )
+        conn.execute(f"DELETE FROM {dimension.get_totals_table()}")
+        conn.execute(f"INSERT INTO {dimension.get_totals_table()} (entity_id, flights) "
+                     f"SELECT entity_id, SUM(flights) FROM {dimension.get_table()} GROUP BY entity_id")
+
+
+def day_of(dt: datetime) -> int:
+    """Returns the summary bucket containing a time"""
+    return util.dt_to_db(dt) // DAY_MS
+
+
+def day_start(day: int) -> datetime:
+    """Returns the start of a summary bucket"""
+    return datetime.fromtimestamp(0, timezone.utc) + timedelta(days=day)
+
+
+def flights_by_entity_sql(dimension: Dimension, after: Optional[datetime] = None,
+                          before: Optional[datetime] = None) -> tuple[str, list]:
+    """
+    Returns (query selecting (id, frequency) of every entity with flights departing in a window, arguments). Bounds
+    are exclusive and None when unbounded. Whole days are counted from the summaries and only the flights in the
+    partial days at either end are read
+    """
+    if after is None and before is None:
+        return f"SELECT entity_id AS id, flights AS frequency FROM {dimension.get_totals_table()}", []
+
+    first_day = None if after is None else util.dt_to_db(after) // DAY_MS + 1
+    last_day = None if before is None else util.dt_to_db(before) // DAY_MS - 1
+
+    # Half-open ranges of departure times in the partial days
+    edges = []
+    if first_day is not None and last_day is not None and first_day > last_day:
+        # Too short to contain a whole day
+        edges.append((util.dt_to_db(after) + 1, util.dt_to_db(before)))
+        first_day, last_day = 1, 0
+    else:
+        if first_day is not None:
+            edges.append((util.dt_to_db(after) + 1, first_day * DAY_MS))
+        if last_day is not None:
+            edges.append(((last_day + 1) * DAY_MS, util.dt_to_db(before)))
+
+    day_conditions, arguments = [], []
+    if first_day is not None:
+        day_conditions.append("day >= ?")
+        arguments.append(first_day)
+    if last_day is not None:
+        day_conditions.append("day <= ?")
+        arguments.append(last_day)
+    parts = [f"SELECT entity_id, flights FROM {dimension.get_table()} WHERE {' AND '.join(day_conditions)}"]
+
+    if len(edges) > 0:
+        parts.append(
+            f"SELECT entity_id, 1 FROM ({dimension.get_flights_sql()}) WHERE " +
+            " OR ".join(["(departure_time >= ? AND departure_time < ?)"] * len(edges))
+        )
+        arguments += [t for edge in edges for t in edge]
+
+    return (f"SELECT entity_id AS id, SUM(flights) AS frequency FROM ({' UNION ALL '.join(parts)}) "
+            f"GROUP BY entity_id"), arguments
+
+
+def flights_by_entity(conn: sqlite3.Connection, dimension: Dimension, after: Optional[datetime] = None,
+                      before: Optional[datetime] = None, limit: Optional[int] = None) -> list[tuple[int, int]]:
+    """Returns (entity ID, flight count) of the entities with the most flights departing in a window, busiest first"""
+    sql, arguments = flights_by_entity_sql(dimension, after, before)
+    return conn.execute(
+        f"SELECT id, frequency FROM ({sql}) ORDER BY frequency DESC, id" +
+        ("" if limit is None else f" LIMIT {int(limit)}"),
+        arguments
+    ).fetchall()
+
+
+def traffic_series(conn: sqlite3.Connection, dimension: Dimension, start: datetime, end: datetime,
+                   bucket_days: int = 1, entity_id: Optional[int] = None) -> list[tuple[datetime, int]]:
+    """
+    Returns (bucket start, flights) for every bucket of bucket_days days from the day containing start to the day
+    containing end, counting the flights of one entity or (if entity_id is None) of every entity. Read only from
+    the summaries, so the cost depends on the number of buckets rather than the number of flights
+    """
+    first_day, last_day = day_of(start), day_of(end)
+    conditions, arguments = ["day >= ?", "day <= ?"], [first_day, last_day]
+    if entity_id is not None:
+        conditions.append("entity_id = ?")
+        arguments.append(entity_id)
+
+    counts = dict(conn.execute(
+        f"SELECT (day - ?) / ? AS bucket, SUM(flights) FROM {dimension.get_table()} "
+        f"WHERE {' AND '.join(conditions)} GROUP BY bucket",
+        [first_day, bucket_days] + arguments
+    ).fetchall())
+    return [
+        (day_start(first_day + bucket * bucket_days), counts.get(bucket, 0))
+        for bucket in range((last_day - first_day) // bucket_days + 1)
+    ]
@@ -0,0 +1,259 @@
+"""
+Exports flights matching search criteria to CSV, JSONL, Parquet or a text table. Run with:
+    python export.py [--db table.db] [--departure-after 2024-01-01] [--destinations 1,2] ... flights.csv
+The format is taken from the file extension unless --format is given. Rows are streamed from the database in
+batches so memory use doesn't depend on the number of flights exported. CSV and JSONL exports can be loaded
+back with ingest.py
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+from datetime import datetime
+from enum import Enum
+from typing import Callable, Optional
+
+import tables
+import util
+from database import db_flight_query
+from database import db_flight_records
+from database import db_spatial
+
+# Flights written per batch
+EXPORT_BATCH_SIZE = 10_000
+
+
+class ExportFormat(Enum):
+    CSV = 1
+    JSONL = 2
+    PARQUET = 3
+    TABLE = 4
+
+    def get_extension(self) -> str:
+        if self == ExportFormat.CSV:
+            return ".csv"
+        elif self == ExportFormat.JSONL:
+            return ".jsonl"
+        elif self == ExportFormat.PARQUET:
+            return ".parquet"
+        elif self == ExportFormat.TABLE:
+            return ".txt"
+
+    @staticmethod
+    def from_path(path: str) -> Optional["ExportFormat"]:
+        for export_format in ExportFormat:
+            if path.lower().endswith(export_format.get_extension()):
+                return export_format
+        return None
+
+
+# Flat columns written for every flight. Pilots are written as a list in JSONL and Parquet and as ";" separated
+# pilot_ids and pilot_names columns in CSV
+COLUMNS = ["id", "departure_time", "arrival_time", "source_id", "source_name", "destination_id",
+           "destination_name", "aircraft_id", "aircraft_name"]
+
+
+def _flat_values(record: db_flight_records.FlightRecord) -> list:
+    return [record.id, record.departure_time.isoformat(), record.arrival_time.isoformat(),
+            record.source_id, record.source_name, record.destination_id, record.destination_name,
+            record.aircraft_id, record.aircraft_name]
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS + ["pilot_ids", "pilot_names"])
+
+    def write(self, batch: list[db_flight_records.FlightRecord]):
+        self.writer.writerows(
+            _flat_values(r) + [";".join(str(p[0]) for p in r.pilots), ";".join(p[1] or "" for p in r.pilots)]
+            for r in batch
+        )
+
+    def close(self):
+        self.file.close()
+
+
+class _JsonlWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, batch: list[db_flight_records.FlightRecord]):
+        self.file.write("".join(
+            json.dumps({
+                **dict(zip(COLUMNS, _flat_values(r))),
+                "pilots": [{"id": p[0], "name": p[1]} for p in r.pilots]
+            }) + "\n"
+            for r in batch
+        ))
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+        self.pyarrow = pyarrow
+        timestamp = pyarrow.timestamp("ms", tz="UTC")
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("departure_time", timestamp),
+            ("arrival_time", timestamp),
+            ("source_id", pyarrow.int64()),
+            ("source_name", pyarrow.string()),
+            ("destination_id", pyarrow.int64()),
+            ("destination_name", pyarrow.string()),
+            ("aircraft_id", pyarrow.int64()),
+            ("aircraft_name", pyarrow.string()),
+            ("pilots", pyarrow.list_(pyarrow.struct([("id", pyarrow.int64()), ("name", pyarrow.string())]))),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, batch: list[db_flight_records.FlightRecord]):
+        self.writer.write_batch(self.pyarrow.RecordBatch.from_pydict({
+            "id": [r.id for r in batch],
+            "departure_time": [r.departure_time for r in batch],
+            "arrival_time": [r.arrival_time for r in batch],
+            "source_id": [r.source_id for r in batch],
+            "source_name": [r.source_name for r in batch],
+            "destination_id": [r.destination_id for r in batch],
+            "destination_name": [r.destination_name for r in batch],
+            "aircraft_id": [r.aircraft_id for r in batch],
+            "aircraft_name": [r.aircraft_name for r in batch],
+            "pilots": [[{"id": p[0], "name": p[1]} for p in r.pilots] for r in batch],
+        }, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class _TableWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w", encoding="utf-8")
+        self.writer = tables.TableWriter(COLUMNS + ["pilots"], out=self.file)
+
+    def write(self, batch: list[db_flight_records.FlightRecord]):
+        self.writer.write_rows(
+            ["" if v is None else str(v) for v in _flat_values(r)] + [", ".join(p[1] or "" for p in r.pilots)]
+            for r in batch
+        )
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+def export_flights(conn: sqlite3.Connection, query: db_flight_query.FlightQuery, path: str,
+                   export_format: ExportFormat, progress: Optional[Callable[[int, int], None]] = None,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Writes every flight matching the query to a file and returns the number of flights written.
+    progress (if given) is called with (flights written, total flights) after every batch
+    """
+    total = db_flight_query.count_flights(conn, query) if progress is not None else 0
+
+    if export_format == ExportFormat.CSV:
+        writer = _CsvWriter(path)
+    elif export_format == ExportFormat.JSONL:
+        writer = _JsonlWriter(path)
+    elif export_format == ExportFormat.PARQUET:
+        writer = _ParquetWriter(path)
+    else:  # export_format == ExportFormat.TABLE
+        writer = _TableWriter(path)
+
+    written = 0
+    try:
+        for batch in db_flight_query.iter_flight_batches(conn, query, batch_size):
+            writer.write(batch)
+            written += len(batch)
+            if progress is not None:
+                progress(written, total)
+    finally:
+        writer.close()
+    return written
+
+
+def print_progress(written: int, total: int):
+    """Prints export progress over the previous progress line"""
+    percent = 100 if total == 0 else written * 100 // total
+    print(f"\rExported {written}/{total} flight(s) ({percent}%)", end="", file=sys.stderr, flush=True)
+
+
+def export_options(conn: sqlite3.Connection, query: db_flight_query.FlightQuery):
+    """
+    Allows the user to export the flights matching a query
+    """
+    c = util.choices("Select format:", ["CSV", "JSONL", "Parquet", "Text Table"])
+    export_format = ExportFormat(c)
+
+    print("Enter file name:")
+    path = input("> ")
+    print()
+    if ExportFormat.from_path(path) is None:
+        path += export_format.get_extension()
+
+    try:
+        written = export_flights(conn, query, path, export_format, print_progress)
+    except (OSError, RuntimeError) as e:
+        print(f"Export failed: {e}")
+        print()
+        return
+
+    print(file=sys.stderr)
+    print(f"Exported {written} flight(s) to {path}")
+    print()
+
+
+if __name__ == '__main__':
+    def id_set(value: str) -> set[int]:
+        return {int(v) for v in value.split(",") if v.strip() != ""}
+
+    parser = argparse.ArgumentParser(description="Export flights to CSV, JSONL, Parquet or a text table")
+    parser.add_argument("path", help="file to write")
+    parser.add_argument("--db", default="table.db", help="database to export from")
+    parser.add_argument("--format", choices=[f.name.lower() for f in ExportFormat],
+                        help="defaults to the format matching the file extension")
+    for bound in ["departure-after", "departure-before", "arrival-after", "arrival-before"]:
+        parser.add_argument(f"--{bound}", type=datetime.fromisoformat, help="ISO 8601 time (exclusive)")
+    for selection in ["sources", "destinations", "pilots", "aircraft"]:
+        parser.add_argument(f"--{selection}", type=id_set, default=set(), help="comma separated IDs")
+    for area in ["source-within", "destination-within"]:
+        parser.add_argument(f"--{area}", type=db_spatial.Circle.from_string, metavar="LAT,LON,KM",
+                            help="only sources/destinations within a distance of a point")
+    parser.add_argument("--descending", action="store_true", help="export latest departures first")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress")
+    args = parser.parse_args()
+
+    if args.format is not None:
+        export_format = ExportFormat[args.format.upper()]
+    else:
+        export_format = ExportFormat.from_path(args.path)
+        if export_format is None:
+            parser.error("can't tell the format from the file extension - use --format")
+
+    query = db_flight_query.FlightQuery(
+        args.departure_after, args.departure_before, args.arrival_after, args.arrival_before,
+        args.sources, args.destinations, args.pilots, args.aircraft, not args.descending,
+        args.source_within, args.destination_within
+    )
+
+    conn = sqlite3.connect(args.db)
+    db_spatial.register_functions(conn)
+    try:
+        started = datetime.now()
+        written = export_flights(conn, query, args.path, export_format, None if args.quiet else print_progress)
+        if not args.quiet:
+            print(file=sys.stderr)
+        print(f"Exported {written} flight(s) in {(datetime.now() - started).total_seconds():.2f}s")
+    except RuntimeError as e:
+        sys.exit(f"Export failed: {e}")
+    finally:
+        conn.close()
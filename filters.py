@@ -2,15 +2,14 @@ import sqlite3
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Optional, Callable
+from typing import Optional
 
 import util
 from database import db_aircraft
 from database import db_destinations
 from database import db_pilots
-from database.db_aircraft import get_aircraft_from_id
-from database.db_destinations import get_destinations_from_id
-from database.db_pilots import get_pilot_from_id
+from database import db_names
+from database import db_spatial
 
 from util import dt_format, choices, get_datetime_or_none
 
@@ -21,17 +20,6 @@ class DateRange:
     start: Optional[datetime] = field(default_factory=lambda: datetime.now())
     end: Optional[datetime] = None
 
-    def get_condition_or_none(self, column: str) -> Optional[tuple[str, list[int]]]:
-        """Returns (SQL condition, arguments) or None based on data"""
-        if self.start is None and self.end is None:
-            return None
-        elif self.end is None:
-            return f"{column} > ?", [util.dt_to_db(self.start)]
-        elif self.start is None:
-            return f"{column} < ?", [util.dt_to_db(self.end)]
-        else:
-            return f"{column} > ? AND {column} < ?", [int(self.start.timestamp()), int(self.end.timestamp())]
-
     def modify(self):
         """Allows the user to modify the date range"""
         def time_or_none_to_str(dt: Optional[datetime]) -> str:
@@ -61,6 +49,55 @@ class DateRange:
             return f"From {dt_format(self.start)} to {dt_format(self.end)}"
 
 
+@dataclass
+class AreaFilter:
+    """Class representing a filter on destinations within a distance of another destination"""
+    centre_id: Optional[int] = None
+    radius_km: float = 500.0
+    circle: Optional[db_spatial.Circle] = None
+
+    def modify(self, conn: sqlite3.Connection):
+        """Allows the user to modify the centre and distance"""
+        while True:
+            c = choices("Select an option:", [
+                f"Change Centre - {self.centre_to_string(conn)}",
+                f"Change Distance - {self.radius_km:g} km",
+                f"Clear",
+                f"Done"
+            ])
+
+            if c == 1:
+                centre_id = db_destinations.get_destination(conn)
+                if centre_id is not None:
+                    self.centre_id = centre_id
+            elif c == 2:
+                print("Enter distance (km)")
+                self.radius_km = util.choose_float_range(0.0, db_spatial.MAX_DISTANCE_KM)
+            elif c == 3:
+                self.centre_id = None
+            else:
+                break
+
+        # The centre's coordinates are looked up once so the area can be searched without them
+        self.circle = None
+        if self.centre_id is not None:
+            coordinates = db_spatial.get_coordinates(conn, self.centre_id)
+            if coordinates is not None:
+                self.circle = db_spatial.Circle(coordinates[0], coordinates[1], self.radius_km)
+
+    def centre_to_string(self, conn: sqlite3.Connection) -> str:
+        """Returns the name of the centre destination"""
+        if self.centre_id is None:
+            return "None"
+        return db_destinations.get_destinations_from_id(conn, self.centre_id)
+
+    def to_string(self, conn: sqlite3.Connection) -> str:
+        """Converts the area to a user-readable string"""
+        if self.circle is None:
+            return "Any"
+        return f"Within {self.radius_km:g} km of {self.centre_to_string(conn)}"
+
+
 class MultiSelectionType(Enum):
     DESTINATION = 1
     PILOT = 2
@@ -73,21 +110,6 @@ class MultiSelection:
     selection_type: MultiSelectionType
     selection: set[int] = field(default_factory=list)
 
-    def get_condition_or_none(self) -> Optional[tuple[str, list[int]]]:
-        """Returns (SQL condition, arguments) or None based on data"""
-        if len(self.selection) == 0: return None
-
-        if self.selection_type == MultiSelectionType.DESTINATION:
-            return f"destination_id in ({', '.join(['?' for _ in range(len(self.selection))])})", list(self.selection)
-        elif self.selection_type == MultiSelectionType.AIRCRAFT:
-            return f"aircraft_id in ({', '.join(['?' for _ in range(len(self.selection))])})", list(self.selection)
-        elif self.selection_type == MultiSelectionType.PILOT:
-            return (
-                f"id in (SELECT flight_id FROM pilot_flights WHERE "
-                f"pilot_id in ({', '.join(['?' for _ in range(len(self.selection))])}))",
-                list(self.selection)
-            )
-
     def modify(self, conn: sqlite3.Connection, assignment=False):
         """Allows the user to modify the selection"""
         if self.selection_type == MultiSelectionType.DESTINATION:
@@ -99,17 +121,20 @@ class MultiSelection:
 
     def to_string(self, conn: sqlite3.Connection, assignment=False) -> str:
         """Converts the selection to a user-readable string"""
-        def selection_to_string(sel: set[int], f: Callable[[sqlite3.Connection, int], str], a: bool) -> str:
+        def selection_to_string(sel: set[int], table: str, missing: str, a: bool) -> str:
             if a:
                 s = "None"
             else:
                 s = "Any"
             if len(sel) != 0:
-                s = ", ".join(map(lambda x: f(conn, x), sel))
+                # Every name is resolved with at most one query
+                names = db_names.get_names(conn, table, sel)
+                s = ", ".join(missing if names[x] is None else names[x] for x in sel)
             return s
 
-        string_builder = lambda f: selection_to_string(self.selection, f, assignment)
+        string_builder = lambda t, m: selection_to_string(self.selection, t, m, assignment)
 
-        if self.selection_type == MultiSelectionType.DESTINATION: return string_builder(get_destinations_from_id)
-        elif self.selection_type == MultiSelectionType.PILOT: return string_builder(get_pilot_from_id)
-        elif self.selection_type == MultiSelectionType.AIRCRAFT: return string_builder(get_aircraft_from_id)
+        if self.selection_type == MultiSelectionType.DESTINATION:
+            return string_builder("destinations", "[INVALID DESTINATION]")
+        elif self.selection_type == MultiSelectionType.PILOT: return string_builder("pilots", "[NO PILOT]")
+        elif self.selection_type == MultiSelectionType.AIRCRAFT: return string_builder("aircraft", "[INVALID AIRCRAFT]")
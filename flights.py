@@ -2,8 +2,13 @@ import sqlite3
 from dataclasses import dataclass, field
 
 from database import db_flights
+from database import db_flight_query
+from database import db_profiling
+import assignment
+import export
 import util
-from filters import DateRange, MultiSelection, MultiSelectionType
+from filters import AreaFilter, DateRange, MultiSelection, MultiSelectionType
+from pagination import KeysetPager
 from util import choices
 import consts
 
@@ -16,111 +21,104 @@ class FlightSearchOptions:
     destinations: MultiSelection = field(default_factory=lambda: MultiSelection(MultiSelectionType.DESTINATION))
     pilots: MultiSelection = field(default_factory=lambda: MultiSelection(MultiSelectionType.PILOT))
     aircraft: MultiSelection = field(default_factory=lambda: MultiSelection(MultiSelectionType.AIRCRAFT))
-    ascending: bool = True
-    page: int = 0
-    has_next_page: bool = False
+    source_area: AreaFilter = field(default_factory=AreaFilter)
+    destination_area: AreaFilter = field(default_factory=AreaFilter)
+    pager: KeysetPager = field(default_factory=lambda: KeysetPager(("departure_time", "id")))
 
     def modify(self, conn: sqlite3.Connection) -> int:
         """
         Allow users to modify the search criteria or add/modify/delete flights
         """
-        page_text = ["No Previous Page", "No Next Page"]
+        page_text = self.pager.page_text()
 
-        if self.page > 0:
-            page_text[0] = f"Previous Page ({self.page})"
-        if self.has_next_page:
-            page_text[1] = f"Next Page ({self.page + 2})"
-
-        c = choices("Select an option:", [
+        menu = [
             f"Change Departure Time Range - {self.departure_time.to_string()}",
             f"Change Arrival Time Range - {self.arrival_time.to_string()}",
             f"Change Sources - {self.sources.to_string(conn)}",
             f"Change Destinations - {self.destinations.to_string(conn)}",
+            f"Change Source Area - {self.source_area.to_string(conn)}",
+            f"Change Destination Area - {self.destination_area.to_string(conn)}",
             f"Change Pilots - {self.pilots.to_string(conn)}",
             f"Change Aircraft - {self.aircraft.to_string(conn)}",
-            f"Change Result Order - Departure Time {'Ascending' if self.ascending else 'Descending'}",
+            f"Change Result Order - Departure Time {'Ascending' if self.pager.ascending else 'Descending'}",
             page_text[0],
             page_text[1],
+            f"Jump to Departure Date",
             f"View/Modify/Delete Flight",
             f"Add Flight",
+            f"Export Flights",
+            f"Assign Aircraft and Pilots",
             f"Return"
-        ])
-
-        reset_page = True
-
-        if c == 1: self.departure_time.modify()
-        elif c == 2: self.arrival_time.modify()
-        elif c == 3: self.sources.modify(conn)
-        elif c == 4: self.destinations.modify(conn)
-        elif c == 5: self.pilots.modify(conn)
-        elif c == 6: self.aircraft.modify(conn)
-        # Change ordering
-        elif c == 7: self.ascending = not self.ascending
-        # Prev page
-        elif c == 8:
-            if self.page > 0:
-                self.page -= 1
-            reset_page = False
-        # Next page
-        elif c == 9:
-            if self.has_next_page:
-                self.page += 1
-            reset_page = False
-        # Modify flight
-        elif c == 10:
-            print("Enter flight ID:")
-            db_flights.modify_flight(conn, util.choose_number())
-        # New flight
-        elif c == 11:
-            db_flights.modify_flight(conn, None)
-        # Done
-        elif c == 12: return False
-
-        if reset_page:
-            self.page = 0
-
-        return True
+        ]
+        c = choices("Select an option:", menu, conn)
+
+        # Another session changed the data - redraw the same page
+        if c == 0: return True
+        with db_profiling.action(conn, menu[c - 1]):
+            reset_page = True
+
+            if c == 1: self.departure_time.modify()
+            elif c == 2: self.arrival_time.modify()
+            elif c == 3: self.sources.modify(conn)
+            elif c == 4: self.destinations.modify(conn)
+            elif c == 5: self.source_area.modify(conn)
+            elif c == 6: self.destination_area.modify(conn)
+            elif c == 7: self.pilots.modify(conn)
+            elif c == 8: self.aircraft.modify(conn)
+            # Change ordering
+            elif c == 9: self.pager.ascending = not self.pager.ascending
+            # Prev page
+            elif c == 10:
+                self.pager.previous_page()
+                reset_page = False
+            # Next page
+            elif c == 11:
+                self.pager.next_page()
+                reset_page = False
+            # Jump to date
+            elif c == 12:
+                self.pager.seek(util.dt_to_db(util.get_datetime()))
+                reset_page = False
+            # Modify flight
+            elif c == 13:
+                print("Enter flight ID:")
+                db_flights.modify_flight(conn, util.choose_number())
+            # New flight
+            elif c == 14:
+                db_flights.modify_flight(conn, None)
+            # Export
+            elif c == 15:
+                export.export_options(conn, self.to_query())
+                reset_page = False
+            # Assign aircraft and pilots to the matching flights
+            elif c == 16:
+                assignment.assignment_options(conn, self.to_query())
+            # Done
+            elif c == 17: return False
+
+            if reset_page:
+                self.pager.reset()
+
+            return True
+
+    def to_query(self) -> db_flight_query.FlightQuery:
+        """Returns the query matching the current search options"""
+        return db_flight_query.FlightQuery(
+            self.departure_time.start, self.departure_time.end,
+            self.arrival_time.start, self.arrival_time.end,
+            set(self.sources.selection), set(self.destinations.selection),
+            set(self.pilots.selection), set(self.aircraft.selection),
+            self.pager.ascending, self.source_area.circle, self.destination_area.circle
+        )
 
     def display_flights(self, conn: sqlite3.Connection):
         """
         Displays the flights given the current search options
         """
-        conditions = []
-        arguments = []
-
-        # All search conditions
-        temp = [
-            self.departure_time.get_condition_or_none("departure_time"),
-            self.arrival_time.get_condition_or_none("arrival_time"),
-            self.sources.get_condition_or_none(),
-            self.destinations.get_condition_or_none(),
-            self.pilots.get_condition_or_none()
-        ]
-
-        for r in temp:
-            if r is not None:
-                # Apply condition
-                conditions.append(r[0])
-                arguments += r[1]
-
-        if len(conditions) == 0:
-            conditions = ""
-        else:
-            conditions = "WHERE " + " AND ".join(conditions)
+        rows = db_flight_query.page_flights(conn, self.to_query(), self.pager)
 
-        rows = conn.execute(
-            f"SELECT id, departure_time, arrival_time, source_id, destination_id, aircraft_id FROM flights "
-            f"{conditions} ORDER BY departure_time {'ASC' if self.ascending else 'DESC'} LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * self.page}",
-            arguments
-        ).fetchall()
-
-        self.has_next_page = False
-        if len(rows) > consts.LIMIT_PER_PAGE:
-            self.has_next_page = True
-            rows = rows[:consts.LIMIT_PER_PAGE]
-
-        print(f"Page: {self.page + 1}")
-        util.print_flight_rows(conn, rows, consts.LIMIT_PER_PAGE)
+        print(f"Page: {self.pager.to_string()}")
+        util.print_flight_rows(rows, consts.LIMIT_PER_PAGE)
 
         if len(rows) == 0:
             print("[NO DATA FOR CRITERIA]")
@@ -132,7 +130,9 @@ def flight_options(conn: sqlite3.Connection):
     Allows users to view and modify flights
     """
     options = FlightSearchOptions()
-    options.display_flights(conn)
+    with db_profiling.action(conn, "Display Flights"):
+        options.display_flights(conn)
 
     while options.modify(conn):
-        options.display_flights(conn)
+        with db_profiling.action(conn, "Display Flights"):
+            options.display_flights(conn)
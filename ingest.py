@@ -0,0 +1,334 @@
+"""
+Bulk loads pilots, aircraft, destinations, flights and crew assignments from CSV or JSONL files. Run with:
+    python ingest.py [--db table.db] [--rejects rejects.csv] flights=flights.csv crew=crew.jsonl ...
+Files are loaded in dependency order (aircraft, destinations, pilots, flights then crew) so a single run can load
+a whole schedule. Each file may give explicit IDs (an "id" column) so later files can refer to its rows
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import operator
+import sqlite3
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Iterator, Optional, TextIO
+
+import util
+from database import db_initialisation
+
+# Rows sent to SQLite per executemany call
+BATCH_SIZE = 50_000
+
+# PRAGMAs used while loading. Foreign keys are validated in bulk instead of row by row
+_LOAD_PRAGMAS = {
+    "foreign_keys": "OFF",
+    "synchronous": "OFF",
+    "cache_size": "-262144",
+    "temp_store": "MEMORY",
+}
+
+
+def parse_time(value: Any) -> Optional[int]:
+    """
+    Parses a time given as an ISO 8601 string into the database representation (ms since the epoch).
+    Returns None if it isn't valid
+    """
+    try:
+        return util.dt_to_db(datetime.fromisoformat(str(value).strip()))
+    except ValueError:
+        return None
+
+
+# Staging column types. Values are staged as read and SQLite's type affinity converts numeric text, so the
+# type of a staged value shows whether it was valid. TIME columns also accept ISO 8601 strings
+INTEGER = "INTEGER"
+REAL = "REAL"
+TEXT = "TEXT"
+TIME = "TIME"
+
+
+@dataclass
+class EntitySpec:
+    """Class describing how a file is loaded into a table"""
+    table: str
+    # (column, type) for every column read from the file
+    columns: list[tuple[str, str]]
+    # (reason, condition on the staged row s) for rows that are rejected once the file is staged
+    rejections: list[tuple[str, str]]
+    has_id: bool = True
+    # Expressions (on staged columns) inserted instead of the staged value
+    expressions: dict[str, str] = field(default_factory=dict)
+
+
+def _duplicate_id(table: str) -> tuple[str, str]:
+    # Blank IDs are assigned one when the row is inserted, so are never duplicates
+    return (
+        "duplicate id",
+        f"nullif(s.id, '') IS NOT NULL AND EXISTS (SELECT 1 FROM {table} WHERE {table}.id = s.id) "
+        f"OR nullif(s.id, '') IS NOT NULL AND EXISTS (SELECT 1 FROM ingest_staging AS p "
+        f"WHERE p.id = s.id AND p.line < s.line)"
+    )
+
+
+def _missing(table: str, column: str) -> tuple[str, str]:
+    return f"unknown {column}", f"NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.id = s.{column})"
+
+
+# In the order they are loaded
+ENTITIES = {
+    "aircraft": EntitySpec("aircraft", [("name", TEXT)], [_duplicate_id("aircraft")]),
+    "destinations": EntitySpec(
+        "destinations",
+        [("name", TEXT), ("code", TEXT), ("latitude", REAL), ("longitude", REAL)],
+        [
+            _duplicate_id("destinations"),
+            ("invalid latitude", "s.latitude > 90 OR s.latitude < -90"),
+            ("invalid longitude", "s.longitude > 180 OR s.longitude < -180"),
+            ("invalid code", "length(trim(s.code)) > 4"),
+        ],
+        expressions={"code": "upper(trim(code))"}
+    ),
+    "pilots": EntitySpec(
+        "pilots",
+        [("name", TEXT), ("surname", TEXT), ("date_joined", TIME)],
+        [_duplicate_id("pilots")]
+    ),
+    "flights": EntitySpec(
+        "flights",
+        [("source_id", INTEGER), ("destination_id", INTEGER), ("departure_time", TIME), ("arrival_time", TIME),
+         ("aircraft_id", INTEGER)],
+        [
+            _duplicate_id("flights"),
+            _missing("destinations", "source_id"),
+            _missing("destinations", "destination_id"),
+            _missing("aircraft", "aircraft_id"),
+            ("arrival before departure", "s.arrival_time < s.departure_time"),
+        ]
+    ),
+    "crew": EntitySpec(
+        "pilot_flights",
+        [("pilot_id", INTEGER), ("flight_id", INTEGER)],
+        [
+            _missing("pilots", "pilot_id"),
+            _missing("flights", "flight_id"),
+            (
+                "duplicate assignment",
+                "EXISTS (SELECT 1 FROM pilot_flights WHERE pilot_id = s.pilot_id AND flight_id = s.flight_id) "
+                "OR EXISTS (SELECT 1 FROM ingest_staging AS p "
+                "WHERE p.pilot_id = s.pilot_id AND p.flight_id = s.flight_id AND p.line < s.line)"
+            ),
+        ],
+        has_id=False
+    ),
+}
+
+
+@dataclass
+class IngestResult:
+    """Class representing the outcome of loading one file"""
+    entity: str
+    path: str
+    loaded: int = 0
+    rejected: Counter = field(default_factory=Counter)
+
+
+def read_records(path: str, columns: list[str]) -> Iterator[tuple]:
+    """
+    Streams (line number, *values of columns, reason) from a CSV file with a header row or a JSONL file.
+    Missing values are None, and reason is None unless the line couldn't be read as a record at all
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+            unreadable = [None] * len(columns)
+            for line_no, line in enumerate(f, start=1):
+                if line.strip() == "":
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_no, *unreadable, "malformed JSON"
+                    continue
+                if not isinstance(record, dict):
+                    yield line_no, *unreadable, "not a JSON object"
+                    continue
+                values = [record.get(c) for c in columns]
+                # Nested values can't be bound and are rejected as invalid
+                yield (line_no, *[json.dumps(v) if isinstance(v, (dict, list)) else v for v in values], None)
+        else:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            missing = [c for c in columns if c not in header and c != "id"]
+            if len(missing) > 0:
+                raise ValueError(f"{path} is missing column(s): {', '.join(missing)}")
+
+            width = len(header)
+            indexes = [header.index(c) for c in columns if c in header]
+            no_id = "id" in columns and "id" not in header
+            get = operator.itemgetter(*indexes)
+            for row in reader:
+                if len(row) < width:
+                    row += [None] * (width - len(row))
+                values = get(row)
+                if len(indexes) == 1:
+                    values = (values,)
+                yield (reader.line_num, None, *values, None) if no_id else (reader.line_num, *values, None)
+
+
+@dataclass
+class RejectLog:
+    """Class writing rejected rows to a CSV file (if one was given)"""
+    file: Optional[TextIO] = None
+    writer: Any = None
+
+    def write(self, entity: str, path: str, line: int, reason: str):
+        if self.file is None:
+            return
+        if self.writer is None:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["entity", "file", "line", "reason"])
+        self.writer.writerow([entity, path, line, reason])
+
+
+def _column_rejections(spec: EntitySpec) -> list[tuple[str, str]]:
+    """Returns the rejections for values that are missing or have the wrong type"""
+    rejections = []
+    if spec.has_id:
+        rejections.append(("invalid id", "s.id IS NOT NULL AND s.id != '' AND typeof(s.id) != 'integer'"))
+    for column, column_type in spec.columns:
+        rejections.append((f"missing {column}", f"s.{column} IS NULL OR trim(s.{column}) = ''"))
+        if column_type in (INTEGER, TIME):
+            rejections.append((f"invalid {column}", f"typeof(s.{column}) != 'integer'"))
+        elif column_type == REAL:
+            rejections.append((f"invalid {column}", f"typeof(s.{column}) NOT IN ('integer', 'real')"))
+    return rejections
+
+
+def _stage(conn: sqlite3.Connection, spec: EntitySpec, path: str):
+    """Streams a file into the staging table in batches"""
+    columns = (["id"] if spec.has_id else []) + [c for c, _ in spec.columns]
+    types = ([INTEGER] if spec.has_id else []) + [t for _, t in spec.columns]
+    affinities = [INTEGER if t == TIME else t for t in types]
+    conn.execute(
+        f"CREATE TEMP TABLE ingest_staging (line INTEGER PRIMARY KEY, "
+        f"{', '.join([f'{c} {a}' for c, a in zip(columns, affinities)])}, reason TEXT)"
+    )
+
+    insert = (f"INSERT INTO ingest_staging (line, {', '.join(columns)}, reason) "
+              f"VALUES ({', '.join(['?' for _ in range(len(columns) + 2)])})")
+    records = read_records(path, columns)
+    while True:
+        batch = list(itertools.islice(records, BATCH_SIZE))
+        if len(batch) == 0:
+            break
+        conn.executemany(insert, batch)
+
+    # Convert ISO 8601 times (only rows using them go through Python)
+    for column, column_type in spec.columns:
+        if column_type == TIME:
+            conn.execute(
+                f"UPDATE ingest_staging SET {column} = coalesce(ingest_parse_time({column}), {column}) "
+                f"WHERE typeof({column}) = 'text'"
+            )
+
+    # Indexes used by the duplicate checks are cheaper to build once everything is staged
+    if spec.has_id:
+        conn.execute("CREATE INDEX temp.ingest_staging_id ON ingest_staging (id)")
+    else:
+        conn.execute("CREATE INDEX temp.ingest_staging_pair ON ingest_staging (pilot_id, flight_id)")
+
+
+def ingest_file(conn: sqlite3.Connection, entity: str, path: str,
+                rejects: Optional[RejectLog] = None) -> IngestResult:
+    """Loads a file into the table for the entity in one transaction, rejecting invalid rows"""
+    spec = ENTITIES[entity]
+    result = IngestResult(entity, path)
+    reject_log = RejectLog() if rejects is None else rejects
+    conn.create_function("ingest_parse_time", 1, parse_time, deterministic=True)
+
+    try:
+        _stage(conn, spec, path)
+
+        # Validate every staged row in one statement (lines that couldn't be read are already rejected)
+        reasons = " ".join([
+            f"WHEN {condition} THEN '{reason}'" for reason, condition in _column_rejections(spec) + spec.rejections
+        ])
+        conn.execute(
+            f"UPDATE ingest_staging AS s SET reason = CASE {reasons} END "
+            f"WHERE reason IS NULL AND CASE {reasons} END IS NOT NULL"
+        )
+
+        for line, reason in conn.execute(
+                "SELECT line, reason FROM ingest_staging WHERE reason IS NOT NULL ORDER BY line"):
+            result.rejected[reason] += 1
+            reject_log.write(entity, path, line, reason)
+
+        columns = (["id"] if spec.has_id else []) + [c for c, _ in spec.columns]
+        expressions = [spec.expressions.get(c, f"trim({c})" if t == TEXT else c) for c, t in spec.columns]
+        if spec.has_id:
+            expressions.insert(0, "nullif(id, '')")
+        result.loaded = conn.execute(
+            f"INSERT INTO {spec.table} ({', '.join(columns)}) "
+            f"SELECT {', '.join(expressions)} FROM ingest_staging WHERE reason IS NULL ORDER BY line"
+        ).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.ingest_staging")
+
+    return result
+
+
+@contextlib.contextmanager
+def load_pragmas(conn: sqlite3.Connection):
+    """Relaxes PRAGMAs for a bulk load, restoring them afterwards. Commits any open transaction"""
+    conn.commit()
+    previous = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in _LOAD_PRAGMAS}
+    for name, value in _LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            conn.execute(f"PRAGMA {name}={value}")
+
+
+def ingest(conn: sqlite3.Connection, files: dict[str, str], rejects: Optional[TextIO] = None) -> list[IngestResult]:
+    """Loads files (entity: path) in dependency order with PRAGMAs relaxed for the duration of the load"""
+    reject_log = RejectLog(rejects)
+    with load_pragmas(conn):
+        return [ingest_file(conn, entity, files[entity], reject_log) for entity in ENTITIES if entity in files]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk load CSV/JSONL files into the database")
+    parser.add_argument("files", nargs="+", metavar="ENTITY=PATH",
+                        help=f"file to load where ENTITY is one of: {', '.join(ENTITIES)}")
+    parser.add_argument("--db", default="table.db", help="database to load into")
+    parser.add_argument("--rejects", help="CSV file to write rejected rows to")
+    args = parser.parse_args()
+
+    files = {}
+    for argument in args.files:
+        entity, _, path = argument.partition("=")
+        if entity not in ENTITIES or path == "":
+            parser.error(f"invalid file argument '{argument}'")
+        files[entity] = path
+
+    conn = db_initialisation.initialise_db(args.db)
+    rejects_file = None if args.rejects is None else open(args.rejects, "w", newline="", encoding="utf-8")
+    try:
+        started = datetime.now()
+        for r in ingest(conn, files, rejects_file):
+            print(f"{r.entity} ({r.path}): {r.loaded} row(s) loaded, {sum(r.rejected.values())} rejected")
+            for reason, count in r.rejected.most_common():
+                print(f"\t{reason}: {count}")
+        print(f"Done in {(datetime.now() - started).total_seconds():.2f}s")
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+        conn.close()
@@ -0,0 +1,261 @@
+"""
+Finds connecting itineraries between two destinations: the flights to take to get from one to the other after a
+time, changing flights only at the destination a flight lands at and with time to make the connection
+"""
+import sqlite3
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import consts
+import util
+from assignment import Leg
+from database import db_destinations
+from database import db_names
+from util import dt_to_db, db_to_dt
+
+# Later than any arrival
+_NEVER = 2 ** 63 - 1
+
+MINUTE_MS = 60_000
+
+
+class FlightNetwork:
+    """
+    Index of the flights departing from each destination, kept as one route per destination flown to with its
+    flights ordered by departure, so the earliest arrival at a neighbour from a time is a binary search rather than
+    a query. Flights are held in flat arrays, route after route, rather than as objects the garbage collector would
+    have to walk
+    """
+    def __init__(self, rows):
+        grouped: dict[tuple[int, int], list[tuple[int, int, int]]] = {}
+        # Rows are read in departure order so each route's flights are appended in order
+        for source_id, destination_id, departure, arrival, flight_id in rows:
+            # Flights landing before they depart can't be taken and ones landing where they left never help
+            if arrival < departure or source_id == destination_id:
+                continue
+            grouped.setdefault((source_id, destination_id), []).append((departure, arrival, flight_id))
+
+        # Route numbers by where they leave from and then where they go, and where the routes to each destination
+        # leave from. Route r's flights are at positions starts[r] to starts[r + 1]
+        self.routes: dict[int, dict[int, int]] = {}
+        self.sources: dict[int, list[int]] = {}
+        self.starts = array("q", [0])
+        self.departures = array("q")
+        # Earliest arrival of the flights on the same route departing from each position on, and the position of
+        # the flight landing then
+        self.arrivals = array("q")
+        self.best = array("q")
+        self.flight_ids = array("q")
+        for (source_id, destination_id), flights in grouped.items():
+            start = len(self.departures)
+            for departure, arrival, flight_id in flights:
+                self.departures.append(departure)
+                self.arrivals.append(arrival)
+                self.flight_ids.append(flight_id)
+            self.best.extend(range(start, len(self.departures)))
+            for i in range(len(self.departures) - 2, start - 1, -1):
+                if self.arrivals[i + 1] < self.arrivals[i]:
+                    self.arrivals[i] = self.arrivals[i + 1]
+                    self.best[i] = self.best[i + 1]
+            self.routes.setdefault(source_id, {})[destination_id] = len(self.starts) - 1
+            self.sources.setdefault(destination_id, []).append(source_id)
+            self.starts.append(len(self.departures))
+
+    def within(self, destination_id: int, hops: int) -> list[set[int]]:
+        """
+        Returns the destinations with routes reaching a destination in at most 0, 1, ... hops flights, ignoring
+        when they fly. Stops early once half the destinations flown from are in the last set, as checking the
+        rest isn't worth it
+        """
+        found = [{destination_id}]
+        frontier = [destination_id]
+        while len(found) <= hops and 2 * len(found[-1]) <= len(self.routes):
+            reached = set(found[-1])
+            next_frontier = []
+            for location in frontier:
+                for source_id in self.sources.get(location, ()):
+                    if source_id not in reached:
+                        reached.add(source_id)
+                        next_frontier.append(source_id)
+            frontier = next_frontier
+            found.append(reached)
+        return found
+
+    @staticmethod
+    def load(conn: sqlite3.Connection) -> "FlightNetwork":
+        """Builds the index from every flight, reading them in departure order from the covering index"""
+        return FlightNetwork(conn.execute(
+            "SELECT source_id, destination_id, departure_time, arrival_time, id FROM flights "
+            "ORDER BY departure_time, id"
+        ))
+
+
+# The index built on each connection
+_networks: util.ConnectionCache[FlightNetwork] = util.ConnectionCache()
+
+
+def get_network(conn: sqlite3.Connection) -> FlightNetwork:
+    """Returns the index of the flights, only rebuilding it if the database has changed since it was built"""
+    return _networks.get(conn, lambda: FlightNetwork.load(conn))
+
+
+@dataclass
+class Itinerary:
+    """Class representing flights taken one after another from a source to a destination"""
+    legs: list[Leg]
+
+    def get_departure(self) -> int:
+        return self.legs[0].departure
+
+    def get_arrival(self) -> int:
+        return self.legs[-1].arrival
+
+
+def search(network: FlightNetwork, source_id: int, destination_id: int, after: int,
+           max_legs: int = consts.ITINERARY_MAX_LEGS,
+           min_connection: int = consts.ITINERARY_MIN_CONNECTION_MINUTES * MINUTE_MS,
+           connection_times: Optional[dict[int, int]] = None) -> list[Itinerary]:
+    """
+    Returns the itineraries departing from a source at or after a time (in database times) that no other beats on
+    both number of flights and arrival, fewest flights first (so the last arrives earliest). Each change of flights
+    leaves at least min_connection, or the destination's own time in connection_times, between landing and departing.
+    Searched in rounds of one more flight each, only going on from destinations reached earlier than before
+    """
+    if source_id == destination_id:
+        return []
+
+    connection_times = {} if connection_times is None else connection_times
+    # Only destinations that can still reach the destination in the flights left are worth reaching
+    within = network.within(destination_id, max_legs - 1)
+    earliest = {source_id: after}  # Earliest arrival found at each destination
+    # Destinations reached earlier than before in each round: arrival, where the flight there left from and the
+    # position on its route it was found from
+    rounds: list[dict[int, tuple[int, Optional[int], int]]] = [{source_id: (after, None, 0)}]
+    found = []
+    for legs in range(1, max_legs + 1):
+        # Filtering by the destinations left reachable in the flights remaining only pays off while they're few
+        useful = within[max_legs - legs] if max_legs - legs < len(within) else None
+        reached = {}
+        for location, (arrival, _, _) in rounds[-1].items():
+            ready = arrival if legs == 1 else arrival + connection_times.get(location, min_connection)
+            if ready >= earliest.get(destination_id, _NEVER):
+                continue  # Can't beat an itinerary already found
+            routes = network.routes.get(location, {})
+            if useful is None:
+                candidates = routes.items()
+            elif len(useful) < len(routes):
+                candidates = [(d, routes[d]) for d in useful if d in routes]
+            else:
+                candidates = [(d, route) for d, route in routes.items() if d in useful]
+            for next_location, route in candidates:
+                end = network.starts[route + 1]
+                i = bisect_left(network.departures, ready, network.starts[route], end)
+                if i == end:
+                    continue
+                next_arrival = network.arrivals[i]
+                if next_arrival < earliest.get(next_location, _NEVER) and next_arrival < earliest.get(destination_id,
+                                                                                                        _NEVER):
+                    earliest[next_location] = next_arrival
+                    reached[next_location] = (next_arrival, location, i)
+
+        if len(reached) == 0:
+            break
+        rounds.append(reached)
+        if destination_id in reached:
+            found.append(_itinerary(network, rounds, destination_id))
+    return found
+
+
+def _itinerary(network: FlightNetwork, rounds: list[dict[int, tuple[int, Optional[int], int]]],
+               destination_id: int) -> Itinerary:
+    """Follows the flights back from a destination reached in the last round"""
+    legs = []
+    location = destination_id
+    for reached in reversed(rounds[1:]):
+        _, previous, i = reached[location]
+        # The flight found is the one landing earliest from position i on
+        position = network.best[i]
+        legs.append(Leg(network.flight_ids[position], previous, location, network.departures[position],
+                        network.arrivals[position]))
+        location = previous
+    return Itinerary(legs[::-1])
+
+
+def earliest_arrival(conn: sqlite3.Connection, source_id: int, destination_id: int, after: datetime,
+                     **options) -> Optional[Itinerary]:
+    """Returns the itinerary arriving earliest (fewest flights if tied), or None if there isn't one"""
+    found = search(get_network(conn), source_id, destination_id, dt_to_db(after), **options)
+    return found[-1] if len(found) > 0 else None
+
+
+def fewest_legs(conn: sqlite3.Connection, source_id: int, destination_id: int, after: datetime,
+                **options) -> Optional[Itinerary]:
+    """Returns the itinerary with the fewest flights (arriving earliest if tied), or None if there isn't one"""
+    found = search(get_network(conn), source_id, destination_id, dt_to_db(after), **options)
+    return found[0] if len(found) > 0 else None
+
+
+def _format_minutes(ms: int) -> str:
+    minutes = ms // MINUTE_MS
+    return f"{minutes // 60}h {minutes % 60:02}m"
+
+
+def print_itineraries(conn: sqlite3.Connection, found: list[Itinerary]):
+    """Prints each itinerary's flights with the time spent connecting between them"""
+    names = db_names.get_names(conn, "destinations", {i for itinerary in found for leg in itinerary.legs
+                                                      for i in (leg.source_id, leg.destination_id)})
+    for number, itinerary in enumerate(found, 1):
+        label = ""
+        if len(found) > 1 and number == 1:
+            label = " (fewest flights)"
+        elif len(found) > 1 and number == len(found):
+            label = " (earliest arrival)"
+        print(f"Option {number}{label}: {len(itinerary.legs)} flight(s), arriving "
+              f"{util.dt_format(db_to_dt(itinerary.get_arrival()))} after "
+              f"{_format_minutes(itinerary.get_arrival() - itinerary.get_departure())}")
+        table = [["Flight ID", "From", "To", "Departure Time", "Arrival Time", "Connection"]]
+        for i, leg in enumerate(itinerary.legs):
+            table.append([
+                str(leg.flight_id),
+                "[INVALID SOURCE]" if names[leg.source_id] is None else names[leg.source_id],
+                "[INVALID DESTINATION]" if names[leg.destination_id] is None else names[leg.destination_id],
+                util.dt_format(db_to_dt(leg.departure)),
+                util.dt_format(db_to_dt(leg.arrival)),
+                "" if i == 0 else _format_minutes(leg.departure - itinerary.legs[i - 1].arrival),
+            ])
+        util.print_table(table)
+        print()
+
+
+def itinerary_options(conn: sqlite3.Connection):
+    """Allows the user to find the flights connecting two destinations"""
+    print("Select the destination to leave from")
+    source_id = db_destinations.get_destination(conn)
+    if source_id is None:
+        return
+    print("Select the destination to get to")
+    destination_id = db_destinations.get_destination(conn)
+    if destination_id is None:
+        return
+    if source_id == destination_id:
+        print("Those are the same destination")
+        print()
+        return
+
+    print("Leaving after:")
+    after = util.get_datetime()
+    print("Enter the shortest time to change flights (minutes)")
+    min_connection = util.choose_number_from_range(0, 24 * 60) * MINUTE_MS
+    print("Enter the most flights to take")
+    max_legs = util.choose_number_from_range(1, 8)
+
+    found = search(get_network(conn), source_id, destination_id, dt_to_db(after), max_legs, min_connection)
+    if len(found) == 0:
+        print(f"[NO ITINERARIES WITH UP TO {max_legs} FLIGHT(S)]")
+        print()
+        return
+    # Options are listed fewest flights first, each arriving earlier than the one before
+    print_itineraries(conn, found)
@@ -1,64 +1,107 @@
+import argparse
 import sqlite3
 
-import check_for_errors
-import statistics
 from database import db_initialisation
-from flights import flight_options
-from non_flights import non_flight_options, NonFlightType
+from database import db_profiling
+from database import db_search
+from database import db_spatial
+from database import db_traffic
 from util import choices
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Flight database manager")
+    parser.add_argument("--db", default="table.db", help="database to open")
+    parser.add_argument("--read-only", action="store_true",
+                        help="open an existing database for viewing alongside an editing session")
+    parser.add_argument("--profile", choices=list(db_initialisation.PROFILES), default="default",
+                        help="connection tuning profile")
+    parser.add_argument("--rebuild-traffic", action="store_true",
+                        help="recompute the traffic summaries from the flights before starting")
+    parser.add_argument("--trace", action="store_true", help="profile every statement from the start")
+    parser.add_argument("--slow-query-ms", type=float,
+                        help="keep statements taking at least this many milliseconds (implies --trace)")
+    parser.add_argument("--slow-query-log", help="append slow statements to a file as they happen (implies --trace)")
+    parser.add_argument("--trace-export", help="write the statement profile to a JSON file on quitting "
+                                                "(implies --trace)")
+    args = parser.parse_args()
+
     print("WARNING: Some tables may not display correctly if the terminal is not wide enough\n")
 
     # Initialise connection and create tables
-    conn = db_initialisation.initialise_db()
+    if args.read_only:
+        print("Read-only session - changes can't be saved\n")
+        conn = db_initialisation.open_read_only(args.db, args.profile)
+    else:
+        conn = db_initialisation.initialise_db(args.db, args.profile)
+        if args.rebuild_traffic:
+            db_traffic.rebuild_traffic_summaries(conn)
+            conn.commit()
+
+    slow_log = None
+    if args.trace or any(value is not None for value in [args.slow_query_ms, args.slow_query_log, args.trace_export]):
+        if args.slow_query_log is not None:
+            slow_log = open(args.slow_query_log, "a")
+        db_profiling.start_profiling(conn, args.slow_query_ms, slow_log)
 
     # Main loop
     while True:
-        c = choices("Select option:", [
+        options = [
             "View/Modify Flights",
             "View/Modify Pilots",
             "View/Modify Aircraft",
             "View/Modify Destinations",
-            "Lookup Destination By Code",
+            "Search Pilots, Aircraft and Destinations",
+            "Find Nearby Destinations",
+            "Find Connecting Flights",
             "Statistics",
             "Check for Errors",
+            "Profile Database Statements",
             "Save and Quit",
             "Quit without Saving"
-        ])
+        ]
+        c = choices("Select option:", options)
 
-        if c == 1:  # Flights
-            flight_options(conn)
-        elif c == 2:  # Pilots
-            non_flight_options(conn, NonFlightType.PILOTS)
-        elif c == 3:  # Aircraft
-            non_flight_options(conn, NonFlightType.AIRCRAFT)
-        elif c == 4:  # Destinations
-            non_flight_options(conn, NonFlightType.DESTINATIONS)
-        elif c == 5:  # Lookup destination
-            print("Enter destination code:")
-            code = input("> ")
-
-            destinations = conn.execute("SELECT id, name FROM destinations WHERE code = ?", (code,)).fetchall()
-            if len(destinations) == 0:
-                print("No destination matches that code")
-                print()
-                continue
-
-            print("Destinations matching that code:")
-            for destination in destinations:
-                print(f"\t{destination[1]} [ID: {destination[0]}]")
+        # Menus are imported the first time they're chosen so that startup only loads what the main menu needs
+        try:
+            with db_profiling.action(conn, options[c - 1]):
+                if c == 1:  # Flights
+                    from flights import flight_options
+                    flight_options(conn)
+                elif c in (2, 3, 4):  # Pilots, aircraft and destinations
+                    from non_flights import non_flight_options, NonFlightType
+                    non_flight_options(conn, [NonFlightType.PILOTS, NonFlightType.AIRCRAFT,
+                                              NonFlightType.DESTINATIONS][c - 2])
+                elif c == 5:  # Search names and destination codes
+                    db_search.search_everything(conn)
+                elif c == 6:  # Destinations near a point
+                    db_spatial.nearby_options(conn)
+                elif c == 7:  # Itineraries between two destinations
+                    import itineraries
+                    itineraries.itinerary_options(conn)
+                elif c == 8:  # Stats
+                    import statistics
+                    statistics.show_statistics(conn)
+                elif c == 9:  # Errors
+                    import check_for_errors
+                    check_for_errors.check_for_errors(conn)
+                elif c == 10:  # Statement profiling
+                    db_profiling.profiling_options(conn)
+                elif c == 11:  # Save and quit
+                    conn.commit()
+                    break
+                elif c == 12:  # Quit without saving
+                    c2 = choices("Are you sure you want to quit without saving?", ["Yes", "No"])
+                    if c2 == 1:
+                        break
+        except sqlite3.OperationalError as e:
+            if not args.read_only:
+                raise
+            # Raised by anything that tries to write
+            print(f"Not available in a read-only session ({e})")
             print()
-        elif c == 6:  # Stats
-            statistics.show_statistics(conn)
-        elif c == 7:  # Errors
-            check_for_errors.check_for_errors(conn)
-        elif c == 8:  # Save and quit
-            conn.commit()
-            break
-        elif c == 9:  # Quit without saving
-            c2 = choices("Are you sure you want to quit without saving?", ["Yes", "No"])
-            if c2 == 1:
-                break
 
+    if args.trace_export is not None and conn.profile is not None:
+        db_profiling.export_profile(conn.profile, args.trace_export)
+    if slow_log is not None:
+        slow_log.close()
     conn.close()
@@ -2,7 +2,8 @@ import sqlite3
 from enum import Enum
 
 import util
-import consts
+from database import db_cascade
+from pagination import KeysetPager
 
 class NonFlightType(Enum):
     AIRCRAFT = 1
@@ -31,25 +32,21 @@ def non_flight_options(conn: sqlite3.Connection, others_type: NonFlightType):
     Allows user to view, add and remove data from the aircraft, destination and pilots tables
     """
 
-    page = 0
+    pager = KeysetPager(("id",))
 
     while True:
         # Get data
         if others_type == NonFlightType.AIRCRAFT:
-            rows = conn.execute(f"SELECT id, name FROM aircraft LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
+            rows = pager.fetch(conn, "aircraft", "id, name", [], [])
             table = [["ID", "Name"]]
         elif others_type == NonFlightType.DESTINATIONS:
-            rows = conn.execute(f"SELECT id, code, name, latitude, longitude FROM destinations LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
+            rows = pager.fetch(conn, "destinations", "id, code, name, latitude, longitude", [], [])
             table = [["ID", "Code", "Name", "Latitude", "Longitude"]]
         else:  # others_type == NonFlightType.PILOTS:
-            rows = conn.execute(f"SELECT id, name, surname, date_joined FROM pilots LIMIT {consts.LIMIT_PER_PAGE + 1} OFFSET {consts.LIMIT_PER_PAGE * page}").fetchall()
+            rows = pager.fetch(conn, "pilots", "id, name, surname, date_joined", [], [])
             table = [["ID", "Name", "Surname", "Date Joined"]]  # Extra column for pilots
 
         all_ids = []
-        has_next = False
-        if len(rows) > consts.LIMIT_PER_PAGE:
-            rows = rows[:consts.LIMIT_PER_PAGE]
-            has_next = True
 
         # Add data to table
         for row in rows:
@@ -65,17 +62,13 @@ def non_flight_options(conn: sqlite3.Connection, others_type: NonFlightType):
                 table.append([str(row[0]), row[1]])
 
         # Output table
-        print(f"Page: {page + 1}")
+        print(f"Page: {pager.to_string()}")
         util.print_table(table)
         if len(rows) == 0:
             print("[NO DATA]")
         print()
 
-        page_text = ["No Previous Page", "No Next Page"]
-        if page > 0:
-            page_text[0] = f"Previous Page ({page})"
-        if has_next:
-            page_text[1] = f"Next Page ({page + 2})"
+        page_text = pager.page_text()
 
         choice = util.choices("Select an option:", [
             f"Add {others_type.get_name()}",
@@ -83,7 +76,7 @@ def non_flight_options(conn: sqlite3.Connection, others_type: NonFlightType):
             page_text[0],
             page_text[1],
             f"Done"
-        ])
+        ], conn)
 
         # Add
         if choice == 1:
@@ -127,74 +120,25 @@ def non_flight_options(conn: sqlite3.Connection, others_type: NonFlightType):
                     break
                 print("Invalid ID")
 
-            if others_type == NonFlightType.PILOTS:
-                rows = conn.execute(
-                    "SELECT flight_id FROM pilot_flights WHERE pilot_id = ?",
-                    (_id,)
-                ).fetchall()
-
-                to_delete = []
-                for row in rows:
-                    pilots_on_flight = conn.execute(
-                        "SELECT pilot_id FROM pilot_flights WHERE flight_id = ?",
-                        (row[0],)
-                    ).fetchall()
-
-                    # Flight will need to be deleted if last pilot is gone
-                    if len(pilots_on_flight) == 1:
-                        to_delete.append(row[0])
-
-                if len(to_delete) > 0:
-                    print(f"Deleting this pilot will result in {len(to_delete)} flight(s) "
-                          f"(ID(s): {', '.join([str(d) for d in to_delete])}) being deleted due to having no pilot")
-
-                    c2 = util.choices("Are you sure you want to continue?", ["Yes", "No"])
-                    if c2 == 2: continue
-
-                conn.execute("DELETE FROM pilots WHERE id = ?", (_id,))
-
-                # Delete flights with no pilots
-                for flight_id in to_delete:
-                    conn.execute("DELETE FROM flights WHERE id = ?", (flight_id,))
-            else:
-                # Get flights that will be cascade deleted
-                if others_type == NonFlightType.AIRCRAFT:
-                    deleted = list(map(
-                        lambda x: x[0],
-                        conn.execute("SELECT id FROM flights WHERE aircraft_id = ?", (_id,)).fetchall()
-                    ))
-                else:  # others_type == NonFlightType.DESTINATIONS:
-                    deleted = list(map(
-                        lambda x: x[0],
-                        conn.execute(
-                            "SELECT id FROM flights WHERE source_id = ? OR destination_id = ?",
-                            (_id, _id)
-                        ).fetchall()
-                    ))
-
-                if len(deleted) > 0:
-                    print(f"Deleting this {others_type.get_name().lower()} will result in {len(deleted)} flight(s) "
-                          f"(ID(s): {', '.join([str(d) for d in deleted])}) being deleted due to having no "
-                          f"{others_type.get_name().lower()}")
-
-                    c2 = util.choices("Are you sure you want to continue?", ["Yes", "No"])
-                    if c2 == 2: continue
-
-                if others_type == NonFlightType.AIRCRAFT:
-                    conn.execute("DELETE FROM aircraft where id = ?", (_id,))
-                elif others_type == NonFlightType.DESTINATIONS:
-                    conn.execute("DELETE FROM destinations where id = ?", (_id,))
-                # Flights will be deleted automatically
+            # Flights are deleted along with their aircraft/destinations, and with a pilot when it was their only pilot
+            impact = db_cascade.preview_delete(conn, others_type.get_table(), _id)
+            if impact.flight_count > 0:
+                print(f"Deleting this {others_type.get_name().lower()} will result in {impact.flight_count} flight(s) "
+                      f"(ID(s): {impact.to_string()}) being deleted due to having no "
+                      f"{others_type.get_name().lower()}")
+
+                c2 = util.choices("Are you sure you want to continue?", ["Yes", "No"])
+                if c2 == 2: continue
+
+            db_cascade.delete_with_cascade(conn, others_type.get_table(), _id)
 
         # Previous page
         elif choice == 3:
-            if page > 0:
-                page -= 1
+            pager.previous_page()
 
         # Next page
         elif choice == 4:
-            if has_next:
-                page += 1
+            pager.next_page()
 
         # Done
         elif choice == 5:
@@ -0,0 +1,136 @@
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Any
+
+import consts
+
+# Pads partial keys passed to seek so that they sort before/after every real row sharing the prefix
+_MIN_KEY = -(2 ** 63)
+_MAX_KEY = 2 ** 63 - 1
+
+
+@dataclass
+class KeysetPager:
+    """
+    Class representing a cursor-based (keyset) position in a result set ordered by key_columns.
+    Pages are found by seeking on the key instead of using OFFSET so every page costs the same to load
+    """
+    key_columns: tuple[str, ...]
+    ascending: bool = True
+    page: Optional[int] = 0  # None when the page number isn't known (after a seek)
+    has_next_page: bool = False
+    has_previous_page: bool = False
+    start: Optional[tuple] = None  # Key of the first row on the page (None for the first page)
+    page_size: int = consts.LIMIT_PER_PAGE
+    _next_start: Optional[tuple] = field(default=None, repr=False)
+    _move_back: bool = field(default=False, repr=False)
+
+    def reset(self):
+        """Returns to the first page"""
+        self.page = 0
+        self.start = None
+        self._move_back = False
+
+    def next_page(self):
+        """Moves to the next page (if there is one)"""
+        if not self.has_next_page:
+            return
+        self.start = self._next_start
+        if self.page is not None:
+            self.page += 1
+
+    def previous_page(self):
+        """Moves to the previous page (if there is one). The page is found on the next fetch"""
+        if self.has_previous_page:
+            self._move_back = True
+
+    def seek(self, *key_prefix):
+        """Moves to the page starting at the first row with a key at or after key_prefix"""
+        pad = _MIN_KEY if self.ascending else _MAX_KEY
+        self.start = tuple(key_prefix) + (pad,) * (len(self.key_columns) - len(key_prefix))
+        self.page = None
+        self._move_back = False
+
+    def to_string(self) -> str:
+        """Converts the page number to a user-readable string"""
+        return "?" if self.page is None else str(self.page + 1)
+
+    def page_text(self) -> list[str]:
+        """Returns the menu text for the previous and next page options"""
+        page_text = ["No Previous Page", "No Next Page"]
+        if self.has_previous_page:
+            page_text[0] = "Previous Page" if self.page is None else f"Previous Page ({self.page})"
+        if self.has_next_page:
+            page_text[1] = "Next Page" if self.page is None else f"Next Page ({self.page + 2})"
+        return page_text
+
+    def _key_condition(self, forward: bool) -> str:
+        """Returns a condition selecting keys after (forward) or before the start of the page"""
+        if forward:
+            op = ">=" if self.ascending else "<="
+        else:
+            op = "<" if self.ascending else ">"
+        return f"({', '.join(self.key_columns)}) {op} ({', '.join(['?' for _ in self.key_columns])})"
+
+    def _order(self, forward: bool) -> str:
+        """Returns an ORDER BY clause walking the key forward or backward"""
+        direction = "ASC" if self.ascending == forward else "DESC"
+        return ", ".join([f"{c} {direction}" for c in self.key_columns])
+
+    @staticmethod
+    def _where(conditions: list[str]) -> str:
+        return "" if len(conditions) == 0 else "WHERE " + " AND ".join(conditions)
+
+    def _find_previous_start(self, conn: sqlite3.Connection, table: str, conditions: list[str], arguments: list):
+        """Moves start back by one page"""
+        row = conn.execute(
+            f"SELECT {', '.join(self.key_columns)} FROM {table} "
+            f"{self._where(conditions + [self._key_condition(False)])} "
+            f"ORDER BY {self._order(False)} LIMIT 1 OFFSET {self.page_size - 1}",
+            arguments + list(self.start)
+        ).fetchone()
+
+        if row is None:  # Less than a page before start
+            self.reset()
+        else:
+            self.start = tuple(row)
+            if self.page is not None:
+                self.page = max(self.page - 1, 0)
+
+    def fetch(self, conn: sqlite3.Connection, table: str, columns: str, conditions: list[str], arguments: list,
+              key_of: Callable[[Any], tuple] = lambda row: (row[0],),
+              load: Optional[Callable[[str, list], list]] = None) -> list:
+        """
+        Returns the rows on the current page. conditions/arguments filter the table, key_of extracts the key from
+        a returned row and load (if given) runs the page query instead of executing it directly
+        """
+        if self._move_back:
+            self._move_back = False
+            if self.start is not None:
+                self._find_previous_start(conn, table, conditions, arguments)
+
+        page_conditions = list(conditions)
+        page_arguments = list(arguments)
+        if self.start is not None:
+            page_conditions.append(self._key_condition(True))
+            page_arguments += list(self.start)
+
+        sql = (f"SELECT {columns} FROM {table} {self._where(page_conditions)} "
+               f"ORDER BY {self._order(True)} LIMIT {self.page_size + 1}")
+        rows = conn.execute(sql, page_arguments).fetchall() if load is None else load(sql, page_arguments)
+
+        self.has_next_page = len(rows) > self.page_size
+        self._next_start = key_of(rows[self.page_size]) if self.has_next_page else None
+        rows = rows[:self.page_size]
+
+        # Check whether anything precedes the page
+        self.has_previous_page = False
+        if self.start is not None:
+            self.has_previous_page = conn.execute(
+                f"SELECT 1 FROM {table} {self._where(conditions + [self._key_condition(False)])} LIMIT 1",
+                arguments + list(self.start)
+            ).fetchone() is not None
+            if not self.has_previous_page:
+                self.page = 0
+
+        return rows
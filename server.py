@@ -0,0 +1,549 @@
+"""
+Serves the flight database over a local HTTP/JSON API. Run with:
+    python server.py [--db table.db] [--host 127.0.0.1] [--port 8080] [--workers 4]
+Endpoints:
+    GET    /flights                 search (departure_after, departure_before, arrival_after, arrival_before,
+                                    sources, destinations, pilots, aircraft, source_within, destination_within
+                                    as latitude,longitude,radius_km, order=asc|desc, limit, cursor)
+    POST   /flights                 create a flight
+    GET    /flights/{id}
+    PUT    /flights/{id}            replace a flight and its pilots
+    DELETE /flights/{id}
+    GET    /{aircraft|destinations|pilots}          list (limit, cursor)
+    POST   /{aircraft|destinations|pilots}          create
+    GET    /{aircraft|destinations|pilots}/{id}
+    GET    /destinations/nearby     destinations nearest first (latitude, longitude and radius_km or k)
+    DELETE /{aircraft|destinations|pilots}/{id}     delete along with the flights that depend on it
+    GET    /statistics
+    GET    /traffic                 flights per bucket (dimension=sources|destinations|aircraft|pilots, start, end,
+                                    bucket_days, id to count one entity)
+    POST   /traffic/rebuild         recompute the traffic summaries from the flights
+    GET    /integrity               run the integrity check without saving it (full=1 to check every row)
+    POST   /integrity               run the integrity check and save it, so the next one only checks rows changed
+                                    since (full=1 to check every row)
+List responses are {"items": [...], "next_cursor": ...}; pass next_cursor back as cursor to get the next page.
+Requests are handled concurrently by an asyncio event loop while SQLite work runs on a bounded thread pool where
+every thread has its own connection
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import re
+import sqlite3
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+import check_for_errors
+import statistics
+import util
+from database import db_cascade
+from database import db_flight_query
+from database import db_flight_records
+from database import db_flights
+from database import db_initialisation
+from database import db_pilots
+from database import db_spatial
+from database import db_traffic
+from filters import MultiSelection, MultiSelectionType
+from pagination import KeysetPager
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+MAX_HEADER_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+# Seconds an idle keep-alive connection is held open
+KEEP_ALIVE_TIMEOUT = 15
+
+STATUS_TEXT = {
+    200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    """Error returned to the client as {"error": message}"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclasses.dataclass
+class Request:
+    """Class representing a parsed HTTP request"""
+    method: str
+    path: str
+    params: dict[str, str]
+    headers: dict[str, str]
+    body: bytes
+
+    def json(self) -> dict:
+        try:
+            value = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Body isn't valid JSON")
+        if type(value) != dict:
+            raise HttpError(400, "Body must be a JSON object")
+        return value
+
+
+def _text(value: Any) -> str:
+    if type(value) != str or value.strip() == "":
+        raise ValueError("must be a non-empty string")
+    return value
+
+
+def _number(value: Any) -> float:
+    if type(value) not in (int, float):
+        raise ValueError("must be a number")
+    return float(value)
+
+
+def _time(value: Any) -> int:
+    return util.dt_to_db(_datetime(value))
+
+
+def _datetime(value: Any) -> datetime:
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("must be an ISO 8601 time")
+    # Times without an offset are local like those entered in the menus
+    return dt if dt.tzinfo is not None else dt.astimezone()
+
+
+# (column, parser) for every column clients give when creating an entity
+ENTITY_COLUMNS = {
+    "aircraft": [("name", _text)],
+    "destinations": [("name", _text), ("code", _text), ("latitude", _number), ("longitude", _number)],
+    "pilots": [("name", _text), ("surname", _text), ("date_joined", _time)],
+}
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't convert {type(value).__name__} to JSON")
+
+
+def flight_to_json(record: db_flight_records.FlightRecord) -> dict:
+    return {**dataclasses.asdict(record), "pilots": [{"id": p[0], "name": p[1]} for p in record.pilots]}
+
+
+def _id_set(params: dict[str, str], name: str) -> set[int]:
+    try:
+        return {int(v) for v in params.get(name, "").split(",") if v.strip() != ""}
+    except ValueError:
+        raise HttpError(400, f"{name} must be comma separated IDs")
+
+
+def _optional_circle(params: dict[str, str], name: str) -> Optional[db_spatial.Circle]:
+    if name not in params:
+        return None
+    try:
+        return db_spatial.Circle.from_string(params[name])
+    except ValueError as e:
+        raise HttpError(400, f"{name} {e}")
+
+
+def _optional_datetime(params: dict[str, str], name: str) -> Optional[datetime]:
+    if name not in params:
+        return None
+    try:
+        return _datetime(params[name])
+    except ValueError as e:
+        raise HttpError(400, f"{name} {e}")
+
+
+def _pager(params: dict[str, str], key_columns: tuple[str, ...]) -> KeysetPager:
+    """Returns a pager positioned at the request's cursor"""
+    try:
+        limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+        start = None if "cursor" not in params else tuple(int(v) for v in params["cursor"].split(","))
+    except ValueError:
+        raise HttpError(400, "limit and cursor must be integers")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HttpError(400, f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if start is not None and len(start) != len(key_columns):
+        raise HttpError(400, "Invalid cursor")
+    return KeysetPager(key_columns, params.get("order", "asc") != "desc", page=None, start=start, page_size=limit)
+
+
+def _page(pager: KeysetPager, items: list) -> dict:
+    next_cursor = None
+    if pager.has_next_page:
+        pager.next_page()
+        next_cursor = ",".join(str(k) for k in pager.start)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def search_flights(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    p = request.params
+    if p.get("order", "asc") not in ("asc", "desc"):
+        raise HttpError(400, "order must be asc or desc")
+    query = db_flight_query.FlightQuery(
+        _optional_datetime(p, "departure_after"), _optional_datetime(p, "departure_before"),
+        _optional_datetime(p, "arrival_after"), _optional_datetime(p, "arrival_before"),
+        _id_set(p, "sources"), _id_set(p, "destinations"), _id_set(p, "pilots"), _id_set(p, "aircraft"),
+        p.get("order", "asc") == "asc", _optional_circle(p, "source_within"), _optional_circle(p, "destination_within")
+    )
+    pager = _pager(p, ("departure_time", "id"))
+    records = db_flight_query.page_flights(conn, query, pager)
+    return 200, _page(pager, [flight_to_json(r) for r in records])
+
+
+def get_flight(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    records = db_flight_records.get_flight_records_from_ids(conn, [int(match[1])])
+    if len(records) == 0:
+        raise HttpError(404, "No flight with that ID")
+    return 200, flight_to_json(records[0])
+
+
+def _flight_data(body: dict) -> db_flights.FlightData:
+    """Returns checked flight data from a request body"""
+    try:
+        pilots = body.get("pilots", [])
+        if type(pilots) != list or any(type(p) != int for p in pilots):
+            raise ValueError("pilots must be a list of IDs")
+        data = db_flights.FlightData(
+            body.get("source_id"), body.get("destination_id"),
+            None if "departure_time" not in body else _datetime(body["departure_time"]),
+            None if "arrival_time" not in body else _datetime(body["arrival_time"]),
+            body.get("aircraft_id"),
+            MultiSelection(MultiSelectionType.PILOT, set(pilots))
+        )
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+    check = data.check()
+    if check is not None:
+        raise HttpError(400, check)
+    return data
+
+
+def create_flight(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    data = _flight_data(request.json())
+    flight_id = db_flights.save_flight(conn, None, data)
+    conn.commit()
+    return 201, flight_to_json(db_flight_records.get_flight_records_from_ids(conn, [flight_id])[0])
+
+
+def update_flight(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    flight_id = int(match[1])
+    data = _flight_data(request.json())
+    if not db_flights.flight_exists(conn, flight_id):
+        raise HttpError(404, "No flight with that ID")
+    db_flights.save_flight(conn, flight_id, data, db_pilots.get_pilots_for_flight(conn, flight_id))
+    conn.commit()
+    return 200, flight_to_json(db_flight_records.get_flight_records_from_ids(conn, [flight_id])[0])
+
+
+def delete_flight(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    if conn.execute("DELETE FROM flights WHERE id = ?", (int(match[1]),)).rowcount == 0:
+        raise HttpError(404, "No flight with that ID")
+    conn.commit()
+    return 200, {"deleted": int(match[1])}
+
+
+def _entity_columns(table: str) -> str:
+    return ", ".join(["id"] + [column for column, _ in ENTITY_COLUMNS[table]])
+
+
+def _entity_to_json(table: str, row: tuple) -> dict:
+    entity = dict(zip(["id"] + [column for column, _ in ENTITY_COLUMNS[table]], row))
+    if table == "pilots":
+        entity["date_joined"] = util.db_to_dt(entity["date_joined"]).isoformat()
+    return entity
+
+
+def list_entities(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    table = match[1]
+    pager = _pager(request.params, ("id",))
+    rows = pager.fetch(conn, table, _entity_columns(table), [], [])
+    return 200, _page(pager, [_entity_to_json(table, row) for row in rows])
+
+
+def nearby_destinations(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    p = request.params
+    try:
+        latitude, longitude = float(p["latitude"]), float(p["longitude"])
+        if "radius_km" in p:
+            found = db_spatial.destinations_within(conn, db_spatial.Circle(latitude, longitude, float(p["radius_km"])))
+        else:
+            k = int(p.get("k", "10"))
+            if k < 1:
+                raise ValueError
+            found = db_spatial.nearest_destinations(conn, latitude, longitude, k)
+    except (KeyError, ValueError):
+        raise HttpError(400, "latitude and longitude must be numbers, with a radius_km number or k integer")
+
+    found = found[:MAX_PAGE_SIZE]
+    rows = {row[0]: row for row in conn.execute(
+        f"SELECT {_entity_columns('destinations')} FROM destinations WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps([destination_id for destination_id, _ in found]),)
+    )}
+    return 200, {"items": [
+        {**_entity_to_json("destinations", rows[destination_id]), "distance_km": distance}
+        for destination_id, distance in found
+    ]}
+
+
+def _load_entity(conn: sqlite3.Connection, table: str, entity_id: int) -> dict:
+    row = conn.execute(f"SELECT {_entity_columns(table)} FROM {table} WHERE id = ?", (entity_id,)).fetchone()
+    if row is None:
+        raise HttpError(404, f"No {table} with that ID")
+    return _entity_to_json(table, row)
+
+
+def get_entity(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    return 200, _load_entity(conn, match[1], int(match[2]))
+
+
+def create_entity(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    table = match[1]
+    body = request.json()
+    values = []
+    for column, parse in ENTITY_COLUMNS[table]:
+        try:
+            values.append(parse(body.get(column)))
+        except ValueError as e:
+            raise HttpError(400, f"{column} {e}")
+
+    entity = dict(zip([column for column, _ in ENTITY_COLUMNS[table]], values))
+    if table == "destinations":
+        entity["code"] = entity["code"].strip().upper()
+        if len(entity["code"]) > 4:
+            raise HttpError(400, "code must be 1 - 4 characters")
+        if not -90 <= entity["latitude"] <= 90 or not -180 <= entity["longitude"] <= 180:
+            raise HttpError(400, "latitude/longitude out of range")
+
+    cursor = conn.execute(
+        f"INSERT INTO {table} ({', '.join(entity)}) VALUES ({', '.join(['?' for _ in entity])})",
+        list(entity.values())
+    )
+    conn.commit()
+    return 201, _load_entity(conn, table, cursor.lastrowid)
+
+
+def delete_entity(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    table, entity_id = match[1], int(match[2])
+    if conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (entity_id,)).fetchone() is None:
+        raise HttpError(404, f"No {table} with that ID")
+
+    deleted_flights = db_cascade.delete_with_cascade(conn, table, entity_id)
+    conn.commit()
+    return 200, {"deleted": entity_id, "deleted_flights": deleted_flights}
+
+
+def get_statistics(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    stats = statistics.get_statistics(conn)
+    result = dataclasses.asdict(stats)
+    for name, value in result.items():
+        if type(value) == tuple:  # Most frequent (ID, name, count)
+            result[name] = {"id": value[0], "name": value[1], "flights": value[2]}
+    result["daily_departures"] = [{"day": day, "flights": count} for day, count in stats.daily_departures]
+    return 200, result
+
+
+def get_traffic(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    p = request.params
+    try:
+        dimension = db_traffic.Dimension[p.get("dimension", "sources").upper()]
+    except KeyError:
+        raise HttpError(400, "dimension must be sources, destinations, aircraft or pilots")
+    start, end = _optional_datetime(p, "start"), _optional_datetime(p, "end")
+    if start is None or end is None:
+        raise HttpError(400, "start and end are required")
+    try:
+        bucket_days = int(p.get("bucket_days", 1))
+        entity_id = None if "id" not in p else int(p["id"])
+    except ValueError:
+        raise HttpError(400, "bucket_days and id must be integers")
+    if bucket_days < 1:
+        raise HttpError(400, "bucket_days must be at least 1")
+
+    series = db_traffic.traffic_series(conn, dimension, start, end, bucket_days, entity_id)
+    return 200, {"items": [{"start": day, "flights": count} for day, count in series]}
+
+
+def rebuild_traffic(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    db_traffic.rebuild_traffic_summaries(conn)
+    conn.commit()
+    return 200, {"rebuilt": [d.get_table() for d in db_traffic.Dimension]}
+
+
+def check_integrity(conn: sqlite3.Connection, request: Request, match: re.Match) -> tuple[int, Any]:
+    report = check_for_errors.check_integrity(conn, request.params.get("full", "0") == "1",
+                                              request.method == "POST")
+    return 200, {
+        "full": report.full,
+        "checked_at": report.checked_at,
+        "ok": report.is_ok(),
+        "violations": {v.name.lower(): rows for v, rows in report.violations.items()},
+    }
+
+
+Handler = Callable[[sqlite3.Connection, Request, re.Match], tuple[int, Any]]
+_ENTITY = "(aircraft|destinations|pilots)"
+
+# (path pattern, {method: handler})
+ROUTES: list[tuple[re.Pattern, dict[str, Handler]]] = [
+    (re.compile(r"/flights"), {"GET": search_flights, "POST": create_flight}),
+    (re.compile(r"/flights/(\d+)"), {"GET": get_flight, "PUT": update_flight, "DELETE": delete_flight}),
+    (re.compile(r"/destinations/nearby"), {"GET": nearby_destinations}),
+    (re.compile(f"/{_ENTITY}"), {"GET": list_entities, "POST": create_entity}),
+    (re.compile(rf"/{_ENTITY}/(\d+)"), {"GET": get_entity, "DELETE": delete_entity}),
+    (re.compile(r"/statistics"), {"GET": get_statistics}),
+    (re.compile(r"/traffic"), {"GET": get_traffic}),
+    (re.compile(r"/traffic/rebuild"), {"POST": rebuild_traffic}),
+    (re.compile(r"/integrity"), {"GET": check_integrity, "POST": check_integrity}),
+]
+
+
+class FlightServer:
+    """Class representing the HTTP server and the thread pool running its database work"""
+    def __init__(self, path: str, profile: str = "default", workers: int = 4):
+        self.path = path
+        self.profile = profile
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self.local = threading.local()
+        self.connections: list[sqlite3.Connection] = []
+        self.connections_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the calling worker thread's connection, opening it on first use"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = db_initialisation.connect(self.path, self.profile)
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    def _handle(self, request: Request) -> tuple[int, Any]:
+        """Runs a request's handler on the calling worker thread"""
+        for pattern, methods in ROUTES:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            if request.method not in methods:
+                raise HttpError(405, f"{request.method} isn't supported on {request.path}")
+
+            conn = self._connection()
+            try:
+                return methods[request.method](conn, request, match)
+            except sqlite3.IntegrityError as e:
+                raise HttpError(409, f"Conflicts with existing data ({e})")
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+        raise HttpError(404, f"No endpoint at {request.path}")
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        """Reads the next request on a connection or returns None once the client has closed it"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(413, "Headers too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        headers[":version"] = version
+
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length < 0 or length > MAX_BODY_SIZE:
+            raise HttpError(413, "Body too large")
+        body = await reader.readexactly(length) if length > 0 else b""
+
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        return Request(method.upper(), url.path.rstrip("/") or "/", params, headers, body)
+
+    @staticmethod
+    def _keep_alive(request: Request) -> bool:
+        connection = request.headers.get("connection", "").lower()
+        if request.headers[":version"] == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    async def _write_response(self, writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool):
+        body = json.dumps(payload, default=_to_json).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    keep_alive = self._keep_alive(request)
+                    status, payload = await loop.run_in_executor(self.executor, self._handle, request)
+                except HttpError as e:
+                    status, payload, keep_alive = e.status, {"error": str(e)}, e.status not in (400, 413)
+                except Exception as e:
+                    status, payload, keep_alive = 500, {"error": f"Internal error ({type(e).__name__})"}, False
+
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self._serve_connection, host, port, limit=MAX_HEADER_SIZE)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+        for conn in self.connections:
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the flight database over HTTP/JSON")
+    parser.add_argument("--db", default="table.db", help="database to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="threads running database work")
+    parser.add_argument("--profile", choices=list(db_initialisation.PROFILES), default="default",
+                        help="connection tuning profile")
+    args = parser.parse_args()
+
+    # Creates the schema and switches to WAL so worker connections can read while another writes
+    db_initialisation.initialise_db(args.db, args.profile).close()
+
+    flight_server = FlightServer(args.db, args.profile, args.workers)
+    try:
+        asyncio.run(flight_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        flight_server.close()
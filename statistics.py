@@ -1,101 +1,175 @@
 import sqlite3
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Tuple
+from typing import Optional
 
+import tables
 import util
+from database import db_names
+from database import db_traffic
+from database.db_traffic import Dimension
 from util import dt_to_db, db_to_dt
 
-from database.db_pilots import get_pilot_from_id
-from database.db_destinations import get_destinations_from_id
-from database.db_aircraft import get_aircraft_from_id
+# Days of departures shown in the statistics
+TREND_DAYS = 7
+
+
+@dataclass
+class Statistics:
+    """Class representing the statistics at a single instant"""
+    now: datetime
+    total_flights: int
+    completed: int
+    to_complete: int
+    in_flight: int
+    departed_last_24h: int
+    departing_next_24h: int
+    last_departure: Optional[datetime]
+    last_arrival: Optional[datetime]
+    total_pilots: int
+    total_destinations: int
+    total_aircraft: int
+    # (ID, name, flight count) or None if there are no flights
+    busiest_pilot: Optional[tuple[int, Optional[str], int]]
+    popular_destination: Optional[tuple[int, Optional[str], int]]
+    popular_destination_week: Optional[tuple[int, Optional[str], int]]
+    popular_aircraft: Optional[tuple[int, Optional[str], int]]
+    # (day, flights departing) for the last TREND_DAYS days, ending today
+    daily_departures: list[tuple[datetime, int]]
+
+
+# The statistics computed on each connection, with the minute they were computed in
+_cache: util.ConnectionCache[Statistics] = util.ConnectionCache()
+
+
+def _most_frequent(conn: sqlite3.Connection, group_sql: str, name_sql: str,
+                   params=()) -> Optional[tuple[int, Optional[str], int]]:
+    """
+    Returns (ID, name, count) for the most frequent ID given a query grouping IDs with their frequency and a
+    query returning the name of an ID
+    """
+    row = conn.execute(
+        f"SELECT grouped.id, ({name_sql}), grouped.frequency "
+        f"FROM ({group_sql}) AS grouped ORDER BY grouped.frequency DESC LIMIT 1",
+        params
+    ).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], row[2]
 
 
-def print_stat(conn: sqlite3.Connection, title: str, table: str, cond: str, params: Tuple) -> None:
+def _busiest(conn: sqlite3.Connection, dimension: Dimension, after: Optional[datetime] = None,
+             before: Optional[datetime] = None) -> Optional[tuple[int, Optional[str], int]]:
     """
-    Prints how many rows are returned given a table, condition and parameters
+    Returns (ID, name, count) for the entity with the most flights departing in a window, counted from the traffic
+    summaries rather than every flight
     """
-    print(f"\t{title}: {conn.execute('SELECT COUNT() FROM ' + table + ' ' + cond, params).fetchone()[0]}")
+    table = dimension.get_entity_table()
+    group_sql, params = db_traffic.flights_by_entity_sql(dimension, after, before)
+    return _most_frequent(conn, group_sql, f"SELECT {db_names.NAME_EXPRESSIONS[table]} FROM {table} "
+                                           f"WHERE id = grouped.id", params)
+
+
+def compute_statistics(conn: sqlite3.Connection, now: datetime) -> Statistics:
+    """Computes all statistics relative to now"""
+    t_now = dt_to_db(now)
+    t_day_ago = dt_to_db(now - timedelta(days=1))
+    t_day_ahead = dt_to_db(now + timedelta(days=1))
+
+    # Every flight count in one pass
+    flights = conn.execute(
+        "SELECT COUNT(), "
+        "COUNT() FILTER (WHERE arrival_time < :now), "
+        "COUNT() FILTER (WHERE arrival_time > :now), "
+        "COUNT() FILTER (WHERE departure_time < :now AND arrival_time > :now), "
+        "COUNT() FILTER (WHERE departure_time > :day_ago AND departure_time < :now), "
+        "COUNT() FILTER (WHERE departure_time > :now AND departure_time < :day_ahead), "
+        "MAX(departure_time), MAX(arrival_time) "
+        "FROM flights",
+        {"now": t_now, "day_ago": t_day_ago, "day_ahead": t_day_ahead}
+    ).fetchone()
 
+    totals = conn.execute(
+        "SELECT (SELECT COUNT() FROM pilots), (SELECT COUNT() FROM destinations), (SELECT COUNT() FROM aircraft)"
+    ).fetchone()
 
-def show_statistics(conn: sqlite3.Connection):
+    return Statistics(
+        now,
+        flights[0], flights[1], flights[2], flights[3], flights[4], flights[5],
+        None if flights[6] is None else db_to_dt(flights[6]),
+        None if flights[7] is None else db_to_dt(flights[7]),
+        totals[0], totals[1], totals[2],
+        _busiest(conn, Dimension.PILOTS),
+        _busiest(conn, Dimension.DESTINATIONS),
+        _busiest(conn, Dimension.DESTINATIONS, now, now + timedelta(days=7)),
+        _busiest(conn, Dimension.AIRCRAFT),
+        # Every flight has one source, so the source summary's daily totals count every flight
+        db_traffic.traffic_series(conn, Dimension.SOURCES, now - timedelta(days=TREND_DAYS - 1), now),
+    )
+
+
+def get_statistics(conn: sqlite3.Connection) -> Statistics:
     """
-    Prints a range of statistics
+    Returns the statistics, only recomputing them if the database has changed or the minute has turned since they
+    were last computed, as counts such as the flights in the air depend on the time as well as the data
     """
-    print("Flights:")
-    total_flights = conn.execute('SELECT COUNT() FROM flights').fetchone()[0]
-    print("\tTotal Flights:", total_flights)
-
-    print_stat(conn, "Completed", "flights", "WHERE arrival_time < ?", (dt_to_db(datetime.now()),))
-    print_stat(conn, "To Complete", "flights", "WHERE arrival_time > ?", (dt_to_db(datetime.now()),))
-    print_stat(conn, "In Flight", "flights", "WHERE departure_time < ? AND arrival_time > ?", (dt_to_db(datetime.now()), dt_to_db(datetime.now())))
-
-    start = datetime.now() - timedelta(days=1)
-    end = datetime.now()
-    print_stat(conn, "Flights departed in last 24h", "flights", "WHERE departure_time > ? AND departure_time < ?", (dt_to_db(start), dt_to_db(end)))
-
-    start = datetime.now()
-    end = datetime.now() + timedelta(days=1)
-    print_stat(conn, "Flights departing in next 24h", "flights", "WHERE departure_time > ? AND departure_time < ?", (dt_to_db(start), dt_to_db(end)))
-
-    if total_flights != 0:
-        print("\tLast scheduled flight departure: ", end="")
-        last = conn.execute(
-            "SELECT departure_time FROM flights ORDER BY departure_time DESC"
-        ).fetchone()[0]
-        print(util.dt_format(db_to_dt(last)))
-
-        print("\tLast scheduled flight arrival: ", end="")
-        last = conn.execute(
-            "SELECT arrival_time FROM flights ORDER BY arrival_time DESC"
-        ).fetchone()[0]
-        print(util.dt_format(db_to_dt(last)))
+    now = datetime.now()
+    return _cache.get(conn, lambda: compute_statistics(conn, now), now.replace(second=0, microsecond=0))
 
-    print()
-
-    print("Pilots")
-    print_stat(conn, "Total Pilots", "pilots", "", ())
 
-    row = conn.execute(
-        "SELECT pilot_id, COUNT(pilot_id) AS `frequency` FROM pilot_flights GROUP BY pilot_id ORDER BY `frequency` DESC"
-    ).fetchone()
-    if row is not None:
-        pilot, count = row[0], row[1]
-        print(f"\tPilot with most scheduled flights (all time): {get_pilot_from_id(conn, pilot)} [ID: {pilot}] - {count} flight(s)")
+def print_statistics(stats: Statistics):
+    """
+    Prints a range of statistics
+    """
+    def print_most_frequent(title: str, value: Optional[tuple[int, Optional[str], int]]):
+        if value is not None:
+            name = "[INVALID ID]" if value[1] is None else value[1]
+            print(f"\t{title}: {name} [ID: {value[0]}] - {value[2]} flight(s)")
 
+    print(f"Statistics as of {util.dt_format(stats.now)}")
     print()
 
-    print("Destinations")
+    print("Flights:")
+    print("\tTotal Flights:", stats.total_flights)
+    print(f"\tCompleted: {stats.completed}")
+    print(f"\tTo Complete: {stats.to_complete}")
+    print(f"\tIn Flight: {stats.in_flight}")
+    print(f"\tFlights departed in last 24h: {stats.departed_last_24h}")
+    print(f"\tFlights departing in next 24h: {stats.departing_next_24h}")
 
-    print_stat(conn, "Total Destinations", "destinations", "", ())
+    if stats.total_flights != 0:
+        print(f"\tLast scheduled flight departure: {util.dt_format(stats.last_departure)}")
+        print(f"\tLast scheduled flight arrival: {util.dt_format(stats.last_arrival)}")
 
-    row = conn.execute(
-        "SELECT destination_id, COUNT(destination_id) AS `frequency` FROM flights GROUP BY destination_id ORDER BY `frequency` DESC"
-    ).fetchone()
-    if row is not None:
-        destination, count = row[0], row[1]
-        print(f"\tMost popular destination: {get_destinations_from_id(conn, destination)} [ID: {destination}] - {count} flight(s)")
+    print(f"\tDepartures per day (last {TREND_DAYS} days):")
+    tables.print_table([[util.dt_format_no_time(day), str(count)] for day, count in stats.daily_departures], "\t\t")
 
-    start = datetime.now()
-    end = datetime.now() + timedelta(days=7)
-    row = conn.execute(
-        "SELECT destination_id, COUNT(destination_id) AS `frequency` FROM flights WHERE departure_time > ? AND departure_time < ? GROUP BY destination_id ORDER BY `frequency` DESC",
-        (dt_to_db(start), dt_to_db(end))
-    ).fetchone()
-    if row is not None:
-        destination, count = row[0], row[1]
-        print(f"\tMost popular destination over next week: {get_destinations_from_id(conn, destination)} [ID: {destination}] - {count} flight(s)")
+    print()
 
+    print("Pilots")
+    print(f"\tTotal Pilots: {stats.total_pilots}")
+    print_most_frequent("Pilot with most scheduled flights (all time)", stats.busiest_pilot)
+    print()
+
+    print("Destinations")
+    print(f"\tTotal Destinations: {stats.total_destinations}")
+    print_most_frequent("Most popular destination", stats.popular_destination)
+    print_most_frequent("Most popular destination over next week", stats.popular_destination_week)
     print()
 
     print("Aircraft")
-    print_stat(conn, "Total Aircraft", "aircraft", "", ())
-    row = conn.execute(
-        "SELECT aircraft_id, COUNT(aircraft_id) AS `frequency` FROM flights GROUP BY aircraft_id ORDER BY `frequency` DESC"
-    ).fetchone()
-    if row is not None:
-        aircraft, count = row[0], row[1]
-        print(f"\tMost popular aircraft: {get_aircraft_from_id(conn, aircraft)} [ID: {aircraft}] - {count} flight(s)")
+    print(f"\tTotal Aircraft: {stats.total_aircraft}")
+    print_most_frequent("Most popular aircraft", stats.popular_aircraft)
     print()
 
-    input("Press enter...")
+
+def show_statistics(conn: sqlite3.Connection):
+    """
+    Prints the statistics, reprinting them whenever another session changes the data
+    """
+    while True:
+        print_statistics(get_statistics(conn))
+        print("Press enter...")
+        if util.input_or_refresh(conn) is not None:
+            break
     print()
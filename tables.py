@@ -0,0 +1,136 @@
+import sys
+from typing import Iterable, Optional, TextIO
+
+import consts
+
+# Written after every cell
+COLUMN_GAP = "    "
+# Replaces the end of a cell cut short in a streamed table
+TRUNCATION_MARK = "..."
+
+
+def column_widths(rows: Iterable[list[str]]) -> list[int]:
+    """Returns the width of the longest cell in each column"""
+    widths = []
+    for row in rows:
+        for i, s in enumerate(row):
+            if i == len(widths):
+                widths.append(0)
+            widths[i] = max(widths[i], len(s))
+    return widths
+
+
+def format_row(row: list[str], widths: list[int], indent: str = "") -> str:
+    """Formats a row of a table (including the line break) with each cell padded to its column's width"""
+    return indent + "".join(s.ljust(width) + COLUMN_GAP for s, width in zip(row, widths)) + "\n"
+
+
+def format_table(table: list[list[str]], indent: str = "") -> str:
+    """Formats a 2D array of strings as a table"""
+    widths = column_widths(table)
+    return "".join(format_row(row, widths, indent) for row in table)
+
+
+def print_table(table: list[list[str]], indent: str = ""):
+    """Prints a 2D array of strings as a table with a single write"""
+    sys.stdout.write(format_table(table, indent))
+
+
+def truncate(s: str, width: int) -> str:
+    """Cuts a cell down to a width, marking that it was cut"""
+    if len(s) <= width:
+        return s
+    return s[:max(width - len(TRUNCATION_MARK), 0)] + TRUNCATION_MARK
+
+
+def _ask_continue() -> bool:
+    """Waits for the user between pages and returns False if they want to stop"""
+    return not input("-- More (Enter to continue, Q to stop) -- ").strip().lower().startswith("q")
+
+
+class TableWriter:
+    """
+    Class writing a table too large to hold in memory. Rows are buffered and written a block at a time, with
+    column widths taken from the first block and longer cells truncated. If paged (and the user is at a
+    terminal), waits for the user after every page and repeats the headings at the top of the next
+    """
+    def __init__(self, headings: Optional[list[str]] = None, out: Optional[TextIO] = None, indent: str = "",
+                 paged: bool = False, block_size: int = consts.TABLE_BLOCK_ROWS,
+                 max_cell_width: int = consts.TABLE_MAX_CELL_WIDTH):
+        self.headings = headings
+        self.out = out
+        self.indent = indent
+        self.block_size = block_size
+        self.max_cell_width = max_cell_width
+        self.page_size = consts.TABLE_PAGE_ROWS if paged and self._is_interactive() else None
+        self.widths: Optional[list[int]] = None
+        self.rows_written = 0
+        self.stopped = False  # Set once the user stops paging
+        self._pending: list[list[str]] = []
+        self._page_rows = 0
+        self._at_page_start = True
+
+    def _stream(self) -> TextIO:
+        # sys.stdout is looked up on every write so that redirecting it after construction works
+        return sys.stdout if self.out is None else self.out
+
+    def _is_interactive(self) -> bool:
+        return sys.stdin.isatty() and self._stream().isatty()
+
+    def write_rows(self, rows: Iterable[list[str]]) -> bool:
+        """Adds rows to the table and returns False once the user has stopped paging"""
+        for row in rows:
+            if self.stopped:
+                break
+            self._pending.append(row)
+            if len(self._pending) >= self.block_size:
+                self._write_pending()
+        return not self.stopped
+
+    def close(self):
+        """Writes any rows still buffered (and the headings if there were no rows)"""
+        self._write_pending()
+        if self.rows_written == 0 and self._at_page_start and self.headings is not None:
+            self._stream().write(self._format(self.headings))
+
+    def _format(self, row: list[str]) -> str:
+        return format_row([truncate(s, width) for s, width in zip(row, self.widths)], self.widths, self.indent)
+
+    def _write_pending(self):
+        if self.widths is None:
+            sample = self._pending if self.headings is None else [self.headings] + self._pending
+            self.widths = [min(width, self.max_cell_width) for width in column_widths(sample)]
+
+        while len(self._pending) > 0 and not self.stopped:
+            # The user is asked before the next page rather than after each page, so a table ending on a page
+            # boundary doesn't wait for nothing
+            if self.page_size is not None and self._page_rows == self.page_size:
+                if not _ask_continue():
+                    self.stopped = True
+                    break
+                self._page_rows = 0
+                self._at_page_start = True
+
+            count = len(self._pending) if self.page_size is None else \
+                min(len(self._pending), self.page_size - self._page_rows)
+            text = ""
+            if self._at_page_start and self.headings is not None:
+                text = self._format(self.headings)
+            self._at_page_start = False
+
+            self._stream().write(text + "".join(self._format(row) for row in self._pending[:count]))
+            del self._pending[:count]
+            self._page_rows += count
+            self.rows_written += count
+
+        if self.stopped:
+            self._pending.clear()
+
+
+def stream_table(rows: Iterable[list[str]], headings: Optional[list[str]] = None, indent: str = "",
+                 paged: bool = True) -> int:
+    """Prints rows as a table without holding them all in memory and returns the number printed"""
+    writer = TableWriter(headings, indent=indent, paged=paged)
+    writer.write_rows(rows)
+    writer.close()
+    return writer.rows_written
@@ -0,0 +1,321 @@
+"""
+Benchmarks the non-interactive core of every menu hot path against generated datasets of several sizes,
+reporting latency percentiles and the number of statements each run executes. Run from the repository root with:
+    python -m testing.benchmark
+Results are compared with the stored baseline and the run fails if a path executes more statements than it did.
+Latencies are compared after scaling the baseline by how fast a fixed calibration workload runs on each machine, and
+only reported, as they vary too much between machines to fail on. Record a new baseline with:
+    python -m testing.benchmark --update-baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+import check_for_errors
+import statistics
+import util
+from database import db_flight_records
+from database import db_flights
+from database import db_initialisation
+from filters import DateRange, MultiSelection, MultiSelectionType
+from flights import FlightSearchOptions
+from pagination import KeysetPager
+from testing import generate_dataset
+
+if __name__ != "__main__":
+    exit(-1)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+PERCENTILES = (50, 95, 99)
+# Rows in the calibration workload's table and times it is run
+CALIBRATION_ROWS = 20_000
+CALIBRATION_REPEAT = 15
+
+
+@dataclass
+class Benchmark:
+    """Class representing a single hot path to time"""
+    name: str
+    run: Callable[[sqlite3.Connection], None]
+    # Called after every run outside of the timed section, e.g. to undo writes
+    teardown: Optional[Callable[[sqlite3.Connection], None]] = None
+
+
+@dataclass
+class Result:
+    """Class representing the timings of a benchmark on one dataset"""
+    # Milliseconds for each percentile in PERCENTILES
+    percentiles: dict[str, float]
+    # Statements executed by a single run
+    queries: int
+
+    def to_dict(self) -> dict:
+        return {"percentiles": self.percentiles, "queries": self.queries}
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Returns the nearest-rank percentile of sorted values"""
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def search(departure: DateRange, **selections: MultiSelection) -> Callable[[sqlite3.Connection], None]:
+    """Returns a run displaying the first page of a flight search"""
+    def run(conn: sqlite3.Connection):
+        options = FlightSearchOptions(departure, DateRange(None, None))
+        for attribute, selection in selections.items():
+            setattr(options, attribute, selection)
+        options.display_flights(conn)
+    return run
+
+
+def search_next_page(conn: sqlite3.Connection):
+    options = FlightSearchOptions(DateRange(None, None), DateRange(None, None))
+    options.display_flights(conn)
+    options.pager.next_page()
+    options.display_flights(conn)
+
+
+def search_seek(conn: sqlite3.Connection):
+    options = FlightSearchOptions(DateRange(None, None), DateRange(None, None))
+    options.pager.seek(util.dt_to_db(generate_dataset.GeneratorOptions.start + timedelta(days=180)))
+    options.display_flights(conn)
+
+
+def print_page(conn: sqlite3.Connection):
+    util.print_flight_rows(db_flight_records.get_flight_records_from_ids(conn, list(range(1, 11))), 10)
+
+
+def picker(table: str, columns: str) -> Callable[[sqlite3.Connection], None]:
+    """Returns a run fetching and printing the first page of an entity picker"""
+    def run(conn: sqlite3.Connection):
+        rows = KeysetPager(("id",)).fetch(conn, table, columns, [], [])
+        util.print_table([[str(value) for value in row] for row in rows])
+    return run
+
+
+def uncached_statistics(conn: sqlite3.Connection):
+    statistics.compute_statistics(conn, datetime.now())
+
+
+def full_integrity_check(conn: sqlite3.Connection):
+    check_for_errors.print_report(conn, check_for_errors.check_integrity(conn, True, True))
+
+
+def incremental_integrity_check(conn: sqlite3.Connection):
+    conn.execute("UPDATE flights SET arrival_time = arrival_time + 1 WHERE id = 1")
+    check_for_errors.print_report(conn, check_for_errors.check_integrity(conn))
+
+
+def save_existing_flight(conn: sqlite3.Connection):
+    current_pilots = {row[0] for row in conn.execute("SELECT pilot_id FROM pilot_flights WHERE flight_id = 1")}
+    row = conn.execute(
+        "SELECT source_id, destination_id, departure_time, arrival_time, aircraft_id FROM flights WHERE id = 1"
+    ).fetchone()
+    data = db_flights.FlightData(
+        row[0], row[1], util.db_to_dt(row[2]), util.db_to_dt(row[3] + 60_000), row[4],
+        MultiSelection(MultiSelectionType.PILOT, {1, 2})
+    )
+    db_flights.save_flight(conn, 1, data, current_pilots)
+
+
+def save_new_flight(conn: sqlite3.Connection):
+    departure = generate_dataset.GeneratorOptions.start
+    data = db_flights.FlightData(1, 2, departure, departure + timedelta(hours=2), 1,
+                                 MultiSelection(MultiSelectionType.PILOT, {1, 2}))
+    db_flights.save_flight(conn, None, data)
+
+
+def rollback(conn: sqlite3.Connection):
+    conn.rollback()
+
+
+BENCHMARKS = [
+    Benchmark("display_flights", search(DateRange(None, None))),
+    # The default range starts now, which is after every generated flight, so an open range inside the data stands in
+    Benchmark("display_flights after date",
+              search(DateRange(generate_dataset.GeneratorOptions.start + timedelta(days=180), None))),
+    Benchmark("display_flights next page", search_next_page),
+    Benchmark("display_flights seek", search_seek),
+    Benchmark("display_flights by destination",
+              search(DateRange(None, None), destinations=MultiSelection(MultiSelectionType.DESTINATION, {1, 2}))),
+    Benchmark("display_flights by source",
+              search(DateRange(None, None), sources=MultiSelection(MultiSelectionType.DESTINATION, {3}))),
+    Benchmark("display_flights by pilot",
+              search(DateRange(None, None), pilots=MultiSelection(MultiSelectionType.PILOT, {1, 2, 3}))),
+    Benchmark("display_flights by aircraft",
+              search(DateRange(None, None), aircraft=MultiSelection(MultiSelectionType.AIRCRAFT, {1}))),
+    Benchmark("print_flight_rows", print_page),
+    Benchmark("show_statistics", uncached_statistics),
+    Benchmark("show_statistics cached", lambda conn: statistics.get_statistics(conn)),
+    Benchmark("check_for_errors full", full_integrity_check, rollback),
+    Benchmark("check_for_errors incremental", incremental_integrity_check, rollback),
+    Benchmark("modify_flight save existing", save_existing_flight, rollback),
+    Benchmark("modify_flight save new", save_new_flight, rollback),
+    Benchmark("aircraft picker", picker("aircraft", "id, name")),
+    Benchmark("destination picker", picker("destinations", "id, code, name")),
+    Benchmark("pilot picker", picker("pilots", "id, name, surname")),
+]
+
+
+def run_benchmark(conn: sqlite3.Connection, benchmark: Benchmark, repeat: int) -> Result:
+    """Runs a benchmark (once to warm up, then repeat times) and returns its timings"""
+    queries = []
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat + 1):
+            queries.clear()
+            conn.set_trace_callback(queries.append)
+            started = time.perf_counter()
+            benchmark.run(conn)
+            elapsed = time.perf_counter() - started
+            conn.set_trace_callback(None)
+            if benchmark.teardown is not None:
+                benchmark.teardown(conn)
+            if i > 0:
+                timings.append(elapsed * 1000)
+
+    timings.sort()
+    return Result({f"p{p}": round(percentile(timings, p), 3) for p in PERCENTILES}, len(queries))
+
+
+def create_dataset(directory: str, flights: int, seed: int) -> sqlite3.Connection:
+    """Generates a dataset with the given number of flights and returns a connection to it"""
+    conn = db_initialisation.initialise_db(os.path.join(directory, f"benchmark_{flights}.db"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_dataset.generate(conn, generate_dataset.GeneratorOptions(flights=flights, seed=seed))
+        conn.commit()
+        # Start from a clean integrity state like a database that has been checked before
+        check_for_errors.check_integrity(conn, True, True)
+    return conn
+
+
+def calibrate() -> float:
+    """
+    Returns the median milliseconds a fixed mix of SQLite queries and Python loops takes, which is used to compare
+    latencies measured on different machines
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, a INTEGER, b INTEGER)")
+    conn.executemany("INSERT INTO t (a, b) VALUES (?, ?)",
+                     [(i * 7919 % CALIBRATION_ROWS, i % 97) for i in range(CALIBRATION_ROWS)])
+    conn.execute("CREATE INDEX t_a ON t (a)")
+    timings = []
+    for _ in range(CALIBRATION_REPEAT):
+        started = time.perf_counter()
+        total = 0
+        for a, b in conn.execute("SELECT a, b FROM t ORDER BY a"):
+            total += a * b
+        conn.execute("SELECT b, COUNT(), SUM(a) FROM t GROUP BY b").fetchall()
+        for i in range(0, CALIBRATION_ROWS, 100):
+            conn.execute("SELECT id FROM t WHERE a = ?", (i,)).fetchone()
+        timings.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    timings.sort()
+    return percentile(timings, 50)
+
+
+def find_regressions(results: dict, baseline: dict) -> list[str]:
+    """Returns a description of every benchmark that executes more statements than its baseline"""
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            expected = baseline.get(size, {}).get(name)
+            if expected is not None and result["queries"] > expected["queries"]:
+                regressions.append(f"{name} ({size} flights): {result['queries']} queries, "
+                                   f"baseline {expected['queries']}")
+    return regressions
+
+
+def find_slowdowns(results: dict, baseline: dict, speed: float, tolerance: float, slack: float) -> list[str]:
+    """
+    Returns a description of every benchmark whose median latency exceeds its baseline, scaled by how much slower
+    (speed > 1) this machine ran the calibration workload, by more than the tolerance factor and slack (ms)
+    """
+    slowdowns = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            expected = baseline.get(size, {}).get(name)
+            if expected is None:
+                continue
+            p50, expected_p50 = result["percentiles"]["p50"], expected["percentiles"]["p50"] * speed
+            if p50 > expected_p50 * tolerance and p50 - expected_p50 > slack:
+                slowdowns.append(f"{name} ({size} flights): p50 {p50:.3f}ms, scaled baseline {expected_p50:.3f}ms")
+    return slowdowns
+
+
+parser = argparse.ArgumentParser(description="Benchmark the app's hot paths")
+parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")], default=[1_000, 10_000, 100_000],
+                    help="comma separated numbers of flights to generate")
+parser.add_argument("--repeat", type=int, default=20, help="timed runs of each benchmark")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--only", help="only run benchmarks whose name contains this")
+parser.add_argument("--baseline", default=BASELINE_PATH)
+parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+parser.add_argument("--tolerance", type=float, default=2.0, help="p50 slowdown factor reported")
+parser.add_argument("--slack", type=float, default=1.0, help="p50 slowdown (ms) never reported")
+args = parser.parse_args()
+
+calibration = calibrate()
+print(f"Calibration workload took {calibration:.3f}ms")
+print()
+results = {}
+with tempfile.TemporaryDirectory() as directory:
+    for size in args.sizes:
+        print(f"Generating {size} flights...")
+        conn = create_dataset(directory, size, args.seed)
+        results[str(size)] = {}
+
+        print(f"{'Benchmark':<36}" + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES) + f"{'Queries':>9}")
+        for benchmark in BENCHMARKS:
+            if args.only is not None and args.only not in benchmark.name:
+                continue
+            result = run_benchmark(conn, benchmark, args.repeat)
+            results[str(size)][benchmark.name] = result.to_dict()
+            print(f"{benchmark.name:<36}" + "".join(f"{v:>8.3f}ms" for v in result.percentiles.values())
+                  + f"{result.queries:>9}")
+        print()
+        conn.close()
+
+if args.update_baseline:
+    with open(args.baseline, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "calibration": round(calibration, 3),
+            "results": results,
+        }, f, indent=2)
+    print(f"Baseline written to {args.baseline}")
+    sys.exit(0)
+
+if not os.path.exists(args.baseline):
+    print("No baseline - run with --update-baseline to create one")
+    sys.exit(0)
+
+with open(args.baseline) as f:
+    baseline = json.load(f)
+
+speed = calibration / baseline["calibration"]
+slowdowns = find_slowdowns(results, baseline["results"], speed, args.tolerance, args.slack)
+for slowdown in slowdowns:
+    print(f"SLOWER (advisory): {slowdown}")
+print(f"This machine ran the calibration workload {speed:.2f}x as long as the baseline's")
+
+regressions = find_regressions(results, baseline["results"])
+for regression in regressions:
+    print(f"REGRESSION: {regression}")
+print(f"{len(regressions)} regression(s) against baseline")
+sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,263 @@
+"""
+Checks that the assignment solver keeps aircraft and pilots to one flight at a time and to where they landed, that
+it uses no more of them than needed on schedules it can solve exactly, and times it on a large schedule and on
+reassigning a generated one with too few aircraft and pilots. Run from the repository root with:
+    python -m testing.check_assignments
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import assignment
+import conflicts
+from assignment import ResourceType
+from database import db_flight_query
+from database import db_initialisation
+from testing import generate_dataset
+from util import dt_to_db
+
+if __name__ != "__main__":
+    exit(-1)
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HOUR_MS = 3_600_000
+# Flights in the timed schedule
+LARGE_AIRCRAFT = 400
+LARGE_FLIGHTS_PER_AIRCRAFT = 50
+# Generated flights reassigned to far too few aircraft and pilots, most of which have to keep what they had, and the
+# time that has to take
+LIMITED_FLIGHTS = 20_000
+LIMITED_AIRCRAFT = 30
+LIMITED_PILOTS = 60
+LIMITED_BUDGET_S = 15
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def create_schedule(path: str, rng: random.Random, aircraft: int, flights_per_aircraft: int, locations: int):
+    """
+    Creates a database where every aircraft flies a chain of flights between random locations and each flight's
+    pilots are the aircraft's crew, so the schedule is consistent. A few aircraft and pilots are left idle
+    """
+    conn = db_initialisation.initialise_db(path)
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(locations)])
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(aircraft + 5)])
+    conn.executemany("INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+                     [("Pilot", str(i), dt_to_db(START)) for i in range(2 * aircraft + 5)])
+    flights, crew = [], []
+    for aircraft_id in range(1, aircraft + 1):
+        location = rng.randint(1, locations)
+        now = dt_to_db(START) + rng.randint(0, 24 * HOUR_MS)
+        for _ in range(flights_per_aircraft):
+            destination = rng.randint(1, locations)
+            arrival = now + rng.randint(1, 6) * HOUR_MS // 2
+            flights.append((len(flights) + 1, location, destination, now, arrival, aircraft_id))
+            crew += [(2 * aircraft_id - 1, len(flights)), (2 * aircraft_id, len(flights))]
+            location = destination
+            now = arrival + rng.randint(0, 8) * HOUR_MS // 4
+    conn.executemany("INSERT INTO flights (id, source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", flights)
+    conn.executemany("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)", crew)
+    conn.commit()
+    return conn
+
+
+def schedule_breaks(conn, resource_type: ResourceType) -> dict[int, tuple[int, int]]:
+    """Returns the flights either side of the first overlap or break in continuity in each resource's schedule"""
+    timelines = defaultdict(list)
+    for row in conn.execute(resource_type.get_schedule_sql(), (-2 ** 63, 2 ** 63 - 1)):
+        timelines[row[0]].append(row[1:])
+    breaks = {}
+    for resource_id, legs in timelines.items():
+        for (first, _, destination, _, arrival), (second, source, _, departure, _) in zip(legs, legs[1:]):
+            if arrival > departure or destination != source:
+                breaks[resource_id] = (first, second)
+                break
+    return breaks
+
+
+def minimum_resources(conn, pilots_per_flight: int = 1) -> int:
+    """
+    Returns the fewest resources able to fly every flight when there are no other commitments: at each location,
+    the most departures ever outnumbering the arrivals that landed in time
+    """
+    events = conn.execute(
+        "SELECT source_id, departure_time, 1, 1 FROM flights UNION ALL "
+        "SELECT destination_id, arrival_time, 0, -1 FROM flights ORDER BY 2, 3"
+    ).fetchall()
+    balance, needed = defaultdict(int), defaultdict(int)
+    for location, _, _, change in events:
+        balance[location] += change
+        needed[location] = max(needed[location], balance[location])
+    return sum(needed.values()) * pilots_per_flight
+
+
+def used(conn, resource_type: ResourceType) -> int:
+    return len({row[0] for row in conn.execute(resource_type.get_schedule_sql(), (-2 ** 63, 2 ** 63 - 1))})
+
+
+def apply(conn, query: db_flight_query.FlightQuery, reassign: bool, pilots_per_flight: int = 2,
+          local_search: bool = True) -> tuple[list[assignment.AssignmentResult], float]:
+    """
+    Solves and saves assignments, checking nothing is double-booked and every break left is reported, and returns
+    (results, seconds taken). Flights that couldn't be reassigned keep what they had, which may leave their
+    resources out of position
+    """
+    started = time.perf_counter()
+    results = assignment.solve(conn, query, reassign, pilots_per_flight, local_search)
+    elapsed = time.perf_counter() - started
+    assignment.apply_assignments(conn, results, reassign)
+    # Schedules may already have been double-booked, so only conflicts with a new assignment count
+    assigned = {(result.resource_type.name, flight_id, resource_id)
+                for result in results for flight_id, resource_id in result.assignments}
+    for conflict in conflicts.find_conflicts(conn):
+        if all((conflict.conflict_type.name, flight_id, conflict.resource_id) not in assigned
+               for flight_id in (conflict.first_flight, conflict.second_flight)):
+            continue
+        check(False, f"{conflict.conflict_type.get_name()} {conflict.resource_id} was given flights "
+                     f"{conflict.first_flight} and {conflict.second_flight} at the same time")
+    for result in results:
+        check(result.used <= result.used_greedy, f"{result.resource_type.get_name()}: local search used more")
+        for resource_id, (first, second) in schedule_breaks(conn, result.resource_type).items():
+            check(resource_id in result.stranded or first in result.unassigned or second in result.unassigned,
+                  f"{result.resource_type.get_name()} {resource_id} can't fly flight {first} then {second}")
+    return results, elapsed
+
+
+with tempfile.TemporaryDirectory() as directory:
+    rng = random.Random(0)
+    conn = create_schedule(os.path.join(directory, "small.db"), rng, 30, 20, 12)
+    flight_count = conn.execute("SELECT COUNT() FROM flights").fetchone()[0]
+
+    # Reassigning everything is solved exactly by the greedy pass
+    for local_search in [False, True]:
+        conn.execute("SAVEPOINT test")
+        results, _ = apply(conn, db_flight_query.FlightQuery(), True, 2, local_search)
+        for result in results:
+            name = result.resource_type.get_name()
+            check(len(result.unassigned) == 0, f"{name}: {len(result.unassigned)} flight(s) left unassigned")
+            check(len(result.stranded) == 0, f"{name}: {len(result.stranded)} can't fly their flights")
+            needed = flight_count * (1 if result.resource_type == ResourceType.AIRCRAFT else 2)
+            check(len(result.assignments) == needed, f"{name}: {len(result.assignments)} assignments made")
+            minimum = minimum_resources(conn, 1 if result.resource_type == ResourceType.AIRCRAFT else 2)
+            check(result.used == minimum, f"{name}: {result.used} used instead of the minimum {minimum}")
+            check(used(conn, result.resource_type) == result.used, f"{name}: reported usage differs")
+        conn.execute("ROLLBACK TO test")
+        conn.execute("RELEASE test")
+
+    # Reassigning a window has to get everything back for the flights either side. Resources that can't be are put
+    # back to the flights they had, so every window flight still has an aircraft and two pilots and nothing is left
+    # out of position
+    window = db_flight_query.FlightQuery(START + timedelta(days=1), START + timedelta(days=2))
+    window_flights = db_flight_query.count_flights(conn, window)
+    conn.execute("SAVEPOINT test")
+    results, _ = apply(conn, window, True)
+    print(f"Reassigned a window of {window_flights} flights")
+    for result in results:
+        name = result.resource_type.get_name()
+        check(len(result.stranded) == 0, f"{name}: {len(result.stranded)} can't reach their next flight")
+        print(f"\t{name}: {result.to_string()}")
+    sql, arguments = window.sql(conn)
+    crewed = conn.execute(
+        f"SELECT COUNT() FROM ({sql}) AS f WHERE aircraft_id IN (SELECT id FROM aircraft) "
+        f"AND (SELECT COUNT() FROM pilot_flights WHERE flight_id = f.id) = 2", arguments
+    ).fetchone()[0]
+    check(crewed == window_flights, f"{window_flights - crewed} window flight(s) lost their aircraft or pilots")
+    conn.execute("ROLLBACK TO test")
+    conn.execute("RELEASE test")
+
+    # Filling in flights that lost their aircraft or pilots
+    lost = rng.sample(range(1, flight_count + 1), flight_count // 10)
+    # Dangling aircraft IDs can only come from data loaded without foreign keys
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.executemany("UPDATE flights SET aircraft_id = 1000000 WHERE id = ?", [(i,) for i in lost])
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executemany("DELETE FROM pilot_flights WHERE rowid IN (SELECT rowid FROM pilot_flights WHERE flight_id = ? "
+                     "LIMIT ?)", [(i, rng.randint(1, 2)) for i in lost])
+    results, _ = apply(conn, db_flight_query.FlightQuery(), False)
+    for result in results:
+        name = result.resource_type.get_name()
+        check(len(result.unassigned) == 0, f"{name}: {len(result.unassigned)} flight(s) left unfilled")
+        check(len(result.stranded) == 0, f"{name}: {len(result.stranded)} stranded by filling in flights")
+    check(conn.execute("SELECT COUNT() FROM flights WHERE aircraft_id NOT IN (SELECT id FROM aircraft)").fetchone()[0]
+          == 0, "flights were left without an aircraft")
+    check(conn.execute("SELECT COUNT() FROM flights WHERE (SELECT COUNT() FROM pilot_flights WHERE flight_id = id) "
+                       "!= 2").fetchone()[0] == 0, "flights were left without two pilots")
+    results = assignment.solve(conn, db_flight_query.FlightQuery(), False, 2)
+    check(all(len(r.assignments) == 0 for r in results), "a filled in schedule should need nothing more")
+    conn.close()
+
+    # Two flights leave D3 together: flight 3 on aircraft 1 and pilot 1, which landed at D1, and flight 4 on
+    # aircraft 2 and pilot 2, which landed at D3. Only one can be reassigned, and the other has to keep what it had
+    conn = db_initialisation.initialise_db(os.path.join(directory, "clash.db"))
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(1, 5)])
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [("Aircraft 1",), ("Aircraft 2",)])
+    conn.executemany("INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+                     [("Pilot", "1", dt_to_db(START)), ("Pilot", "2", dt_to_db(START))])
+    departure = dt_to_db(START + timedelta(days=1))
+    conn.executemany("INSERT INTO flights (id, source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     [(1, 2, 1, dt_to_db(START), dt_to_db(START) + HOUR_MS, 1),
+                      (2, 2, 3, dt_to_db(START), dt_to_db(START) + HOUR_MS, 2),
+                      (3, 3, 4, departure, departure + HOUR_MS, 1),
+                      (4, 3, 2, departure, departure + HOUR_MS, 2)])
+    conn.executemany("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)", [(1, 1), (2, 2), (1, 3), (2, 4)])
+    conn.commit()
+    results, _ = apply(conn, db_flight_query.FlightQuery(START + timedelta(hours=12), None), True, 1)
+    for result in results:
+        check(3 in result.unassigned, f"{result.resource_type.get_name()}: flight 3 was reassigned")
+    check(conn.execute("SELECT aircraft_id FROM flights WHERE id = 4").fetchone()[0] == 2,
+          "flight 4 lost its aircraft")
+    check(conn.execute("SELECT pilot_id FROM pilot_flights WHERE flight_id = 4").fetchall() == [(2,)],
+          "flight 4 lost its pilot")
+    conn.close()
+
+    conn = create_schedule(os.path.join(directory, "large.db"), rng, LARGE_AIRCRAFT, LARGE_FLIGHTS_PER_AIRCRAFT, 60)
+    for local_search in [False, True]:
+        conn.execute("SAVEPOINT test")
+        results, elapsed = apply(conn, db_flight_query.FlightQuery(), True, 2, local_search)
+        conn.execute("ROLLBACK TO test")
+        conn.execute("RELEASE test")
+        print(f"Solved {LARGE_AIRCRAFT * LARGE_FLIGHTS_PER_AIRCRAFT} flights "
+              f"{'with' if local_search else 'without'} local search in {elapsed:.2f}s")
+        for result in results:
+            print(f"\t{result.resource_type.get_name()}: {result.to_string()}")
+            check(len(result.unassigned) == 0 and len(result.stranded) == 0,
+                  f"{result.resource_type.get_name()}: the large schedule wasn't solved")
+    conn.close()
+
+    # Nearly every flight keeps what it had, and giving each one back mustn't mean solving everything again
+    conn = db_initialisation.initialise_db(os.path.join(directory, "limited.db"))
+    generate_dataset.generate(conn, generate_dataset.GeneratorOptions(
+        flights=LIMITED_FLIGHTS, aircraft=LIMITED_AIRCRAFT, pilots=LIMITED_PILOTS
+    ))
+    for local_search in [False, True]:
+        conn.execute("SAVEPOINT test")
+        results, elapsed = apply(conn, db_flight_query.FlightQuery(), True, 2, local_search)
+        conn.execute("ROLLBACK TO test")
+        conn.execute("RELEASE test")
+        print(f"Reassigned {LIMITED_FLIGHTS} flights to {LIMITED_AIRCRAFT} aircraft and {LIMITED_PILOTS} pilots "
+              f"{'with' if local_search else 'without'} local search in {elapsed:.2f}s")
+        for result in results:
+            print(f"\t{result.resource_type.get_name()}: {result.to_string()}")
+        check(elapsed <= LIMITED_BUDGET_S, f"reassigning the limited schedule took {elapsed:.2f}s, over its "
+                                           f"{LIMITED_BUDGET_S}s budget")
+    conn.close()
+
+print(f"Checked {len(list(ResourceType))} resource types")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,128 @@
+"""
+Checks that the double-booking sweep finds the same overlapping flights as comparing every pair of flights, including
+flights that are never in the air, and that sweeping only the aircraft and pilots with changed flights finds every
+conflict involving them (and isn't reported as clearing the rest). Run from the repository root with:
+    python -m testing.check_conflicts
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+
+import check_for_errors
+import conflicts
+from conflicts import ConflictType
+from database import db_initialisation
+
+if __name__ != "__main__":
+    exit(-1)
+
+HOUR_MS = 3_600_000
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def brute_force(conn, conflict_type: ConflictType) -> set[tuple[int, int, int, int, int]]:
+    """Returns (resource ID, lower flight ID, higher flight ID, overlap start, overlap end) comparing every pair"""
+    if conflict_type == ConflictType.AIRCRAFT:
+        rows = conn.execute("SELECT aircraft_id, departure_time, arrival_time, id FROM flights").fetchall()
+    else:
+        rows = conn.execute("SELECT pilot_id, departure_time, arrival_time, flights.id FROM pilot_flights "
+                            "JOIN flights ON flights.id = pilot_flights.flight_id").fetchall()
+    found = set()
+    for resource_id, departure, arrival, flight_id in rows:
+        for other_resource, other_departure, other_arrival, other_id in rows:
+            start, end = max(departure, other_departure), min(arrival, other_arrival)
+            if (other_resource == resource_id and start < end and departure < arrival
+                    and other_departure < other_arrival and other_id < flight_id):
+                found.add((resource_id, other_id, flight_id, start, end))
+    return found
+
+
+def swept(conflict_list) -> dict[ConflictType, set[tuple[int, int, int, int, int]]]:
+    """Returns the conflicts found in the same form as brute_force (flights departing together come in any order)"""
+    found = {t: set() for t in ConflictType}
+    for c in conflict_list:
+        first, second = sorted((c.first_flight, c.second_flight))
+        found[c.conflict_type].add((c.resource_id, first, second, c.overlap_start, c.overlap_end))
+    return found
+
+
+with tempfile.TemporaryDirectory() as directory:
+    conn = db_initialisation.initialise_db(os.path.join(directory, "conflicts.db"))
+    rng = random.Random(0)
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(10)])
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(5)])
+    conn.executemany("INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+                     [("Pilot", str(i), 0) for i in range(15)])
+
+    def insert_flight():
+        departure = rng.randint(0, 200) * HOUR_MS // 2
+        # Some land before they depart or as they depart
+        duration = rng.choice([-HOUR_MS, 0]) if rng.random() < 0.1 else rng.randint(1, 8) * HOUR_MS // 2
+        flight_id = conn.execute(
+            "INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (rng.randint(1, 5), rng.randint(1, 5), departure, departure + duration, rng.randint(1, 10))
+        ).lastrowid
+        conn.executemany("INSERT OR IGNORE INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)",
+                         [(rng.randint(1, 15), flight_id) for _ in range(rng.randint(1, 2))])
+
+    for _ in range(300):
+        insert_flight()
+    conn.commit()
+
+    full = swept(conflicts.find_conflicts(conn))
+    for conflict_type in ConflictType:
+        expected = brute_force(conn, conflict_type)
+        check(full[conflict_type] == expected,
+              f"{conflict_type.get_plural()}: the sweep found {sorted(full[conflict_type] - expected)} and missed "
+              f"{sorted(expected - full[conflict_type])}")
+    check(all(start < end for found in full.values() for _, _, _, start, end in found),
+          "an overlap ends before it starts")
+
+    # Changes since a saved check only need the aircraft and pilots of changed flights sweeping
+    checked = 0
+    for _ in range(10):
+        check_for_errors.check_integrity(conn, save=True)
+        for _ in range(rng.randint(1, 5)):
+            if rng.random() < 0.5:
+                insert_flight()
+            else:
+                conn.execute("UPDATE flights SET departure_time = departure_time + ?, aircraft_id = ? WHERE id = ?",
+                             (rng.randint(-4, 4) * HOUR_MS, rng.randint(1, 10), rng.randint(1, 300)))
+        conn.commit()
+
+        changed = conflicts.changed_resources(conn)
+        partial = swept(conflicts.find_conflicts(conn, resources=changed))
+        full = swept(conflicts.find_conflicts(conn))
+        for conflict_type in ConflictType:
+            expected = {c for c in full[conflict_type] if c[0] in changed[conflict_type]}
+            check(partial[conflict_type] == expected,
+                  f"{conflict_type.get_plural()}: sweeping changed resources found {len(partial[conflict_type])} "
+                  f"conflicts instead of {len(expected)}")
+        checked += 1
+
+    # A sweep of only changed resources that finds nothing doesn't claim none of the others are double-booked
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        conflicts.print_conflicts(iter(()), resources={t: set() for t in ConflictType})
+        conflicts.print_conflicts(iter(()))
+    expected = ([f"No double-bookings among changed {t.get_plural()}" for t in ConflictType]
+                + [f"No {t.get_plural()} are double-booked" for t in ConflictType])
+    check(output.getvalue().splitlines() == expected, f"printed {output.getvalue().splitlines()} for no conflicts")
+    conn.close()
+
+print(f"Checked {checked} sweeps of changed aircraft and pilots")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
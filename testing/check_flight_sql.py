@@ -0,0 +1,227 @@
+"""
+Pins the SQL generated for flight searches and checks that it selects the right flights. Run from the repository
+root with:
+    python -m testing.check_flight_sql
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import consts
+import util
+from database import db_flight_query
+from database import db_initialisation
+from database import db_spatial
+from database.db_flight_query import FlightQuery
+from util import dt_to_db
+
+if __name__ != "__main__":
+    exit(-1)
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+START_DB = dt_to_db(START)
+
+# (query, expected conditions, expected arguments)
+PINNED = [
+    (FlightQuery(), [], []),
+    (
+        FlightQuery(departure_after=START, departure_before=START + timedelta(days=1)),
+        ["departure_time > ?", "departure_time < ?"],
+        [START_DB, START_DB + 86_400_000],
+    ),
+    (
+        FlightQuery(arrival_after=START, arrival_before=START + timedelta(seconds=1)),
+        ["arrival_time > ?", "arrival_time < ?"],
+        [START_DB, START_DB + 1000],
+    ),
+    (
+        FlightQuery(sources={3, 1, 2}),
+        ["source_id IN (SELECT value FROM json_each(?))"],
+        ["[1, 2, 3]"],
+    ),
+    (
+        FlightQuery(destinations={5}),
+        ["destination_id IN (SELECT value FROM json_each(?))"],
+        ["[5]"],
+    ),
+    (
+        FlightQuery(aircraft={7, 8}),
+        ["aircraft_id IN (SELECT value FROM json_each(?))"],
+        ["[7, 8]"],
+    ),
+    (
+        FlightQuery(pilots={4, 2}),
+        ["id IN (SELECT flight_id FROM pilot_flights WHERE pilot_id IN (SELECT value FROM json_each(?)))"],
+        ["[2, 4]"],
+    ),
+    (
+        FlightQuery(departure_after=START, sources={1}, destinations={2}, aircraft={3}, pilots={4}),
+        [
+            "departure_time > ?",
+            "source_id IN (SELECT value FROM json_each(?))",
+            "destination_id IN (SELECT value FROM json_each(?))",
+            "aircraft_id IN (SELECT value FROM json_each(?))",
+            "id IN (SELECT flight_id FROM pilot_flights WHERE pilot_id IN (SELECT value FROM json_each(?)))",
+        ],
+        [START_DB, "[1]", "[2]", "[3]", "[4]"],
+    ),
+    (
+        FlightQuery(source_area=db_spatial.Circle(0.0, 0.0, 111.19508372419141)),
+        [
+            "source_id IN (SELECT id FROM destinations WHERE id IN (SELECT id FROM destinations_rtree "
+            "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?) "
+            "AND haversine_km(latitude, longitude, ?, ?) <= ?)"
+        ],
+        [-1.0, 1.0, -1.0, 1.0, 0.0, 0.0, 111.19508372419141],
+    ),
+    (
+        FlightQuery(destination_area=db_spatial.Circle(0.0, 180.0, 111.19508372419141)),
+        [
+            "destination_id IN (SELECT id FROM destinations WHERE id IN (SELECT id FROM destinations_rtree "
+            "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ? UNION ALL "
+            "SELECT id FROM destinations_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?) "
+            "AND haversine_km(latitude, longitude, ?, ?) <= ?)"
+        ],
+        [-1.0, 1.0, 179.0, 180.0, -1.0, 1.0, -180.0, -179.0, 0.0, 180.0, 111.19508372419141],
+    ),
+]
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def rounded(arguments: list) -> list:
+    return [round(a, 6) if type(a) == float else a for a in arguments]
+
+
+# Generated SQL
+for query, expected_conditions, expected_arguments in PINNED:
+    conditions, arguments = query.conditions()
+    check(conditions == expected_conditions, f"conditions of {query}:\n\t{conditions}\n\t!= {expected_conditions}")
+    check(rounded(arguments) == rounded(expected_arguments),
+          f"arguments of {query}:\n\t{arguments}\n\t!= {expected_arguments}")
+
+# Queries differing only in their values share a statement
+for a, b in [
+    (FlightQuery(sources={1}), FlightQuery(sources=set(range(1, 500)))),
+    (FlightQuery(pilots={1, 2}, departure_after=START),
+     FlightQuery(pilots={9}, departure_after=START + timedelta(days=2))),
+    (FlightQuery(source_area=db_spatial.Circle(10, 10, 5)), FlightQuery(source_area=db_spatial.Circle(-40, 3, 900))),
+]:
+    check(a.shape() == b.shape() and a.sql()[0] == b.sql()[0], f"{a} and {b} should share a statement")
+
+db_flight_query.compile_conditions.cache_clear()
+for _ in range(3):
+    FlightQuery(departure_after=START, aircraft={1}).conditions()
+check(db_flight_query.compile_conditions.cache_info().hits == 2, "compiled conditions should be reused")
+
+# Results match filtering every flight in Python
+with tempfile.TemporaryDirectory() as directory:
+    conn = db_initialisation.initialise_db(os.path.join(directory, "sql.db"))
+    rng = random.Random(0)
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(10)])
+    coordinates = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(20)]
+    conn.executemany(
+        "INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+        [(f"Destination {i}", f"D{i}", lat, lon) for i, (lat, lon) in enumerate(coordinates)]
+    )
+    conn.executemany("INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+                     [("Pilot", str(i), START_DB) for i in range(10)])
+
+    flights = {}
+    for flight_id in range(1, 501):
+        departure = START_DB + rng.randint(0, 30 * 86_400_000)
+        flight = (rng.randint(1, 20), rng.randint(1, 20), departure,
+                  departure + rng.randint(1, 20 * 3_600_000), rng.randint(1, 10), set(rng.sample(range(1, 11), 2)))
+        flights[flight_id] = flight
+        conn.execute(
+            "INSERT INTO flights (id, source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (flight_id,) + flight[:5]
+        )
+        conn.executemany("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)",
+                         [(p, flight_id) for p in flight[5]])
+
+    def within(destination_id: int, area: db_spatial.Circle) -> bool:
+        latitude, longitude = coordinates[destination_id - 1]
+        return db_spatial.haversine_km(latitude, longitude, area.latitude, area.longitude) <= area.radius_km
+
+    def matches(query: FlightQuery, flight: tuple) -> bool:
+        source, destination, departure, arrival, aircraft, pilots = flight
+        return all([
+            query.departure_after is None or departure > dt_to_db(query.departure_after),
+            query.departure_before is None or departure < dt_to_db(query.departure_before),
+            query.arrival_after is None or arrival > dt_to_db(query.arrival_after),
+            query.arrival_before is None or arrival < dt_to_db(query.arrival_before),
+            len(query.sources) == 0 or source in query.sources,
+            len(query.destinations) == 0 or destination in query.destinations,
+            len(query.aircraft) == 0 or aircraft in query.aircraft,
+            len(query.pilots) == 0 or len(pilots & query.pilots) > 0,
+            query.source_area is None or within(source, query.source_area),
+            query.destination_area is None or within(destination, query.destination_area),
+        ])
+
+    def random_time() -> datetime:
+        return START + timedelta(milliseconds=rng.randint(0, 31 * 86_400_000))
+
+    def random_ids(count: int) -> set[int]:
+        return set(rng.sample(range(1, count + 1), rng.randint(1, 4))) if rng.random() < 0.3 else set()
+
+    def random_area():
+        if rng.random() < 0.8:
+            return None
+        latitude, longitude = rng.choice(coordinates)
+        return db_spatial.Circle(latitude, longitude, rng.uniform(100, 5000))
+
+    def check_results(query: FlightQuery):
+        found = [r.id for r in db_flight_query.iter_flights(conn, query)]
+        expected = sorted((flights[i][2], i) for i in flights if matches(query, flights[i]))
+        expected = [i for _, i in (expected if query.ascending else reversed(expected))]
+        check(found == expected, f"{query} found {len(found)} flight(s) instead of {len(expected)}")
+        check(db_flight_query.count_flights(conn, query) == len(expected), f"{query} counted the wrong flights")
+
+    # Once with every selection inline and once with selections of more than one ID in temporary tables
+    threshold = consts.SELECTION_TABLE_THRESHOLD
+    for consts.SELECTION_TABLE_THRESHOLD in [threshold, 1]:
+        for _ in range(300):
+            start, end = sorted([random_time(), random_time()])
+            check_results(FlightQuery(
+                start if rng.random() < 0.5 else None, end if rng.random() < 0.5 else None,
+                start if rng.random() < 0.2 else None, end if rng.random() < 0.2 else None,
+                random_ids(20), random_ids(20), random_ids(10), random_ids(10), rng.random() < 0.5,
+                random_area(), random_area()
+            ))
+
+    check(FlightQuery(sources={1, 2}, pilots={3, 4}).shape(conn) == ("sources_table", "pilots_table"),
+          "large selections should use temporary tables")
+
+    # Loading a selection leaves the connection as it was, so its unsaved changes and cached data are unaffected
+    conn.commit()
+    version = util.get_data_version(conn)
+    check_results(FlightQuery(pilots={6, 7, 8}))
+    check(not conn.in_transaction, "loading a selection opened a transaction")
+    check(util.get_data_version(conn) == version, "loading a selection changed the data version")
+
+    # A selection loaded in a transaction that is rolled back is loaded again
+    conn.execute("UPDATE flights SET id = id WHERE id = 1")
+    check_results(FlightQuery(pilots={1, 2, 3}))
+    conn.rollback()
+    check_results(FlightQuery(pilots={1, 2, 3}))
+    conn.execute("UPDATE flights SET id = id WHERE id = 1")
+    check_results(FlightQuery(pilots={4, 5}))
+    conn.rollback()
+    check_results(FlightQuery(pilots={1, 2, 3}))
+    consts.SELECTION_TABLE_THRESHOLD = threshold
+
+    conn.close()
+
+print(f"Checked {len(PINNED)} pinned queries")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,55 @@
+"""
+Checks that the bulk loader assigns IDs to rows without one and rejects rows whose IDs are taken. Run from the
+repository root with:
+    python -m testing.check_ingest
+"""
+import os
+import sys
+import tempfile
+
+import ingest
+from database import db_initialisation
+
+if __name__ != "__main__":
+    exit(-1)
+
+# (file name, contents, rows loaded, rows rejected as duplicates) loaded in order into the same database
+FILES = [
+    # Blank IDs are assigned one, however many rows leave them blank
+    ("blank.csv", "id,name\n,A1\n,A2\n,A3\n", 3, 0),
+    ("blank.jsonl", '{"id": "", "name": "A4"}\n{"id": "", "name": "A5"}\n{"name": "A6"}\n', 3, 0),
+    ("no_id.csv", "name\nA7\nA8\n", 2, 0),
+    # IDs given twice in a file or already in the table are still rejected
+    ("explicit.csv", "id,name\n100,B1\n100,B2\n,B3\n1,B4\n", 2, 2),
+    ("explicit.jsonl", '{"id": 200, "name": "B5"}\n{"id": 200, "name": "B6"}\n{"id": 100, "name": "B7"}\n', 1, 2),
+]
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    conn = db_initialisation.initialise_db(os.path.join(directory, "ingest.db"))
+    expected = 0
+    for name, contents, loaded, duplicates in FILES:
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(contents)
+        result = ingest.ingest(conn, {"aircraft": path})[0]
+        check(result.loaded == loaded, f"{name}: {result.loaded} row(s) loaded instead of {loaded}")
+        check(result.rejected == ({"duplicate id": duplicates} if duplicates > 0 else {}),
+              f"{name}: rejected {dict(result.rejected)} instead of {duplicates} duplicate(s)")
+        expected += loaded
+    count = conn.execute("SELECT COUNT() FROM aircraft").fetchone()[0]
+    check(count == expected, f"{count} aircraft in the table instead of {expected}")
+    conn.close()
+
+print(f"Checked {len(FILES)} files")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
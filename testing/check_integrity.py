@@ -0,0 +1,132 @@
+"""
+Checks that incremental integrity checks find the same violations as full ones after random changes (including
+updates to the IDs of pilots and aircraft), that checks which aren't saved write nothing and leave the caller's
+transaction alone, that saved checks are committed on their own and that read-only sessions can check. Run from
+the repository root with:
+    python -m testing.check_integrity
+"""
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import check_for_errors
+from database import db_initialisation
+from database import db_selections
+
+if __name__ != "__main__":
+    exit(-1)
+
+HOUR_MS = 3_600_000
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def tracking(conn) -> tuple[list, list, list]:
+    return (conn.execute("SELECT * FROM integrity_violations ORDER BY violation, row_id, detail").fetchall(),
+            conn.execute("SELECT * FROM integrity_dirty ORDER BY table_name, row_id").fetchall(),
+            conn.execute("SELECT * FROM integrity_state").fetchall())
+
+
+with tempfile.TemporaryDirectory() as directory:
+    conn = db_initialisation.initialise_db(os.path.join(directory, "integrity.db"))
+    # Lets the changes below break references the way other tools editing the database could
+    conn.execute("PRAGMA foreign_keys=OFF")
+    rng = random.Random(0)
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(10)])
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(10)])
+    conn.executemany("INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+                     [("Pilot", str(i), 0) for i in range(20)])
+    for i in range(200):
+        flight_id = conn.execute(
+            "INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (rng.randint(1, 10), rng.randint(1, 10), i * HOUR_MS, (i + 2) * HOUR_MS, rng.randint(1, 10))
+        ).lastrowid
+        conn.execute("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)", (rng.randint(1, 20), flight_id))
+    conn.commit()
+
+    check(check_for_errors.check_integrity(conn, save=True).is_ok(), "a valid database has violations")
+    check(not conn.in_transaction, "a saved check should be committed")
+
+    # (change, highest ID it's made to)
+    changes = [
+        ("UPDATE pilots SET id = id + 100 WHERE id = ?", 20),
+        ("UPDATE aircraft SET id = id + 100 WHERE id = ?", 10),
+        ("UPDATE destinations SET latitude = 100 WHERE id = ?", 10),
+        ("UPDATE flights SET arrival_time = departure_time - 1 WHERE id = ?", 200),
+        ("DELETE FROM pilot_flights WHERE flight_id = ?", 200),
+        ("DELETE FROM destinations WHERE id = ?", 10),
+    ]
+    checked = 0
+    for _ in range(20):
+        for _ in range(rng.randint(1, 4)):
+            sql, highest = rng.choice(changes)
+            conn.execute(sql, (rng.randint(1, highest),))
+
+        # Unsaved checks see the uncommitted changes without writing anything
+        before = tracking(conn)
+        incremental = check_for_errors.check_integrity(conn)
+        full = check_for_errors.check_integrity(conn, True)
+        checked += 1
+        check(incremental.violations == full.violations,
+              f"an incremental check found {incremental.violations} instead of {full.violations}")
+        check(tracking(conn) == before, "an unsaved check changed the tracking tables")
+        try:
+            check_for_errors.check_integrity(conn, save=True)
+            check(False, "saving a check with uncommitted changes should be refused")
+        except ValueError:
+            pass
+        conn.commit()
+
+        # A saved check only commits its own state
+        if rng.random() < 0.5:
+            saved = check_for_errors.check_integrity(conn, save=True)
+            check(saved.violations == full.violations, "a saved check found different violations")
+            check(not conn.in_transaction, "a saved check should be committed")
+            check(len(tracking(conn)[1]) == 0, "a saved check should clear the changed rows")
+
+    flagged = {v for v, rows in check_for_errors.check_integrity(conn).violations.items() if len(rows) > 0}
+    check(check_for_errors.Violation.INVALID_PILOT_ASSIGNMENT in flagged, "updated pilot IDs weren't caught")
+    check(check_for_errors.Violation.INVALID_AIRCRAFT in flagged, "updated aircraft IDs weren't caught")
+    conn.commit()
+
+    # Read-only sessions check alongside an editing session with unsaved changes
+    path = os.path.join(directory, "integrity.db")
+    read_only = db_initialisation.open_read_only(path)
+    expected = check_for_errors.check_integrity(conn).violations
+    conn.execute("UPDATE flights SET arrival_time = departure_time - 1")
+    for full in (False, True):
+        try:
+            report = check_for_errors.check_integrity(read_only, full)
+            check(report.violations == expected, "a read-only check found different violations")
+        except sqlite3.OperationalError as e:
+            check(False, f"a read-only check failed ({e})")
+    # Marking the connection read-only mustn't stop it using the temporary tables searches load selections into
+    try:
+        db_selections.load_selection(read_only, "pilots", range(1, 100))
+    except sqlite3.OperationalError as e:
+        check(False, f"a read-only session couldn't load a selection ({e})")
+    read_only.close()
+
+    # Check for Errors and then Quit without Saving from the main menu of a read-only session
+    output = subprocess.run([sys.executable, "main.py", "--db", path, "--read-only"], input="9\n1\n12\n1\n",
+                            capture_output=True, text=True).stdout
+    check("Checks complete" in output and "Not available" not in output,
+          "Check for Errors should run in a read-only session")
+    conn.rollback()
+    conn.close()
+
+print(f"Checked {checked} incremental integrity checks")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,158 @@
+"""
+Checks that itinerary searches find the earliest arrival for each number of flights against a search over every
+flight, that the flights found connect in time, and times searches over a large schedule. Run from the repository
+root with:
+    python -m testing.check_itineraries
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import itineraries
+from database import db_initialisation
+from util import dt_to_db
+
+if __name__ != "__main__":
+    exit(-1)
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+START_DB = dt_to_db(START)
+HOUR_MS = 3_600_000
+NEVER = 2 ** 63 - 1
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def create_schedule(path: str, rng: random.Random, locations: int, flights: int, days: int):
+    """Creates a database of flights between random locations, with a few that can't be taken"""
+    conn = db_initialisation.initialise_db(path)
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(locations)])
+    conn.execute("INSERT INTO aircraft (name) VALUES ('Aircraft')")
+    rows = []
+    for _ in range(flights):
+        departure = START_DB + rng.randint(0, days * 24 * HOUR_MS)
+        # Landing before departing or where it left
+        duration = rng.randint(-HOUR_MS, 0) if rng.random() < 0.01 else rng.randint(1, 12) * HOUR_MS // 2
+        rows.append((rng.randint(1, locations), rng.randint(1, locations), departure, departure + duration))
+    conn.executemany("INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+                     "VALUES (?, ?, ?, ?, 1)", rows)
+    conn.commit()
+    return conn
+
+
+def earliest_arrivals(flights: list[tuple], source_id: int, destination_id: int, after: int, max_legs: int,
+                      min_connection: int, connection_times: dict[int, int]) -> list[tuple[int, int]]:
+    """Returns (flights, arrival) of each number of flights arriving earlier than fewer, trying every flight"""
+    best = {source_id: after}
+    found = []
+    for legs in range(1, max_legs + 1):
+        reached = dict(best)
+        for _, source, destination, departure, arrival in flights:
+            if source not in best or arrival < departure or source == destination:
+                continue
+            ready = after if source == source_id else best[source] + connection_times.get(source, min_connection)
+            if departure >= ready and arrival < reached.get(destination, NEVER):
+                reached[destination] = arrival
+        best = reached
+        if destination_id in best and (len(found) == 0 or best[destination_id] < found[-1][1]):
+            found.append((legs, best[destination_id]))
+    return found
+
+
+def indexes_match(path: str) -> bool:
+    """
+    Returns True if the index of a database opened on a new connection matches its flights. The connection is gone
+    once this returns, so the next one opened may be given its ID
+    """
+    conn = db_initialisation.initialise_db(path)
+    try:
+        return itineraries.get_network(conn).starts[-1] == itineraries.FlightNetwork.load(conn).starts[-1]
+    finally:
+        conn.close()
+
+
+with tempfile.TemporaryDirectory() as directory:
+    rng = random.Random(0)
+    conn = create_schedule(os.path.join(directory, "small.db"), rng, 25, 3000, 10)
+    flights = conn.execute("SELECT id, source_id, destination_id, departure_time, arrival_time FROM flights").fetchall()
+    by_id = {row[0]: row for row in flights}
+    network = itineraries.get_network(conn)
+
+    searched = 0
+    for _ in range(300):
+        source_id, destination_id = rng.randint(1, 25), rng.randint(1, 25)
+        after = START_DB + rng.randint(-24 * HOUR_MS, 10 * 24 * HOUR_MS)
+        max_legs = rng.randint(1, 6)
+        min_connection = rng.randint(0, 4) * HOUR_MS // 2
+        connection_times = {rng.randint(1, 25): rng.randint(0, 6) * HOUR_MS for _ in range(rng.randint(0, 5))}
+        found = itineraries.search(network, source_id, destination_id, after, max_legs, min_connection,
+                                   connection_times)
+        searched += 1
+
+        expected = [] if source_id == destination_id else earliest_arrivals(
+            flights, source_id, destination_id, after, max_legs, min_connection, connection_times)
+        got = [(len(itinerary.legs), itinerary.get_arrival()) for itinerary in found]
+        check(got == expected, f"{source_id} to {destination_id} after {after} found {got} instead of {expected}")
+
+        for itinerary in found:
+            legs = itinerary.legs
+            check(legs[0].source_id == source_id and legs[-1].destination_id == destination_id,
+                  f"{source_id} to {destination_id}: itinerary goes from {legs[0].source_id} to "
+                  f"{legs[-1].destination_id}")
+            check(legs[0].departure >= after, f"{source_id} to {destination_id}: leaves before {after}")
+            for leg in legs:
+                check(by_id[leg.flight_id][1:] == (leg.source_id, leg.destination_id, leg.departure, leg.arrival),
+                      f"flight {leg.flight_id} doesn't match the database")
+            for previous, leg in zip(legs, legs[1:]):
+                wait = connection_times.get(leg.source_id, min_connection)
+                check(previous.destination_id == leg.source_id and previous.arrival + wait <= leg.departure,
+                      f"flights {previous.flight_id} and {leg.flight_id} don't connect")
+
+    # The index is rebuilt once flights change
+    source_id, destination_id = 1, 2
+    after = START + timedelta(days=20)
+    check(itineraries.earliest_arrival(conn, source_id, destination_id, after) is None,
+          "nothing departs after the schedule")
+    flight_id = conn.execute("INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, "
+                             "aircraft_id) VALUES (?, ?, ?, ?, 1)",
+                             (source_id, destination_id, dt_to_db(after), dt_to_db(after) + HOUR_MS)).lastrowid
+    itinerary = itineraries.fewest_legs(conn, source_id, destination_id, after)
+    check(itinerary is not None and [leg.flight_id for leg in itinerary.legs] == [flight_id],
+          "a flight added after the index was built wasn't found")
+    conn.close()
+
+    # Connections opened later get their own index, even if they reuse a closed connection's ID and data version
+    for name, count in [("a.db", 5), ("b.db", 50)]:
+        create_schedule(os.path.join(directory, name), rng, 5, count, 1).close()
+    for name in ["a.db", "b.db"]:
+        check(indexes_match(os.path.join(directory, name)), f"{name} was given another database's index")
+
+    conn = create_schedule(os.path.join(directory, "large.db"), rng, 2000, 300_000, 365)
+    started = time.perf_counter()
+    network = itineraries.get_network(conn)
+    built = time.perf_counter() - started
+    times = []
+    for _ in range(100):
+        after = START_DB + rng.randint(0, 300 * 24 * HOUR_MS)
+        started = time.perf_counter()
+        itineraries.search(network, rng.randint(1, 2000), rng.randint(1, 2000), after)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    print(f"Indexed {network.starts[-1]} flights in {built:.2f}s, searched in {times[50] * 1000:.1f}ms "
+          f"(median) and {times[-1] * 1000:.1f}ms (slowest)")
+    conn.close()
+
+print(f"Checked {searched} searches")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,131 @@
+"""
+Checks that statement profiling counts every statement with its rows and menu action whichever way its rows are
+fetched, that it records nothing while off, and measures what it costs while off. Run from the repository root with:
+    python -m testing.check_profiling
+"""
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from database import db_initialisation
+from database import db_profiling
+
+if __name__ != "__main__":
+    exit(-1)
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def stats(profile: db_profiling.Profile, sql: str, action: str = db_profiling.NO_ACTION):
+    return profile.statements.get((action, sql), db_profiling.StatementStats())
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "profile.db")
+    conn = db_initialisation.initialise_db(path)
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(50)])
+
+    check(type(conn.execute("SELECT 1")) is sqlite3.Cursor, "statements should use plain cursors while off")
+    conn.execute("SELECT id FROM aircraft").fetchall()
+    check(conn.profile is None, "nothing should be profiled before profiling starts")
+
+    slow_log = io.StringIO()
+    profile = db_profiling.start_profiling(conn, 0.0, slow_log)
+    select = "SELECT id FROM aircraft WHERE id <= ?"
+
+    # Every way of fetching counts the rows fetched
+    list(conn.execute(select, (10,)))
+    conn.execute(select, (20,)).fetchall()
+    cursor = conn.execute(select, (30,))
+    while cursor.fetchone() is not None:
+        pass
+    cursor = conn.execute(select, (40,))
+    while len(cursor.fetchmany(7)) > 0:
+        pass
+    # Rows left unfetched when the cursor is dropped or reused aren't counted
+    conn.execute(select, (50,)).fetchone()
+    cursor = conn.cursor()
+    cursor.execute(select, (50,)).fetchone()
+    cursor.execute(select, (5,)).fetchall()
+    cursor.close()
+
+    found = stats(profile, select)
+    check(found.calls == 7, f"{found.calls} calls of the select recorded instead of 7")
+    check(found.rows == 10 + 20 + 30 + 40 + 1 + 1 + 5, f"{found.rows} rows of the select recorded")
+    check(0 < found.longest <= found.seconds, "durations should add up")
+
+    # Statements differing only in their literals are counted together
+    for i in range(3):
+        conn.execute(f"SELECT name FROM aircraft WHERE id = {i + 1} AND name != 'x{i}'").fetchall()
+        conn.execute(f"SELECT name FROM aircraft WHERE id IN ({', '.join('?' * (i + 2))})", range(i + 2)).fetchall()
+    check(stats(profile, "SELECT name FROM aircraft WHERE id = ? AND name != ?").calls == 3,
+          "statements with different literals should be normalised together")
+    check(stats(profile, "SELECT name FROM aircraft WHERE id IN (?, ...)").calls == 3,
+          "IN lists of different lengths should be normalised together")
+
+    # Writes and failed statements are recorded when they run
+    insert = "INSERT INTO aircraft (name) VALUES (?)"
+    conn.executemany(insert, [("A",), ("B",)])
+    conn.execute("UPDATE aircraft SET name = name WHERE id < ?", (5,))
+    try:
+        conn.execute("SELECT missing FROM aircraft")
+    except sqlite3.OperationalError:
+        pass
+    check(stats(profile, insert).calls == 1, "executemany should be recorded once")
+    check(stats(profile, "UPDATE aircraft SET name = name WHERE id < ?").calls == 1, "updates should be recorded")
+    check(stats(profile, "SELECT missing FROM aircraft").calls == 1, "failed statements should be recorded")
+
+    # Statements are attributed to the menu options they run under, without the options' current values
+    with db_profiling.action(conn, "View/Modify Flights"):
+        with db_profiling.action(conn, "Change Sources - All"):
+            conn.execute("SELECT COUNT() FROM aircraft").fetchone()
+        with db_profiling.action(conn, "Next Page (3)"):
+            conn.execute("SELECT COUNT() FROM aircraft").fetchone()
+    check(stats(profile, "SELECT COUNT() FROM aircraft", "View/Modify Flights > Change Sources").calls == 1,
+          "nested actions should be joined")
+    check(stats(profile, "SELECT COUNT() FROM aircraft", "View/Modify Flights > Next Page").calls == 1,
+          "option details should be left out of actions")
+    check(sum(profile.histograms["View/Modify Flights > Next Page"]) == 1, "each action should have a histogram")
+
+    total = sum(s.calls for s in profile.statements.values())
+    check(sum(sum(h) for h in profile.histograms.values()) == total, "histograms should count every statement")
+    check(len(profile.slow) == min(total, profile.slow.maxlen), "a 0ms threshold should log every statement")
+    check(len(slow_log.getvalue().splitlines()) == total, "slow statements should be written to the log")
+
+    exported = os.path.join(directory, "profile.json")
+    db_profiling.export_profile(profile, exported)
+    with open(exported) as file:
+        data = json.load(file)
+    check(sum(s["calls"] for s in data["statements"]) == total, "the export should have every statement")
+
+    db_profiling.stop_profiling(conn)
+    conn.execute(select, (10,)).fetchall()
+    check(stats(profile, select).calls == 7, "nothing should be recorded once profiling stops")
+
+    # Cost of going through the profiled connection while off, against a plain connection
+    plain = sqlite3.connect(path)
+    timings = {}
+    for name, connection in [("plain", plain), ("off", conn)]:
+        started = time.perf_counter()
+        for i in range(100_000):
+            connection.execute("SELECT id FROM aircraft WHERE id = ?", (i % 50 + 1,)).fetchone()
+        timings[name] = (time.perf_counter() - started) / 100_000 * 1_000_000
+    print(f"Statements took {timings['plain']:.2f}µs on a plain connection and {timings['off']:.2f}µs with "
+          f"profiling off")
+    plain.close()
+    conn.close()
+
+print(f"Checked {total} profiled statements")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,252 @@
+"""
+Runs EXPLAIN QUERY PLAN on the queries issued by the hot paths of the app and fails if any of them
+falls back to scanning a whole table. Run from the repository root with:
+    python -m testing.check_query_plans
+"""
+import contextlib
+import io
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import conflicts
+import consts
+from database import db_cascade
+from database import db_initialisation
+from database import db_flight_records
+from database import db_names
+from database import db_search
+from database import db_spatial
+from database import db_traffic
+from filters import DateRange, MultiSelection, MultiSelectionType
+from flights import FlightSearchOptions
+from pagination import KeysetPager
+from util import dt_to_db
+
+if __name__ != "__main__":
+    exit(-1)
+
+# Matches a plan step that reads every row of a table, either directly or through one of its indexes
+TABLE_SCAN = re.compile(
+    r"^SCAN (aircraft|destinations|pilots|flights|pilot_flights)\b(?: USING (COVERING )?INDEX (\w+))?"
+)
+# Conditions of each WHERE clause (up to the clause following it) and the first column of each ORDER BY
+WHERE_CLAUSE = re.compile(r"\bWHERE\b(.*?)(?=\bORDER BY\b|\bGROUP BY\b|\bLIMIT\b|$)", re.DOTALL)
+ORDER_BY = re.compile(r"\bORDER BY\s+(?:\w+\.)?(\w+)")
+COLUMN = re.compile(r"\b(?:(\w+)\.)?(\w+)\b")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+# Scans made on purpose (query pattern, reason), reported without failing
+ACCEPTED_SCANS = [
+    (re.compile(r"\bLIKE '.*' ESCAPE\b"),
+     "search words under three characters have no trigrams, so are matched against the entity table itself"),
+]
+
+# Hot queries only issued from interactive menus
+STATIC_QUERIES = [
+    ("SELECT id FROM aircraft WHERE id = ?", (1,)),
+    ("SELECT id FROM destinations WHERE id = ?", (1,)),
+    ("SELECT id FROM pilots WHERE id = ?", (1,)),
+    ("SELECT pilot_id from pilot_flights WHERE flight_id = ?", (1,)),
+    ("SELECT flight_id FROM pilot_flights WHERE pilot_id = ?", (1,)),
+    ("SELECT id, name FROM destinations WHERE code = ?", ("LON",)),
+    ("SELECT source_id, destination_id, departure_time, arrival_time, aircraft_id FROM flights WHERE id = ?", (1,)),
+    ("DELETE FROM pilot_flights WHERE pilot_id = ? AND flight_id = ?", (1, 1)),
+    ("DELETE FROM flights WHERE id = ?", (1,)),
+]
+
+
+def populate(conn: sqlite3.Connection):
+    """Fills the database with enough rows for the planner to prefer indexes"""
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(50)])
+    conn.executemany(
+        "INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+        [(f"Destination {i}", f"D{i}", rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(50)]
+    )
+    conn.executemany(
+        "INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+        [(f"Pilot", str(i), dt_to_db(now)) for i in range(100)]
+    )
+    flights = []
+    for i in range(2000):
+        departure = now + timedelta(hours=i)
+        flights.append((rng.randint(1, 50), rng.randint(1, 50), dt_to_db(departure),
+                        dt_to_db(departure + timedelta(hours=2)), rng.randint(1, 50)))
+    conn.executemany(
+        "INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id) VALUES (?, ?, ?, ?, ?)",
+        flights
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)",
+        [(rng.randint(1, 100), i + 1) for i in range(2000)] + [(rng.randint(1, 100), i + 1) for i in range(2000)]
+    )
+
+
+def search_variants() -> list[FlightSearchOptions]:
+    """Returns flight searches covering every filter"""
+    now = datetime.now()
+    variants = [
+        FlightSearchOptions(),
+        FlightSearchOptions(DateRange(None, None), DateRange(None, None)),
+        FlightSearchOptions(DateRange(now, now + timedelta(days=3)), DateRange(None, None)),
+        FlightSearchOptions(DateRange(None, None), DateRange(None, now + timedelta(days=3))),
+    ]
+    for selection_type, attribute in [
+        (MultiSelectionType.DESTINATION, "sources"), (MultiSelectionType.DESTINATION, "destinations"),
+        (MultiSelectionType.PILOT, "pilots"), (MultiSelectionType.AIRCRAFT, "aircraft")
+    ]:
+        options = FlightSearchOptions(DateRange(None, None), DateRange(None, None))
+        setattr(options, attribute, MultiSelection(selection_type, {1, 2, 3}))
+        variants.append(options)
+    for attribute in ["source_area", "destination_area"]:
+        options = FlightSearchOptions(DateRange(None, None), DateRange(None, None))
+        getattr(options, attribute).circle = db_spatial.Circle(0.0, 179.0, 3000.0)
+        variants.append(options)
+    return variants
+
+
+def capture_queries(conn: sqlite3.Connection) -> list[str]:
+    """Drives the non-interactive hot paths and returns every statement they executed"""
+    queries = []
+    conn.set_trace_callback(queries.append)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Looked up before anything else, so the names aren't already cached
+        for table in db_names.NAME_EXPRESSIONS:
+            db_names.get_names(conn, table, [1, 2, 3])
+
+        # Searched with selections passed inline and again with them loaded into temporary tables
+        threshold = consts.SELECTION_TABLE_THRESHOLD
+        for consts.SELECTION_TABLE_THRESHOLD in [threshold, 1]:
+            for options in search_variants():
+                for ascending in (True, False):
+                    options.pager.ascending = ascending
+                    options.pager.reset()
+                    options.display_flights(conn)
+                    options.pager.next_page()
+                    options.display_flights(conn)
+                    options.pager.previous_page()
+                    options.display_flights(conn)
+                    options.pager.seek(dt_to_db(datetime.now() + timedelta(days=10)))
+                    options.display_flights(conn)
+        consts.SELECTION_TABLE_THRESHOLD = threshold
+
+        for table, columns in [("aircraft", "id, name"), ("destinations", "id, code, name"),
+                               ("pilots", "id, name, surname")]:
+            # No search, an exact search and a misspelt one falling back to the closest matches
+            for text in [None, "1", "tion 1", "Pliot"]:
+                search = db_search.search_condition(conn, table, text)
+                pager = KeysetPager(("id",))
+                pager.fetch(conn, table, columns, search.conditions, search.arguments)
+                pager.next_page()
+                pager.fetch(conn, table, columns, search.conditions, search.arguments)
+                pager.previous_page()
+                pager.fetch(conn, table, columns, search.conditions, search.arguments)
+
+        db_flight_records.get_flight_records_from_ids(conn, [1, 2, 3])
+
+        db_spatial.destinations_within(conn, db_spatial.Circle(10.0, 10.0, 2000.0))
+        db_spatial.nearest_destinations(conn, 10.0, 10.0, 5)
+
+        # The sweeps read every flight but must do so in index order rather than sorting the table
+        list(conflicts.find_conflicts(conn))
+        # Checks of changed rows only sweep the aircraft and pilots with changed flights
+        conflicts.changed_resources(conn)
+        list(conflicts.find_conflicts(conn, resources={t: {1, 2, 3} for t in conflicts.ConflictType}))
+
+        # Windows read whole days from the summaries and only the partial days at either end from flights
+        now = datetime.now(timezone.utc)
+        for dimension in db_traffic.Dimension:
+            db_traffic.flights_by_entity(conn, dimension, limit=1)
+            db_traffic.flights_by_entity(conn, dimension, now, now + timedelta(days=7), 1)
+            db_traffic.flights_by_entity(conn, dimension, now, now + timedelta(hours=5), 1)
+            db_traffic.traffic_series(conn, dimension, now - timedelta(days=6), now)
+            db_traffic.traffic_series(conn, dimension, now - timedelta(days=6), now, 1, 1)
+
+        # Deleted last so the other paths see every row
+        for table in ["pilots", "aircraft", "destinations"]:
+            db_cascade.preview_delete(conn, table, 1)
+            db_cascade.delete_with_cascade(conn, table, 1)
+
+    conn.set_trace_callback(None)
+    # Statements prefixed with "--" are run by SQLite itself (such as FTS5 reading its shadow tables), and CREATE and
+    # DROP only (re)build the temporary tables selections are loaded into, so can't be planned again
+    return [sql for sql in queries if not sql.startswith("--") and not re.match(r"\s*(CREATE|DROP)\b", sql)]
+
+
+def indexed_columns(conn: sqlite3.Connection, table: str) -> dict[str, str]:
+    """Returns the index of a table (by name) and the column each one starts with, including the rowid as id"""
+    indexes = {"": "id"}
+    for _, name, *_ in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        indexes[name] = conn.execute(f"PRAGMA index_info({name})").fetchone()[2]
+    return indexes
+
+
+def filtered_columns(conn: sqlite3.Connection, sql: str, table: str) -> set[str]:
+    """Returns the columns of a table that a query's WHERE clauses compare"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    found = set()
+    for clause in WHERE_CLAUSE.findall(STRING_LITERAL.sub("?", sql)):
+        for qualifier, column in COLUMN.findall(clause):
+            if column in columns and qualifier in ("", table):
+                found.add(column)
+    return found
+
+
+def table_scans(conn: sqlite3.Connection, sql: str, arguments=()) -> list[str]:
+    """
+    Returns the plan steps of a query that scan a whole table or index. A scan is only allowed when no WHERE
+    condition compares a column of the table without an index, and either it walks a covering index in the order
+    the query asks for (reading every row on purpose) or the query stops after LIMIT rows without sorting them
+    """
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, arguments).fetchall()]
+    limited = re.search(r"\bLIMIT\b", sql) is not None and not any("TEMP B-TREE" in step for step in plan)
+    ordered_by = set(ORDER_BY.findall(sql))
+
+    scans = []
+    for step in plan:
+        match = TABLE_SCAN.match(step)
+        if match is None:
+            continue
+        table, covering, index = match.groups()
+        indexed = set(indexed_columns(conn, table).values())
+        if len(filtered_columns(conn, sql, table) - indexed) > 0:
+            scans.append(step)
+        elif not limited and not (covering and indexed_columns(conn, table)[index] in ordered_by):
+            scans.append(step)
+    return scans
+
+
+with tempfile.TemporaryDirectory() as directory:
+    conn = db_initialisation.initialise_db(os.path.join(directory, "plans.db"))
+    populate(conn)
+
+    checked = [(sql, ()) for sql in dict.fromkeys(capture_queries(conn))] + STATIC_QUERIES
+    failures = []
+    accepted = []
+    for sql, arguments in checked:
+        scans = table_scans(conn, sql, arguments)
+        reasons = [reason for pattern, reason in ACCEPTED_SCANS if pattern.search(sql)]
+        if len(scans) > 0 and len(reasons) > 0:
+            accepted.append((sql, reasons[0]))
+        elif len(scans) > 0:
+            failures.append((sql, scans))
+
+    conn.close()
+
+print(f"Checked {len(checked)} queries")
+for sql, reason in accepted:
+    print(f"ACCEPTED: {' '.join(sql.split())}")
+    print(f"\t{reason}")
+for sql, scans in failures:
+    print(f"FAIL: {' '.join(sql.split())}")
+    for scan in scans:
+        print(f"\t{scan}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,303 @@
+"""
+Checks the HTTP/JSON server by starting it on a temporary database and driving every route over a real socket:
+the JSON and status codes returned, cursor pagination, conflicts with existing data, keep-alive connections and
+deleting entities along with the flights that depend on them. Run from the repository root with:
+    python -m testing.check_server
+"""
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from database import db_initialisation
+
+if __name__ != "__main__":
+    exit(-1)
+
+HOST = "127.0.0.1"
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# Seconds to wait for the server to start or answer
+TIMEOUT = 10
+
+failures = []
+requests = 0
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def request(client: http.client.HTTPConnection, method: str, path: str, body: Optional[dict] = None,
+            status: int = 200) -> Any:
+    """Sends a request on a kept-alive connection, checks its status and returns the JSON it returned"""
+    global requests
+    requests += 1
+    client.request(method, path, None if body is None else json.dumps(body),
+                   {} if body is None else {"Content-Type": "application/json"})
+    response = client.getresponse()
+    data = response.read()
+    check(response.status == status, f"{method} {path} returned {response.status} instead of {status} ({data!r})")
+    check(response.getheader("Content-Type") == "application/json", f"{method} {path} didn't return JSON")
+    # Connections are only closed after requests that couldn't be understood
+    keep_alive = "close" if response.status in (400, 413) else "keep-alive"
+    check(response.getheader("Connection") == keep_alive,
+          f"{method} {path} returned Connection: {response.getheader('Connection')} instead of {keep_alive}")
+    try:
+        return json.loads(data)
+    except ValueError:
+        failures.append(f"{method} {path} returned invalid JSON ({data!r})")
+        return None
+
+
+def read_response(stream) -> Optional[tuple[int, dict[str, str], Any]]:
+    """Reads (status, headers, JSON) of a response from a raw socket's stream or returns None at the end"""
+    status_line = stream.readline()
+    if status_line == b"":
+        return None
+    headers = {}
+    while (line := stream.readline().decode("latin-1").strip()) != "":
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(status_line.split(b" ")[1]), headers, json.loads(stream.read(int(headers["content-length"])))
+
+
+def exchange(port: int, data: bytes, count: int) -> tuple[list[tuple[int, dict[str, str], Any]], bool]:
+    """
+    Writes raw bytes to a new connection and returns the first count responses, and whether the server closed the
+    connection after them
+    """
+    global requests
+    requests += count
+    with socket.create_connection((HOST, port), TIMEOUT) as s:
+        s.sendall(data)
+        stream = s.makefile("rb")
+        responses = [read_response(stream) for _ in range(count)]
+        s.settimeout(1)
+        try:
+            closed = stream.read(1) == b""
+        except TimeoutError:
+            closed = False
+        return [r for r in responses if r is not None], closed
+
+
+def page_through(client: http.client.HTTPConnection, path: str, limit: int) -> list[dict]:
+    """Returns the items of every page of a list, following next_cursor on the same connection"""
+    items, cursor, pages, sock = [], None, 0, None
+    separator = "&" if "?" in path else "?"
+    while pages == 0 or cursor is not None:
+        page = request(client, "GET",
+                       f"{path}{separator}limit={limit}" + ("" if cursor is None else f"&cursor={cursor}"))
+        if page is None:
+            break
+        check(len(page["items"]) <= limit, f"{path}: page of {len(page['items'])} with a limit of {limit}")
+        items += page["items"]
+        check(sock is None or client.sock is sock, f"{path}: a page was sent on a new connection")
+        sock = client.sock
+        cursor, pages = page["next_cursor"], pages + 1
+    return items
+
+
+def flight_ids(flights: list[dict]) -> list[int]:
+    return [flight["id"] for flight in flights]
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "server.db")
+    db_initialisation.initialise_db(path).close()
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-u", "server.py", "--db", path, "--port", str(port), "--workers", "2"],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    try:
+        started = server.stdout.readline().decode()
+        if not started.startswith("Serving on"):
+            server.kill()
+            print(f"The server didn't start: {started}{server.stdout.read().decode()}")
+            sys.exit(1)
+        client = http.client.HTTPConnection(HOST, port, timeout=TIMEOUT)
+
+        # Entities are created, listed a page at a time and loaded one at a time
+        aircraft = [request(client, "POST", "/aircraft", {"name": f"Aircraft {i}"}, 201) for i in range(3)]
+        destinations = [
+            request(client, "POST", "/destinations",
+                    {"name": f"Destination {i}", "code": f"d{i}", "latitude": 50.0 + i, "longitude": -1.0}, 201)
+            for i in range(4)
+        ]
+        pilots = [
+            request(client, "POST", "/pilots",
+                    {"name": f"Pilot {i}", "surname": "Smith", "date_joined": "2020-01-01T00:00:00+00:00"}, 201)
+            for i in range(5)
+        ]
+        check(destinations[0]["code"] == "D0", f"destination codes weren't upper cased ({destinations[0]['code']})")
+        check(pilots[0]["date_joined"] == "2020-01-01T00:00:00+00:00",
+              f"date_joined came back as {pilots[0]['date_joined']}")
+        for table, created in [("aircraft", aircraft), ("destinations", destinations), ("pilots", pilots)]:
+            check(page_through(client, f"/{table}", 2) == created, f"paging through {table} didn't list them all")
+            check(request(client, "GET", f"/{table}/{created[-1]['id']}") == created[-1],
+                  f"{table} {created[-1]['id']} doesn't match what was created")
+            request(client, "GET", f"/{table}/9999", status=404)
+        request(client, "POST", "/destinations", {"name": "Nowhere", "code": "TOOLONG", "latitude": 0, "longitude": 0},
+                400)
+        request(client, "POST", "/pilots", {"name": "Pilot"}, 400)
+
+        nearby = request(client, "GET", "/destinations/nearby?latitude=50&longitude=-1&k=2")
+        check([d["id"] for d in nearby["items"]] == [destinations[0]["id"], destinations[1]["id"]],
+              f"nearby destinations were {nearby['items']}")
+        request(client, "GET", "/destinations/nearby?latitude=50", status=400)
+
+        # Flights, with pilots 0 and 1 each flying some alone and some together
+        flights = []
+        for i in range(12):
+            departure = START + timedelta(hours=7 * i)
+            body = {
+                "source_id": destinations[i % 4]["id"], "destination_id": destinations[(i + 1) % 4]["id"],
+                "departure_time": departure.isoformat(), "arrival_time": (departure + timedelta(hours=3)).isoformat(),
+                "aircraft_id": aircraft[i % 2]["id"], "pilots": [pilots[p]["id"] for p in [[0], [1], [0, 1]][i % 3]],
+            }
+            flight = request(client, "POST", "/flights", body, 201)
+            check(flight["source_id"] == body["source_id"] and flight["aircraft_name"] == f"Aircraft {i % 2}"
+                  and datetime.fromisoformat(flight["departure_time"]) == departure
+                  and sorted(p["id"] for p in flight["pilots"]) == sorted(body["pilots"]),
+                  f"flight {i} came back as {flight}")
+            flights.append(flight)
+        by_departure = flight_ids(sorted(flights, key=lambda f: (f["departure_time"], f["id"])))
+
+        check(flight_ids(page_through(client, "/flights", 5)) == by_departure, "paging through flights didn't match")
+        check(flight_ids(page_through(client, "/flights?order=desc", 5)) == by_departure[::-1],
+              "paging through flights latest first didn't match")
+        source_id = destinations[2]["id"]
+        check(flight_ids(page_through(client, f"/flights?sources={source_id}", 1))
+              == [f["id"] for f in flights if f["source_id"] == source_id], "searching by source didn't match")
+        after = (START + timedelta(days=2)).isoformat().replace("+", "%2B")
+        check(flight_ids(page_through(client, f"/flights?departure_after={after}", 4))
+              == [f["id"] for f in flights if datetime.fromisoformat(f["departure_time"]) >= START + timedelta(days=2)],
+              "searching by departure time didn't match")
+        for query in ["limit=0", "cursor=abc", "cursor=1", "order=sideways", "sources=x",
+                      "departure_after=yesterday", "source_within=1,2"]:
+            request(client, "GET", f"/flights?{query}", status=400)
+
+        check(request(client, "GET", f"/flights/{flights[0]['id']}") == flights[0], "flight 0 changed")
+        request(client, "GET", "/flights/9999", status=404)
+        changed = {
+            "source_id": destinations[3]["id"], "destination_id": destinations[0]["id"],
+            "departure_time": flights[0]["departure_time"], "arrival_time": flights[0]["arrival_time"],
+            "aircraft_id": aircraft[2]["id"], "pilots": [pilots[2]["id"], pilots[3]["id"]],
+        }
+        updated = request(client, "PUT", f"/flights/{flights[0]['id']}", changed)
+        check(updated["source_id"] == changed["source_id"] and updated["aircraft_id"] == changed["aircraft_id"]
+              and sorted(p["id"] for p in updated["pilots"]) == changed["pilots"],
+              f"the updated flight came back as {updated}")
+        flights[0] = updated
+        request(client, "PUT", "/flights/9999", changed, 404)
+        request(client, "PUT", f"/flights/{flights[0]['id']}", {**changed, "pilots": []}, 400)
+        request(client, "POST", "/flights", {**changed, "arrival_time": (START - timedelta(hours=1)).isoformat()}, 400)
+
+        # Breaking a foreign key is a conflict that leaves nothing behind
+        request(client, "POST", "/flights", {**changed, "aircraft_id": 9999}, 409)
+        request(client, "PUT", f"/flights/{flights[0]['id']}", {**changed, "pilots": [9999]}, 409)
+        check(request(client, "GET", f"/flights/{flights[0]['id']}") == flights[0],
+              "a conflicting update changed the flight")
+        check(len(page_through(client, "/flights", 100)) == len(flights), "a conflicting flight was saved")
+
+        deleted = flights.pop()
+        check(request(client, "DELETE", f"/flights/{deleted['id']}") == {"deleted": deleted["id"]},
+              "deleting a flight returned the wrong JSON")
+        request(client, "GET", f"/flights/{deleted['id']}", status=404)
+        request(client, "DELETE", f"/flights/{deleted['id']}", status=404)
+
+        # Deleting a pilot deletes the flights no one else flies, and takes them off the rest
+        pilot_id = pilots[0]["id"]
+        alone = [f["id"] for f in flights if [p["id"] for p in f["pilots"]] == [pilot_id]]
+        shared = [f["id"] for f in flights if pilot_id in [p["id"] for p in f["pilots"]] and f["id"] not in alone]
+        check(request(client, "DELETE", f"/pilots/{pilot_id}") == {"deleted": pilot_id, "deleted_flights": len(alone)},
+              "deleting a pilot returned the wrong JSON")
+        request(client, "GET", f"/pilots/{pilot_id}", status=404)
+        remaining = {f["id"]: f for f in page_through(client, "/flights", 100)}
+        check(all(flight_id not in remaining for flight_id in alone), "a deleted pilot's own flights are left")
+        check(all(flight_id in remaining and pilot_id not in [p["id"] for p in remaining[flight_id]["pilots"]]
+                  for flight_id in shared), "a deleted pilot's shared flights weren't kept without them")
+        flights = [f for f in flights if f["id"] in remaining]
+
+        # Deleting an aircraft or destination deletes every flight using it
+        for table, uses in [("aircraft", lambda f, i: f["aircraft_id"] == i),
+                            ("destinations", lambda f, i: i in (f["source_id"], f["destination_id"]))]:
+            entity_id = (aircraft if table == "aircraft" else destinations)[1]["id"]
+            using = [f["id"] for f in flights if uses(f, entity_id)]
+            check(request(client, "DELETE", f"/{table}/{entity_id}")
+                  == {"deleted": entity_id, "deleted_flights": len(using)},
+                  f"deleting {table} {entity_id} returned the wrong JSON")
+            flights = [f for f in flights if f["id"] not in using]
+            check(flight_ids(page_through(client, "/flights", 100)) == flight_ids(
+                sorted(flights, key=lambda f: (f["departure_time"], f["id"]))),
+                f"deleting {table} {entity_id} didn't delete exactly its flights")
+            request(client, "DELETE", f"/{table}/{entity_id}", status=404)
+
+        # Summaries agree with the flights left
+        stats = request(client, "GET", "/statistics")
+        check(stats["total_flights"] == len(flights) and stats["total_pilots"] == len(pilots) - 1,
+              f"statistics counted {stats['total_flights']} flights and {stats['total_pilots']} pilots")
+        span = f"start={START.isoformat()}&end={(START + timedelta(days=4)).isoformat()}".replace("+", "%2B")
+        for path in [f"/traffic?{span}", f"/traffic?{span}&dimension=aircraft&bucket_days=2&id={aircraft[0]['id']}"]:
+            counted = sum(item["flights"] for item in request(client, "GET", path)["items"])
+            expected = len([f for f in flights if "id=" not in path or f["aircraft_id"] == aircraft[0]["id"]])
+            check(counted == expected, f"{path} counted {counted} flights instead of {expected}")
+        request(client, "POST", "/traffic/rebuild")
+        check(sum(item["flights"] for item in request(client, "GET", f"/traffic?{span}")["items"]) == len(flights),
+              "the rebuilt traffic summaries don't count every flight")
+        for query in ["", f"{span}&dimension=planets", f"{span}&bucket_days=0"]:
+            request(client, "GET", f"/traffic?{query}", status=400)
+        for method, query in [("GET", "?full=1"), ("POST", "?full=1"), ("POST", ""), ("GET", "")]:
+            report = request(client, method, f"/integrity{query}")
+            check(report["ok"] and report["full"] == (query != ""),
+                  f"{method} /integrity{query} returned {report}")
+
+        request(client, "DELETE", "/statistics", status=405)
+        request(client, "GET", "/nowhere", status=404)
+        request(client, "POST", "/aircraft", None, 400)
+        client.close()
+
+        # Keep-alive: pipelined requests are each answered on the same connection, which is only closed when asked
+        get = "GET /statistics HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        responses, closed = exchange(port, (get * 3).encode(), 3)
+        check(len(responses) == 3 and all(r[0] == 200 and r[1]["connection"] == "keep-alive" for r in responses)
+              and not closed, "pipelined requests weren't all answered on a kept-alive connection")
+        responses, closed = exchange(port, b"GET /aircraft HTTP/1.1\r\nConnection: close\r\n\r\n", 1)
+        check(len(responses) == 1 and responses[0][1]["connection"] == "close" and closed,
+              "Connection: close didn't close the connection")
+        responses, closed = exchange(port, b"GET /aircraft HTTP/1.0\r\n\r\n", 1)
+        check(len(responses) == 1 and responses[0][0] == 200 and closed, "an HTTP/1.0 connection was kept alive")
+        responses, closed = exchange(port, b"GET /aircraft HTTP/1.0\r\nConnection: keep-alive\r\n\r\n", 1)
+        check(len(responses) == 1 and not closed, "an HTTP/1.0 keep-alive connection was closed")
+        responses, closed = exchange(port, b"NONSENSE\r\n\r\n" + get.encode(), 1)
+        check(len(responses) == 1 and responses[0][0] == 400 and closed,
+              "a malformed request didn't get a 400 and a closed connection")
+        responses, closed = exchange(port, b"POST /aircraft HTTP/1.1\r\nContent-Length: 99999999\r\n\r\n", 1)
+        check(len(responses) == 1 and responses[0][0] == 413 and closed, "a body too large didn't get a 413")
+
+        # Other connections still work after the server has seen all of that
+        client = http.client.HTTPConnection(HOST, port, timeout=TIMEOUT)
+        check(len(request(client, "GET", "/aircraft")["items"]) == 2, "aircraft left after the check don't match")
+        client.close()
+    finally:
+        server.terminate()
+        server.wait(TIMEOUT)
+        server.stdout.close()
+
+print(f"Checked {requests} requests")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
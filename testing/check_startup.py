@@ -0,0 +1,127 @@
+"""
+Checks that schema migrations are applied once each and atomically, that opening a database with a current schema
+runs no DDL, that the main menu's feature modules aren't imported at startup, and that starting the app stays
+within its time budget. Run from the repository root with:
+    python -m testing.check_startup
+"""
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from database import db_initialisation
+
+if __name__ != "__main__":
+    exit(-1)
+
+# Most time starting the app and quitting from the main menu may take on top of starting the interpreter
+STARTUP_BUDGET_MS = 200
+STARTUP_RUNS = 5
+# Modules only needed once an option is chosen from the main menu
+LAZY_MODULES = ["assignment", "check_for_errors", "conflicts", "export", "flights", "itineraries", "non_flights",
+                "statistics"]
+# Statements that change a database
+WRITE = re.compile(r"^\s*(CREATE|DROP|ALTER|INSERT|UPDATE|DELETE|BEGIN|PRAGMA user_version\s*=)", re.IGNORECASE)
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def schema(conn: sqlite3.Connection) -> list[tuple]:
+    return conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY name").fetchall()
+
+
+def elapsed_ms(args: list[str], stdin: str = "") -> float:
+    """Returns the fastest of several runs of a command from the repository root"""
+    times = []
+    for _ in range(STARTUP_RUNS):
+        started = time.perf_counter()
+        subprocess.run(args, input=stdin, capture_output=True, text=True, check=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return min(times)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "startup.db")
+    conn = db_initialisation.initialise_db(path)
+    check(db_initialisation.get_schema_version(conn) == db_initialisation.SCHEMA_VERSION,
+          "a new database should have every migration")
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(100)])
+    conn.execute("INSERT INTO aircraft (name) VALUES ('Aircraft')")
+    conn.executemany("INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+                     "VALUES (?, ?, ?, ?, 1)", [(i % 100 + 1, (i * 7) % 100 + 1, i * 60_000, i * 60_000 + 3_600_000)
+                                                for i in range(20_000)])
+    conn.commit()
+    current = schema(conn)
+    conn.close()
+
+    # A current schema is only checked, never changed
+    conn = db_initialisation.connect(path)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    check(db_initialisation.migrate(conn) == 0, "a current database shouldn't be migrated")
+    writes = [sql for sql in statements if WRITE.match(sql)]
+    check(len(writes) == 0, f"opening a current database ran {writes}")
+
+    # Databases from before the schema was versioned are adopted without changing anything
+    conn.execute("PRAGMA user_version = 0")
+    check(db_initialisation.migrate(conn) == db_initialisation.SCHEMA_VERSION,
+          "an unversioned database should have every migration applied")
+    check(schema(conn) == current, "migrating an unversioned database changed its schema")
+    check(conn.execute("SELECT SUM(flights) FROM traffic_sources").fetchone()[0] == 20_000,
+          "migrating an unversioned database changed its traffic summaries")
+
+    # A failing migration leaves nothing behind, including its version
+    def failing_migration(c: sqlite3.Connection):
+        c.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("migration failed")
+
+    db_initialisation.MIGRATIONS.append(("Fail", failing_migration))
+    db_initialisation.SCHEMA_VERSION += 1
+    try:
+        db_initialisation.migrate(conn)
+        check(False, "a failing migration should raise")
+    except RuntimeError:
+        pass
+    db_initialisation.MIGRATIONS.pop()
+    db_initialisation.SCHEMA_VERSION -= 1
+    check(db_initialisation.get_schema_version(conn) == db_initialisation.SCHEMA_VERSION,
+          "a failing migration changed the schema version")
+    check(schema(conn) == current, "a failing migration left part of its changes")
+
+    # Databases from a newer version of the app aren't touched
+    conn.execute(f"PRAGMA user_version = {db_initialisation.SCHEMA_VERSION + 1}")
+    try:
+        db_initialisation.migrate(conn)
+        check(False, "a database with a newer schema should be refused")
+    except RuntimeError:
+        pass
+    conn.execute(f"PRAGMA user_version = {db_initialisation.SCHEMA_VERSION}")
+    conn.close()
+
+    loaded = subprocess.run(
+        [sys.executable, "-c", f"import sys, main; print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"],
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+    check(len(loaded) == 0, f"{', '.join(loaded)} imported at startup")
+
+    # Started and closed from the main menu with Save and Quit
+    interpreter = elapsed_ms([sys.executable, "-c", "pass"])
+    app = elapsed_ms([sys.executable, "main.py", "--db", path], "11\n")
+    print(f"Started and quit in {app:.1f}ms ({interpreter:.1f}ms of it starting the interpreter)")
+    check(app - interpreter <= STARTUP_BUDGET_MS,
+          f"startup took {app - interpreter:.1f}ms, over its {STARTUP_BUDGET_MS}ms budget")
+
+print(f"Checked {db_initialisation.SCHEMA_VERSION} migrations")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,158 @@
+"""
+Checks that the traffic summaries kept by triggers match the flights after random changes, and that windowed
+queries over them count the same flights as the flights table. Run from the repository root with:
+    python -m testing.check_traffic
+"""
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from database import db_cascade
+from database import db_initialisation
+from database import db_traffic
+from database.db_traffic import Dimension
+from util import dt_to_db
+
+if __name__ != "__main__":
+    exit(-1)
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+START_DB = dt_to_db(START)
+SPAN_MS = 20 * db_traffic.DAY_MS
+
+failures = []
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        failures.append(message)
+
+
+def summaries(conn) -> dict[Dimension, tuple[list, list]]:
+    return {d: (conn.execute(f"SELECT * FROM {d.get_table()} ORDER BY entity_id, day").fetchall(),
+                conn.execute(f"SELECT * FROM {d.get_totals_table()} ORDER BY entity_id").fetchall())
+            for d in Dimension}
+
+
+with tempfile.TemporaryDirectory() as directory:
+    conn = db_initialisation.initialise_db(os.path.join(directory, "traffic.db"))
+    rng = random.Random(0)
+    conn.executemany("INSERT INTO aircraft (name) VALUES (?)", [(f"Aircraft {i}",) for i in range(8)])
+    conn.executemany("INSERT INTO destinations (name, code, latitude, longitude) VALUES (?, ?, ?, ?)",
+                     [(f"Destination {i}", f"D{i}", 0.0, 0.0) for i in range(12)])
+    conn.executemany("INSERT INTO pilots (name, surname, date_joined) VALUES (?, ?, ?)",
+                     [("Pilot", str(i), START_DB) for i in range(15)])
+
+    def ids(table: str) -> list[int]:
+        return [row[0] for row in conn.execute(f"SELECT id FROM {table}")]
+
+    def insert_flight():
+        departure = START_DB + rng.randint(0, SPAN_MS)
+        flight_id = conn.execute(
+            "INSERT INTO flights (source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (rng.choice(ids("destinations")), rng.choice(ids("destinations")), departure,
+             departure + rng.randint(1, 10 * 3_600_000), rng.choice(ids("aircraft")))
+        ).lastrowid
+        conn.executemany("INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)",
+                         [(p, flight_id) for p in rng.sample(ids("pilots"), rng.randint(1, 3))])
+
+    def update_flight():
+        flight_id = rng.choice(ids("flights"))
+        column, value = rng.choice([
+            ("departure_time", START_DB + rng.randint(0, SPAN_MS)), ("source_id", rng.choice(ids("destinations"))),
+            ("destination_id", rng.choice(ids("destinations"))), ("aircraft_id", rng.choice(ids("aircraft"))),
+        ])
+        conn.execute(f"UPDATE flights SET {column} = ? WHERE id = ?", (value, flight_id))
+
+    def reassign_pilot():
+        flight_id = rng.choice(ids("flights"))
+        conn.execute("UPDATE OR IGNORE pilot_flights SET pilot_id = ? WHERE flight_id = ? AND pilot_id = "
+                     "(SELECT MIN(pilot_id) FROM pilot_flights WHERE flight_id = ?)",
+                     (rng.choice(ids("pilots")), flight_id, flight_id))
+
+    def remove_pilot_assignment():
+        conn.execute("DELETE FROM pilot_flights WHERE rowid = (SELECT rowid FROM pilot_flights ORDER BY RANDOM())")
+
+    def delete_flight():
+        conn.execute("DELETE FROM flights WHERE id = ?", (rng.choice(ids("flights")),))
+
+    def delete_entity():
+        table = rng.choice(["pilots", "aircraft", "destinations"])
+        db_cascade.delete_with_cascade(conn, table, rng.choice(ids(table)))
+        # Keep enough entities around to go on inserting flights
+        if table == "pilots":
+            conn.execute("INSERT INTO pilots (name, surname, date_joined) VALUES ('Pilot', 'New', ?)", (START_DB,))
+        elif table == "aircraft":
+            conn.execute("INSERT INTO aircraft (name) VALUES ('Aircraft New')")
+        else:
+            conn.execute("INSERT INTO destinations (name, code, latitude, longitude) VALUES ('New', 'NEW', 0, 0)")
+
+    for _ in range(400):
+        insert_flight()
+
+    for step in range(2000):
+        action = rng.choices([insert_flight, update_flight, reassign_pilot, remove_pilot_assignment, delete_flight,
+                              delete_entity], [30, 30, 10, 10, 15, 5])[0]
+        action()
+        if step % 250 == 0:
+            kept = summaries(conn)
+            db_traffic.rebuild_traffic_summaries(conn)
+            for dimension, rows in summaries(conn).items():
+                check(kept[dimension] == rows, f"{dimension.name} summary differs from a rebuild after step {step}")
+            if len(failures) > 0:
+                break
+
+    # Windows ending anywhere in a day count the same as the flights
+    def random_time():
+        if rng.random() < 0.15:
+            return None
+        if rng.random() < 0.2:  # On a day boundary
+            return datetime.fromtimestamp((START_DB + rng.randint(-1, 21) * db_traffic.DAY_MS) / 1000, timezone.utc)
+        return datetime.fromtimestamp((START_DB + rng.randint(-SPAN_MS // 10, SPAN_MS)) / 1000, timezone.utc)
+
+    for _ in range(300):
+        dimension = rng.choice(list(Dimension))
+        after, before = random_time(), random_time()
+        if after is not None and before is not None and after > before:
+            after, before = before, after
+        conditions, arguments = [], []
+        if after is not None:
+            conditions.append("departure_time > ?")
+            arguments.append(dt_to_db(after))
+        if before is not None:
+            conditions.append("departure_time < ?")
+            arguments.append(dt_to_db(before))
+        where = "" if len(conditions) == 0 else " WHERE " + " AND ".join(conditions)
+        expected = Counter(dict(conn.execute(
+            f"SELECT entity_id, COUNT() FROM ({dimension.get_flights_sql()}){where} GROUP BY entity_id", arguments
+        ).fetchall()))
+        found = dict(db_traffic.flights_by_entity(conn, dimension, after, before))
+        check(found == dict(expected), f"{dimension.name} from {after} to {before} counted the wrong flights")
+
+    # Series buckets add up to the flights departing in their days
+    start, end = START + timedelta(days=2, hours=5), START + timedelta(days=17, hours=1)
+    for bucket_days in [1, 3, 7]:
+        series = db_traffic.traffic_series(conn, Dimension.SOURCES, start, end, bucket_days)
+        check(series[0][0] == START + timedelta(days=2), "series should start at the start of a day")
+        for day, count in series:
+            last = min(day + timedelta(days=bucket_days), START + timedelta(days=18))
+            expected = conn.execute("SELECT COUNT() FROM flights WHERE departure_time >= ? AND departure_time < ?",
+                                    (dt_to_db(day), dt_to_db(last))).fetchone()[0]
+            check(count == expected, f"{bucket_days} day bucket at {day} has {count} flights instead of {expected}")
+
+    pilot = ids("pilots")[0]
+    series = db_traffic.traffic_series(conn, Dimension.PILOTS, START, START + timedelta(days=20), 1, pilot)
+    expected = conn.execute("SELECT COUNT() FROM pilot_flights WHERE pilot_id = ?", (pilot,)).fetchone()[0]
+    check(sum(count for _, count in series) == expected, "a pilot's series should count every flight of theirs")
+
+    conn.close()
+
+print(f"Checked {len(list(Dimension))} summaries")
+for failure in failures:
+    print(f"FAIL: {failure}")
+
+sys.exit(1 if len(failures) > 0 else 0)
@@ -0,0 +1,247 @@
+"""
+Generates a reproducible synthetic dataset for scale testing. Run from the repository root with e.g.:
+    python -m testing.generate_dataset --db scale.db --flights 1000000 --seed 1
+Everything is generated with NumPy in batches and streamed into the existing schema, so the same seed and
+options always produce the same dataset
+"""
+import argparse
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import numpy as np
+
+import ingest
+from database import db_initialisation
+from util import dt_to_db
+
+FIRST_NAMES = np.array([
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William",
+    "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen", "Daniel", "Lisa",
+    "Matthew", "Nancy", "Anthony", "Sandra", "Mark", "Ashley", "Steven", "Emily", "Andrew", "Michelle",
+])
+SURNAMES = np.array([
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee", "Thompson",
+    "White", "Harris", "Clark", "Lewis", "Robinson", "Walker", "Young", "Allen", "King", "Wright", "Scott",
+])
+PLACE_PREFIXES = np.array(["North ", "South ", "East ", "West ", "Port ", "New ", "Lake ", "", "", "", "", ""])
+PLACE_STEMS = np.array([
+    "Ash", "Bright", "Clear", "Dun", "Elm", "Fair", "Glen", "Hart", "Iron", "King", "Lin", "Mill", "Oak", "Pine",
+    "Red", "Stone", "Thorn", "Wood", "Ald", "Bran", "Cald", "Dray", "Fen", "Gray",
+])
+PLACE_SUFFIXES = np.array(["ton", "field", "borough", "ville", "mouth", "ford", "port", "wick", "ham", "by", "dale"])
+AIRCRAFT_MODELS = np.array(["A320", "A321", "A330", "A350", "B737", "B747", "B777", "B787", "E190", "CRJ9", "ATR72"])
+
+MS_PER_HOUR = 3_600_000
+
+
+@dataclass
+class GeneratorOptions:
+    """Class representing the size and shape of a generated dataset"""
+    flights: int = 10_000
+    pilots: int = 0  # 0 scales with the number of flights
+    destinations: int = 0
+    aircraft: int = 0
+    seed: int = 0
+    days: int = 365
+    start: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    # Zipf exponent of route popularity - higher values concentrate traffic on a few hubs
+    hub_skew: float = 1.1
+    # Cruise speed (km/h) and fixed overhead (h) used to derive durations from route length
+    cruise_speed: float = 800.0
+    overhead_hours: float = 0.5
+    # Standard deviation of the log-normal noise applied to durations
+    duration_noise: float = 0.1
+    co_pilot_ratio: float = 0.6
+    batch_size: int = 500_000
+
+    def scaled(self) -> "GeneratorOptions":
+        """Returns the options with entity counts scaled to the number of flights where they weren't given"""
+        return GeneratorOptions(
+            **{
+                **self.__dict__,
+                "pilots": self.pilots or max(10, self.flights // 50),
+                "destinations": self.destinations or max(5, min(5_000, self.flights // 200)),
+                "aircraft": self.aircraft or max(5, self.flights // 500),
+            }
+        )
+
+
+def _next_id(conn: sqlite3.Connection, table: str) -> int:
+    return conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+
+def _batches(count: int, size: int):
+    """Yields (start, stop) index ranges covering count items"""
+    for start in range(0, count, size):
+        yield start, min(start + size, count)
+
+
+def haversine_km(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    """Returns the great-circle distance in km between arrays of points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def generate_pilots(conn: sqlite3.Connection, rng: np.random.Generator, options: GeneratorOptions) -> np.ndarray:
+    """Inserts pilots and returns their IDs"""
+    first_id = _next_id(conn, "pilots")
+    ids = np.arange(first_id, first_id + options.pilots)
+    names = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), options.pilots)]
+    surnames = SURNAMES[rng.integers(0, len(SURNAMES), options.pilots)]
+    joined = dt_to_db(options.start) - rng.integers(0, 5 * 365 * 24, options.pilots) * MS_PER_HOUR
+    conn.executemany(
+        "INSERT INTO pilots (id, name, surname, date_joined) VALUES (?, ?, ?, ?)",
+        zip(ids.tolist(), names.tolist(), surnames.tolist(), joined.tolist())
+    )
+    return ids
+
+
+def generate_destinations(conn: sqlite3.Connection, rng: np.random.Generator,
+                          options: GeneratorOptions) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Inserts destinations and returns (IDs, latitudes, longitudes)"""
+    n = options.destinations
+    first_id = _next_id(conn, "destinations")
+    ids = np.arange(first_id, first_id + n)
+
+    names = np.char.add(
+        np.char.add(PLACE_PREFIXES[rng.integers(0, len(PLACE_PREFIXES), n)],
+                    PLACE_STEMS[rng.integers(0, len(PLACE_STEMS), n)]),
+        PLACE_SUFFIXES[rng.integers(0, len(PLACE_SUFFIXES), n)]
+    )
+    # Unique codes: the destination's index in base 26
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    index = np.arange(n)
+    codes = np.char.add(np.char.add(letters[index // 676 % 26], letters[index // 26 % 26]), letters[index % 26])
+
+    # Uniformly distributed over the sphere
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    longitudes = rng.uniform(-180, 180, n)
+
+    conn.executemany(
+        "INSERT INTO destinations (id, name, code, latitude, longitude) VALUES (?, ?, ?, ?, ?)",
+        zip(ids.tolist(), names.tolist(), codes.tolist(), latitudes.tolist(), longitudes.tolist())
+    )
+    return ids, latitudes, longitudes
+
+
+def generate_aircraft(conn: sqlite3.Connection, rng: np.random.Generator, options: GeneratorOptions) -> np.ndarray:
+    """Inserts aircraft and returns their IDs"""
+    first_id = _next_id(conn, "aircraft")
+    ids = np.arange(first_id, first_id + options.aircraft)
+    names = np.char.add(
+        np.char.add(AIRCRAFT_MODELS[rng.integers(0, len(AIRCRAFT_MODELS), options.aircraft)], "-"),
+        ids.astype(str)
+    )
+    conn.executemany("INSERT INTO aircraft (id, name) VALUES (?, ?)", zip(ids.tolist(), names.tolist()))
+    return ids
+
+
+def generate_flights(conn: sqlite3.Connection, rng: np.random.Generator, options: GeneratorOptions,
+                     pilot_ids: np.ndarray, destinations: tuple[np.ndarray, np.ndarray, np.ndarray],
+                     aircraft_ids: np.ndarray):
+    """Inserts flights and their crew in batches"""
+    destination_ids, latitudes, longitudes = destinations
+    n_destinations = len(destination_ids)
+
+    # Zipf-like popularity so that a few hubs see most of the traffic
+    popularity = 1.0 / np.arange(1, n_destinations + 1) ** options.hub_skew
+    popularity /= popularity.sum()
+
+    start = dt_to_db(options.start)
+    period = options.days * 24 * MS_PER_HOUR
+    next_flight_id = _next_id(conn, "flights")
+
+    for batch_start, batch_stop in _batches(options.flights, options.batch_size):
+        n = batch_stop - batch_start
+
+        sources = rng.choice(n_destinations, n, p=popularity)
+        targets = rng.choice(n_destinations, n, p=popularity)
+        # Never fly to the same place
+        same = sources == targets
+        targets[same] = (targets[same] + rng.integers(1, n_destinations, same.sum())) % n_destinations
+
+        distance = haversine_km(latitudes[sources], longitudes[sources], latitudes[targets], longitudes[targets])
+        hours = (distance / options.cruise_speed + options.overhead_hours) \
+            * rng.lognormal(0.0, options.duration_noise, n)
+
+        # Departures spread over the period, in order across batches
+        offsets = np.sort(rng.integers(0, max(1, period * n // options.flights), n))
+        departures = start + period * batch_start // options.flights + offsets
+        arrivals = departures + (hours * MS_PER_HOUR).astype(np.int64)
+
+        flight_ids = np.arange(next_flight_id, next_flight_id + n)
+        next_flight_id += n
+        aircraft = aircraft_ids[rng.integers(0, len(aircraft_ids), n)]
+
+        conn.executemany(
+            "INSERT INTO flights (id, source_id, destination_id, departure_time, arrival_time, aircraft_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            zip(flight_ids.tolist(), destination_ids[sources].tolist(), destination_ids[targets].tolist(),
+                departures.tolist(), arrivals.tolist(), aircraft.tolist())
+        )
+
+        # Every flight has a captain and some have a different co-pilot
+        n_pilots = len(pilot_ids)
+        captains = rng.integers(0, n_pilots, n)
+        has_co_pilot = rng.random(n) < options.co_pilot_ratio
+        if n_pilots < 2:
+            has_co_pilot[:] = False
+        co_pilots = (captains[has_co_pilot] + rng.integers(1, max(n_pilots, 2), has_co_pilot.sum())) % n_pilots
+
+        crew_pilots = np.concatenate([pilot_ids[captains], pilot_ids[co_pilots]])
+        crew_flights = np.concatenate([flight_ids, flight_ids[has_co_pilot]])
+        conn.executemany(
+            "INSERT INTO pilot_flights (pilot_id, flight_id) VALUES (?, ?)",
+            zip(crew_pilots.tolist(), crew_flights.tolist())
+        )
+        conn.commit()
+        print(f"\t{batch_stop}/{options.flights} flights")
+
+
+def generate(conn: sqlite3.Connection, options: GeneratorOptions):
+    """Generates a dataset into the database"""
+    options = options.scaled()
+    rng = np.random.default_rng(options.seed)
+
+    with ingest.load_pragmas(conn):
+        pilot_ids = generate_pilots(conn, rng, options)
+        destinations = generate_destinations(conn, rng, options)
+        aircraft_ids = generate_aircraft(conn, rng, options)
+        conn.commit()
+        generate_flights(conn, rng, options, pilot_ids, destinations, aircraft_ids)
+
+
+if __name__ == "__main__":
+    defaults = GeneratorOptions()
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset")
+    parser.add_argument("--db", default="scale.db", help="database to generate into")
+    parser.add_argument("--flights", type=int, default=defaults.flights)
+    parser.add_argument("--pilots", type=int, default=0, help="defaults to a number scaled to the flights")
+    parser.add_argument("--destinations", type=int, default=0, help="defaults to a number scaled to the flights")
+    parser.add_argument("--aircraft", type=int, default=0, help="defaults to a number scaled to the flights")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--days", type=int, default=defaults.days, help="length of the schedule")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=defaults.start,
+                        help="start of the schedule (ISO 8601)")
+    parser.add_argument("--hub-skew", type=float, default=defaults.hub_skew,
+                        help="Zipf exponent of destination popularity")
+    parser.add_argument("--cruise-speed", type=float, default=defaults.cruise_speed, help="km/h")
+    parser.add_argument("--overhead-hours", type=float, default=defaults.overhead_hours)
+    parser.add_argument("--duration-noise", type=float, default=defaults.duration_noise)
+    parser.add_argument("--co-pilot-ratio", type=float, default=defaults.co_pilot_ratio)
+    parser.add_argument("--batch-size", type=int, default=defaults.batch_size)
+    args = parser.parse_args()
+    # Flights never land where they left, which takes at least two destinations
+    if args.destinations < 0 or args.destinations == 1:
+        parser.error("--destinations must be at least 2 (or 0 to scale with the flights)")
+
+    db = args.db
+    del args.db
+    conn = db_initialisation.initialise_db(db)
+    started = datetime.now()
+    generate(conn, GeneratorOptions(**vars(args)))
+    conn.close()
+    print(f"Done in {(datetime.now() - started).total_seconds():.2f}s")
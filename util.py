@@ -1,35 +1,59 @@
+import os
+import select
 import sqlite3
+import sys
+import threading
+import weakref
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Callable, Generic, Hashable, Optional, TypeVar
 
-from database import db_aircraft
-from database import db_destinations
-from database import db_pilots
+import tables
+from database import db_flight_records
 
 
 def print_table(table: list[list[str]]):
     """
     Prints a 2D array of strings as a table
     """
-    widths = [0 for _ in range(len(table[0]))]
+    tables.print_table(table)
 
-    for row in table:
-        for i, s in enumerate(row):
-            widths[i] = max(widths[i], len(s))
 
-    for row in table:
-        for i, s in enumerate(row):
-            print(s + " " * (widths[i] - len(s)), end="    ")
-        print()
+# Seconds between checks for commits from other sessions while waiting for input
+REFRESH_INTERVAL = 1.0
 
 
-def choices(heading: str, options: list[str]) -> int:
+def input_or_refresh(refresh: Optional[sqlite3.Connection] = None) -> Optional[str]:
     """
-    Lets user select an option. Returns a 1-indexed choice from the user
+    Reads a line of input. If a connection is given, returns None instead as soon as another session commits to
+    its database so the caller can redraw (only when reading from a terminal on a POSIX system)
+    """
+    if refresh is None or os.name == "nt" or not sys.stdin.isatty():
+        return input("> ")
+
+    print("> ", end="", flush=True)
+    version = refresh.execute("PRAGMA data_version").fetchone()[0]
+    while True:
+        readable, _, _ = select.select([sys.stdin], [], [], REFRESH_INTERVAL)
+        if len(readable) > 0:
+            line = sys.stdin.readline()
+            if line == "":
+                raise EOFError
+            return line.rstrip("\n")
+        if refresh.execute("PRAGMA data_version").fetchone()[0] != version:
+            print()
+            print("[Data changed by another session - refreshing]")
+            print()
+            return None
+
+
+def choices(heading: str, options: list[str], refresh: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Lets user select an option. Returns a 1-indexed choice from the user, or 0 if refresh is given and another
+    session changed the data while waiting
     """
     print(heading)
     print("\n".join([str(i + 1) + ". " + t for i, t in enumerate(options)]))
-    return choose_number_from_range(1, len(options))
+    return choose_number_from_range(1, len(options), refresh)
 
 
 def choose_number() -> int:
@@ -62,13 +86,17 @@ def choose_float_range(minimum: float, maximum: float) -> float:
         return choice
 
 
-def choose_number_from_range(minimum: int, maximum: int) -> int:
+def choose_number_from_range(minimum: int, maximum: int, refresh: Optional[sqlite3.Connection] = None) -> int:
     """
-    Lets the user select a number from the given range (inclusive)
+    Lets the user select a number from the given range (inclusive). Returns 0 if refresh is given and another
+    session changed the data while waiting
     """
     while True:
         try:
-            choice = int(input("> "))
+            line = input_or_refresh(refresh)
+            if line is None:
+                return 0
+            choice = int(line)
             print()
             if choice < minimum or choice > maximum:
                 raise ValueError
@@ -165,34 +193,30 @@ def dt_format_no_time(dt: datetime) -> str:
     return dt.strftime("%d/%m/%Y")
 
 
-def print_flight_rows(conn: sqlite3.Connection, rows, limit):
+def print_flight_rows(records: list["db_flight_records.FlightRecord"], limit: int):
     """
-    Formats database flight rows into a table
+    Formats hydrated flight records into a table
     """
     table = [["ID", "Departure Time", "Arrival Time", "Source", "Destination", "Aircraft", "Pilot(s)"]]
 
-    for i, row in enumerate(rows):
+    for i, record in enumerate(records):
         if i == limit:
             break
 
-        pilots = list(db_pilots.get_pilots_for_flight(conn, row[0]))
+        pilots = [("[NO PILOT]" if name is None else name) for _, name in record.pilots]
         table.append([
-            str(row[0]),
-            str(dt_format(db_to_dt(row[1]))),
-            str(dt_format(db_to_dt(row[2]))),
-            db_destinations.get_destinations_from_id(conn, row[3]),
-            db_destinations.get_destinations_from_id(conn, row[4]),
-            db_aircraft.get_aircraft_from_id(conn, row[5]),
-            db_pilots.get_pilot_from_id(conn, pilots[0]) if len(pilots) > 0 else "[NO PILOTS]"
+            str(record.id),
+            str(dt_format(record.departure_time)),
+            str(dt_format(record.arrival_time)),
+            "[INVALID SOURCE]" if record.source_name is None else record.source_name,
+            "[INVALID DESTINATION]" if record.destination_name is None else record.destination_name,
+            "[INVALID AIRCRAFT]" if record.aircraft_name is None else record.aircraft_name,
+            pilots[0] if len(pilots) > 0 else "[NO PILOTS]"
         ])
 
         # Append additional pilots
-        if len(pilots) > 1:
-            for p in pilots[1:]:
-                table.append([
-                    "", "", "", "", "", "",
-                    db_pilots.get_pilot_from_id(conn, p)
-                ])
+        for p in pilots[1:]:
+            table.append(["", "", "", "", "", "", p])
 
     print_table(table)
 
@@ -244,6 +268,48 @@ def ask_commit(conn: sqlite3.Connection):
         print("Invalid input")
 
 
+def get_data_version(conn: sqlite3.Connection) -> tuple[int, int, bool]:
+    """
+    Returns a value that changes whenever the database is modified, either by this connection
+    (including uncommitted changes, and again if they are rolled back) or by a commit from another connection
+    """
+    return conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes, conn.in_transaction
+
+
+T = TypeVar("T")
+
+
+class ConnectionCache(Generic[T]):
+    """
+    A value kept for each connection until the database changes (see get_data_version). Each connection has its own,
+    as connections (such as the server's worker threads) can see different data and are used from different threads.
+    Values go with their connections, and connections that can't be weakly referenced (plain sqlite3 ones) are given
+    a new value every time
+    """
+    def __init__(self):
+        self._values: weakref.WeakKeyDictionary[sqlite3.Connection, tuple[tuple, T]] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, conn: sqlite3.Connection, make: Callable[[], T], key: Hashable = None) -> T:
+        """
+        Returns the connection's value, made again if the database has changed or the key (anything else the value
+        depends on) differs from when it was made
+        """
+        version = (get_data_version(conn), key)
+        try:
+            with self._lock:
+                cached = self._values.get(conn)
+        except TypeError:
+            return make()
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        value = make()
+        with self._lock:
+            self._values[conn] = (version, value)
+        return value
+
+
 def dt_to_db(date: datetime) -> int:
     """
     Converts a datetime object to an int with the SQLite3 DATETIME representation